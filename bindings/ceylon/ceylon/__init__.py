@@ -3,12 +3,19 @@
 #
 
 from .ceylon import version
-from .ceylon import AgentDetail, MessageHandler, \
-    EventHandler, Processor, UnifiedAgent, UnifiedAgentConfig, PeerMode
+from .ceylon import AgentDetail, InboundMessage, MessageFilter, MessageHandler, \
+    EventHandler, Processor, UnifiedAgent, UnifiedAgentConfig, PeerMode, WireFormat, TransportMode, \
+    GossipProfile, AgentDiagnostics, OverflowPolicy, QueueError, QueueStats
 from .ceylon import enable_log
+from .ceylon import configure_runtime
 from .base.agents import Admin, Worker
 from .base.uni_agent import BaseAgent
-from .base.support import AgentCommon, on, on_run, on_connect
+from .base.support import AgentCommon, MessageEnvelope, on, on_run, on_connect
+from .base.codec import Codec, register_codec, register_type_codec, register_type_tag, encode_payload, decode_payload, \
+    Compressor, CompressionStats, register_compressor
+from .base.chunking import ChunkStream, ChunkTransferError
+from .base.schema import compile_schema
+from .base.arrays import ArrayCodec
 from .static_val import *
 
 print(f"ceylon version: {version()}")
@@ -0,0 +1,116 @@
+# Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (See LICENSE.md or http://www.apache.org/licenses/LICENSE-2.0).
+"""
+Array codec for NumPy arrays and Arrow tables.
+
+An ndarray travels as a small header (dtype, shape) followed by its contiguous data, an Arrow
+``Table`` or ``RecordBatch`` as an Arrow IPC stream. The data starts at a 64 byte aligned offset
+of the payload, and receivers wrap it in an array over the received buffer instead of copying,
+so decoded arrays are read-only.
+
+Neither NumPy nor PyArrow is required; the codec only handles the types whose library imports.
+Enable it per type, e.g. ``register_type_codec(np.ndarray, "array")``.
+"""
+import ast
+import struct
+from typing import Any, Sequence
+
+from ceylon.base.codec import Codec, CodecError, register_codec
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+_NDARRAY = 0
+_ARROW_TABLE = 1
+_ARROW_BATCH = 2
+
+_ALIGNMENT = 64
+
+
+def _aligned_header(header: bytes) -> bytes:
+    # Payload offset of the data: codec id, header, padding length byte, padding
+    padding = -(1 + len(header) + 1) % _ALIGNMENT
+    return header + bytes((padding,)) + bytes(padding)
+
+
+class ArrayCodec(Codec):
+    codec_id = 0x06
+    name = "array"
+
+    def encode(self, message: Any) -> bytes:
+        return b"".join(self.encode_parts(message))
+
+    def encode_parts(self, message: Any) -> Sequence[Any]:
+        if np is not None and isinstance(message, np.ndarray):
+            return self._ndarray_parts(message)
+        if pa is not None and isinstance(message, (pa.Table, pa.RecordBatch)):
+            return self._arrow_parts(message)
+        raise CodecError(f"The array codec cannot encode {type(message).__qualname__}")
+
+    def decode(self, body: memoryview) -> Any:
+        kind = body[0]
+        if kind == _NDARRAY:
+            return self._decode_ndarray(body)
+        if kind in (_ARROW_TABLE, _ARROW_BATCH):
+            return self._decode_arrow(body, kind)
+        raise CodecError(f"Unknown array kind {kind}")
+
+    @staticmethod
+    def _ndarray_parts(array) -> Sequence[Any]:
+        if array.dtype.hasobject:
+            raise CodecError("Arrays of Python objects have no raw buffer, send them with the pickle codec")
+        if not array.flags.c_contiguous:
+            array = np.ascontiguousarray(array)
+        # The .npy descriptor, so structured dtypes keep their fields
+        dtype = repr(np.lib.format.dtype_to_descr(array.dtype)).encode()
+        header = struct.pack(f"<BH{len(dtype)}sB{array.ndim}Q", _NDARRAY, len(dtype), dtype, array.ndim,
+                             *array.shape)
+        return _aligned_header(header), array.reshape(-1).view(np.uint8)
+
+    @staticmethod
+    def _decode_ndarray(body: memoryview):
+        if np is None:
+            raise CodecError("Received an ndarray but numpy is not installed")
+        dtype_size, = struct.unpack_from("<H", body, 1)
+        pos = 3
+        dtype = np.lib.format.descr_to_dtype(ast.literal_eval(str(body[pos:pos + dtype_size], "ascii")))
+        pos += dtype_size
+        ndim = body[pos]
+        shape = struct.unpack_from(f"<{ndim}Q", body, pos + 1)
+        pos += 1 + 8 * ndim
+        pos += 1 + body[pos]
+        count = 1
+        for size in shape:
+            count *= size
+        return np.frombuffer(body, dtype=dtype, count=count, offset=pos).reshape(shape)
+
+    @staticmethod
+    def _arrow_parts(data) -> Sequence[Any]:
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, data.schema) as writer:
+            if isinstance(data, pa.Table):
+                writer.write_table(data)
+            else:
+                writer.write_batch(data)
+        kind = _ARROW_TABLE if isinstance(data, pa.Table) else _ARROW_BATCH
+        return _aligned_header(bytes((kind,))), sink.getvalue()
+
+    @staticmethod
+    def _decode_arrow(body: memoryview, kind: int):
+        if pa is None:
+            raise CodecError("Received an Arrow table but pyarrow is not installed")
+        pos = 2 + body[1]
+        reader = pa.ipc.open_stream(pa.py_buffer(body[pos:]))
+        if kind == _ARROW_TABLE:
+            return reader.read_all()
+        return reader.read_next_batch()
+
+
+register_codec(ArrayCodec())
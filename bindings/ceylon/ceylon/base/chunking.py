@@ -0,0 +1,302 @@
+# Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (See LICENSE.md or http://www.apache.org/licenses/LICENSE-2.0).
+"""
+Chunked transfer of large payloads.
+
+A sender splits an encoded payload into chunks that travel as separate messages. Every chunk
+starts with a fixed header: ``0x07``, a 16 byte transfer id, the chunk index, the chunk count,
+the total payload size and the chunk size. Receivers either reassemble the payload into one
+buffer or hand the chunks, in order, to a handler through a ``ChunkStream``.
+"""
+import asyncio
+import struct
+import time as _time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+from loguru import logger
+
+from ceylon import AgentDetail
+
+CHUNK_PAYLOAD_ID = 0x07
+_HEADER = struct.Struct("<B16sIIQI")
+_END_OF_STREAM = object()
+
+
+class ChunkTransferError(Exception):
+    pass
+
+
+def is_chunk(data: Union[bytes, memoryview], type_tag: Optional[str]) -> bool:
+    # Chunks always carry the type tag of the payload; untagged raw bytes that happen to start
+    # with 0x07 are passed through as they are
+    return type_tag is not None and len(data) >= _HEADER.size and data[0] == CHUNK_PAYLOAD_ID
+
+
+def split_payload(data: bytes, chunk_size: int) -> Iterator[bytes]:
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    transfer_id = uuid.uuid4().bytes
+    view = memoryview(data)
+    count = max(1, -(-len(view) // chunk_size))
+    for index in range(count):
+        yield _HEADER.pack(CHUNK_PAYLOAD_ID, transfer_id, index, count, len(view), chunk_size) + \
+            view[index * chunk_size:(index + 1) * chunk_size]
+
+
+class ChunkStream:
+    """
+    Chunks of one transfer in order, as an async iterator of ``memoryview`` objects. Chunks are
+    queued for the consumer as they arrive and count against the reassembly limit of the agent
+    until they are read; a consumer that falls that far behind gets a ``ChunkTransferError``.
+    Read the stream before the handler returns, the chunks left in it are dropped then.
+    """
+
+    def __init__(self, sender: AgentDetail, transfer_id: str, type_tag: Optional[str], total_size: int,
+                 chunk_count: int, release: Callable[[int], None]):
+        self.sender = sender
+        self.transfer_id = transfer_id
+        self.type_tag = type_tag
+        self.total_size = total_size
+        self.chunk_count = chunk_count
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # Gives the bytes of a chunk back to the reassembly limit once it left the queue
+        self._release = release
+        self._queued_bytes = 0
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> memoryview:
+        item = await self._queue.get()
+        if item is _END_OF_STREAM:
+            raise StopAsyncIteration
+        if isinstance(item, ChunkTransferError):
+            raise item
+        self._queued_bytes -= len(item)
+        self._release(len(item))
+        return item
+
+    async def read(self) -> bytes:
+        """Collect the remaining chunks into one buffer."""
+        return b"".join([bytes(chunk) async for chunk in self])
+
+    def _push(self, item) -> None:
+        if isinstance(item, memoryview):
+            self._queued_bytes += len(item)
+        self._queue.put_nowait(item)
+
+    def _drop_queued(self) -> None:
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._release(self._queued_bytes)
+        self._queued_bytes = 0
+
+    def _abort(self, reason: str) -> None:
+        # Drop undelivered chunks so the error is seen right away
+        self._drop_queued()
+        self._queue.put_nowait(ChunkTransferError(reason))
+
+    def _close(self) -> None:
+        """Called once the handler returned, later chunks of the transfer have no reader."""
+        self._closed = True
+        self._drop_queued()
+
+
+class _Transfer:
+    __slots__ = ("total_size", "chunk_size", "chunk_count", "received", "buffer", "stream", "pending",
+                 "pending_bytes", "next_index", "last_seen")
+
+    def __init__(self, total_size: int, chunk_size: int, chunk_count: int):
+        self.total_size = total_size
+        self.chunk_size = chunk_size
+        self.chunk_count = chunk_count
+        self.received = set()
+        self.buffer: Optional[bytearray] = None
+        self.stream: Optional[ChunkStream] = None
+        # Streams only: chunks that arrived ahead of the next one to deliver
+        self.pending: Dict[int, memoryview] = {}
+        self.pending_bytes = 0
+        self.next_index = 0
+        self.last_seen = _time.monotonic()
+
+    @property
+    def buffered_bytes(self) -> int:
+        # Chunks handed to a stream are accounted for by the stream until they are read
+        return self.total_size if self.buffer is not None else self.pending_bytes
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+
+def _valid_layout(total_size: int, chunk_size: int, count: int) -> bool:
+    return chunk_size >= 1 and count == max(1, -(-total_size // chunk_size))
+
+
+class ChunkReassembler:
+    """
+    Reassembles chunked transfers while holding at most ``max_buffered_bytes`` across all of
+    them. Buffered transfers reserve their full size up front; streams count the chunks that
+    arrived ahead of order and the chunks their consumer has not read yet. Feeding a chunk never
+    waits for a consumer. Transfers that see no chunk for ``timeout`` seconds are dropped, checked
+    on a timer while any transfer is open.
+    """
+
+    def __init__(self, stream: bool = False, max_buffered_bytes: int = 256 * 1024 * 1024, timeout: float = 60.0):
+        self.stream = stream
+        self.max_buffered_bytes = max_buffered_bytes
+        self.timeout = timeout
+        self._transfers: "OrderedDict[Tuple[str, bytes], _Transfer]" = OrderedDict()
+        self._rejected: "OrderedDict[Tuple[str, bytes], None]" = OrderedDict()
+        self._buffered_bytes = 0
+        self._expiry: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def buffered_bytes(self) -> int:
+        return self._buffered_bytes
+
+    def active_transfers(self) -> int:
+        return len(self._transfers)
+
+    def feed(self, sender: AgentDetail, data: Union[bytes, memoryview], type_tag: Optional[str] = None,
+             stream: Optional[bool] = None) -> Union[bytearray, ChunkStream, None]:
+        """
+        Add one chunk. Returns the complete payload when a buffered transfer finishes, a new
+        ``ChunkStream`` when a streamed transfer starts, and ``None`` otherwise. ``stream``
+        overrides the delivery mode of a transfer this chunk starts.
+        """
+        view = memoryview(data)
+        _, transfer_id, index, count, total_size, chunk_size = _HEADER.unpack_from(view)
+        body = view[_HEADER.size:]
+        key = (sender.id, transfer_id)
+        self._expire()
+        if key in self._rejected:
+            return None
+
+        transfer = self._transfers.get(key)
+        started = None
+        if transfer is None:
+            if not _valid_layout(total_size, chunk_size, count):
+                self._reject(key, f"inconsistent header, {count} chunks of {chunk_size} bytes for {total_size} bytes")
+                return None
+            transfer = self._start(key, sender, transfer_id, type_tag, total_size, chunk_size, count,
+                                   self.stream if stream is None else stream)
+            if transfer is None:
+                return None
+            started = transfer.stream
+        elif (total_size, chunk_size, count) != (transfer.total_size, transfer.chunk_size, transfer.chunk_count):
+            self._abort(key, f"chunk {index} does not match the header of the transfer")
+            return None
+        transfer.last_seen = _time.monotonic()
+
+        if index >= transfer.chunk_count or index in transfer.received:
+            return started
+        if len(body) != transfer.chunk_length(index):
+            self._abort(key, f"chunk {index} has {len(body)} bytes, expected {transfer.chunk_length(index)}")
+            return started
+        if transfer.stream is None:
+            return self._fill(key, transfer, index, body)
+        self._deliver(key, transfer, index, body)
+        return started
+
+    def _start(self, key, sender, transfer_id, type_tag, total_size, chunk_size, count,
+               stream: bool) -> Optional[_Transfer]:
+        transfer = _Transfer(total_size, chunk_size, count)
+        if stream:
+            transfer.stream = ChunkStream(sender, transfer_id.hex(), type_tag, total_size, count, self._release)
+        else:
+            if not self._reserve(total_size):
+                self._reject(key, f"{total_size} bytes would exceed the reassembly limit")
+                return None
+            transfer.buffer = bytearray(total_size)
+        self._transfers[key] = transfer
+        self._schedule_expiry()
+        return transfer
+
+    def _fill(self, key, transfer: _Transfer, index: int, body: memoryview) -> Optional[bytearray]:
+        # Slice assignment resizes a bytearray, anything out of place would grow or shift the payload
+        if not 0 <= index < transfer.chunk_count or len(body) != transfer.chunk_length(index):
+            self._abort(key, f"chunk {index} of {len(body)} bytes does not fit the transfer")
+            return None
+        offset = index * transfer.chunk_size
+        transfer.buffer[offset:offset + len(body)] = body
+        transfer.received.add(index)
+        if len(transfer.received) < transfer.chunk_count:
+            return None
+        self._finish(key)
+        return transfer.buffer
+
+    def _deliver(self, key, transfer: _Transfer, index: int, body: memoryview) -> None:
+        if transfer.stream._closed:
+            self._abort(key, "the handler stopped reading the stream")
+            return
+        # Both chunks ahead of order and chunks waiting for the consumer hold memory
+        if not self._reserve(len(body)):
+            self._abort(key, "the stream fell behind by more than the reassembly limit")
+            return
+        transfer.received.add(index)
+        if index != transfer.next_index:
+            transfer.pending[index] = body
+            transfer.pending_bytes += len(body)
+            return
+        transfer.stream._push(body)
+        transfer.next_index += 1
+        while transfer.next_index in transfer.pending:
+            # Already reserved, the stream takes the reservation over
+            chunk = transfer.pending.pop(transfer.next_index)
+            transfer.pending_bytes -= len(chunk)
+            transfer.stream._push(chunk)
+            transfer.next_index += 1
+        if transfer.next_index == transfer.chunk_count:
+            self._finish(key)
+            transfer.stream._push(_END_OF_STREAM)
+
+    def _reserve(self, size: int) -> bool:
+        if self._buffered_bytes + size > self.max_buffered_bytes:
+            return False
+        self._buffered_bytes += size
+        return True
+
+    def _release(self, size: int) -> None:
+        self._buffered_bytes -= size
+
+    def _finish(self, key) -> Optional[_Transfer]:
+        transfer = self._transfers.pop(key, None)
+        if transfer is not None:
+            self._buffered_bytes -= transfer.buffered_bytes
+        return transfer
+
+    def _reject(self, key, reason: str) -> None:
+        logger.warning(f"Dropping chunked transfer {key[1].hex()} from {key[0]}: {reason}")
+        self._rejected[key] = None
+        while len(self._rejected) > 1024:
+            self._rejected.popitem(last=False)
+
+    def _abort(self, key, reason: str) -> None:
+        transfer = self._finish(key)
+        self._reject(key, reason)
+        if transfer is not None and transfer.stream is not None:
+            transfer.stream._abort(reason)
+
+    def _expire(self) -> None:
+        deadline = _time.monotonic() - self.timeout
+        for key in [key for key, transfer in self._transfers.items() if transfer.last_seen < deadline]:
+            self._abort(key, "timed out waiting for chunks")
+
+    def _schedule_expiry(self) -> None:
+        # Stalled transfers expire even when no further chunk arrives to notice them
+        if self._expiry is not None or not self._transfers:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Fed outside an event loop, transfers then only expire when the next chunk arrives
+            return
+        self._expiry = loop.call_later(self.timeout / 2, self._on_expiry)
+
+    def _on_expiry(self) -> None:
+        self._expiry = None
+        self._expire()
+        self._schedule_expiry()
@@ -0,0 +1,439 @@
+# Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (See LICENSE.md or http://www.apache.org/licenses/LICENSE-2.0).
+"""
+Payload codecs for agent messages.
+
+Every encoded payload starts with a one byte codec id followed by the codec's body. Pickle is the
+exception: its payloads are plain pickles, which always start with the PROTO opcode ``0x80``, so
+they stay readable by agents that call ``pickle.loads`` on the raw bytes. Payloads starting with any
+other byte that is not a registered codec id are rejected, e.g. msgpack payloads at an agent without
+msgpack installed.
+
+Codecs receive the body as a read-only ``memoryview`` of the received payload, so stripping the
+codec id never copies it.
+
+An encoded payload above the sender's compression threshold may be wrapped in a compressed frame:
+``0x04``, one byte compressor id, then the compressed payload. Receivers unwrap it before decoding.
+"""
+import dataclasses
+import enum
+import json
+import pickle
+import typing
+import zlib
+from typing import Any, Dict, Iterator, Optional, Sequence, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+from ceylon.base.chunking import CHUNK_PAYLOAD_ID
+
+PICKLE_CODEC_ID = 0x80
+COMPRESSED_PAYLOAD_ID = 0x04
+_RESERVED_IDS = {COMPRESSED_PAYLOAD_ID: "compressed payloads", CHUNK_PAYLOAD_ID: "chunked transfers"}
+
+# Type tags name message types independently of the codec, so receivers can route a message
+# before decoding it.
+_type_tags: Dict[type, str] = {}
+_tagged_types: Dict[str, type] = {}
+
+
+def register_type_tag(message_type: type, tag: Optional[str] = None) -> str:
+    """
+    Tag ``message_type`` with ``tag``, or with its qualified class name when no tag is given.
+    Short tags keep the envelope compact but have to be registered the same way on every agent.
+    The dataclasses and enums in the fields of a dataclass are tagged along with it.
+    """
+    if tag is None:
+        tag = f"{message_type.__module__}.{message_type.__qualname__}"
+    previous = _type_tags.get(message_type)
+    if previous is not None and previous != tag:
+        _tagged_types.pop(previous, None)
+    _type_tags[message_type] = tag
+    _tagged_types[tag] = message_type
+    tag_field_types(message_type)
+    return tag
+
+
+def type_tag(message_type: type) -> str:
+    tag = _type_tags.get(message_type)
+    return tag if tag is not None else register_type_tag(message_type)
+
+
+def tagged_type(tag: str) -> Optional[type]:
+    return _tagged_types.get(tag)
+
+
+def tag_field_types(message_type: type, hints: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Tag the dataclasses and enums the fields of a dataclass refer to, also inside ``Optional``,
+    ``List`` and the like. A receiver that only registered the outer type needs them to decode it.
+    """
+    if not dataclasses.is_dataclass(message_type):
+        return
+    if hints is None:
+        try:
+            hints = typing.get_type_hints(message_type)
+        except Exception:
+            # Unresolvable forward references, the nested types have to be registered by hand
+            return
+    for field in dataclasses.fields(message_type):
+        for nested in _referenced_types(hints.get(field.name)):
+            if nested not in _type_tags:
+                type_tag(nested)
+
+
+def _referenced_types(hint: Any) -> Iterator[type]:
+    if isinstance(hint, type) and (issubclass(hint, enum.Enum) or dataclasses.is_dataclass(hint)):
+        yield hint
+        return
+    for arg in typing.get_args(hint):
+        yield from _referenced_types(arg)
+
+
+class CodecError(ValueError):
+    pass
+
+
+class Codec:
+    codec_id: int
+    name: str
+
+    def encode(self, message: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, body: memoryview) -> Any:
+        raise NotImplementedError
+
+    def encode_parts(self, message: Any) -> Sequence[Any]:
+        """The body as buffers to concatenate, lets large bodies skip an intermediate copy."""
+        return (self.encode(message),)
+
+
+class PickleCodec(Codec):
+    codec_id = PICKLE_CODEC_ID
+    name = "pickle"
+
+    def encode(self, message: Any) -> bytes:
+        return pickle.dumps(message)
+
+    def decode(self, body: memoryview) -> Any:
+        return pickle.loads(body)
+
+
+class JsonCodec(Codec):
+    codec_id = 0x01
+    name = "json"
+
+    def encode(self, message: Any) -> bytes:
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    def decode(self, body: memoryview) -> Any:
+        return json.loads(str(body, "utf-8"))
+
+
+class MsgpackCodec(Codec):
+    codec_id = 0x02
+    name = "msgpack"
+
+    def encode(self, message: Any) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, body: memoryview) -> Any:
+        return msgpack.unpackb(body, raw=False)
+
+
+class DataclassCodec(Codec):
+    """
+    Dataclasses as a JSON array of field values instead of a pickle of the instance. Nested
+    dataclasses and enums are tagged with their type tag; all other values must be JSON types.
+    """
+    codec_id = 0x03
+    name = "dataclass"
+
+    def encode(self, message: Any) -> bytes:
+        return json.dumps(self._pack(message), separators=(",", ":")).encode()
+
+    def decode(self, body: memoryview) -> Any:
+        return self._unpack(json.loads(str(body, "utf-8")))
+
+    def _pack(self, value: Any) -> Any:
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return {"$d": type_tag(type(value)),
+                    "f": [self._pack(getattr(value, f.name)) for f in dataclasses.fields(value) if f.init]}
+        if isinstance(value, enum.Enum):
+            return {"$e": type_tag(type(value)), "v": value.value}
+        if isinstance(value, (list, tuple)):
+            return [self._pack(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self._pack(item) for key, item in value.items()}
+        return value
+
+    def _unpack(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._unpack(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if "$d" in value:
+            cls = self._resolve(value["$d"])
+            # Keywords, so kw_only fields are accepted as well
+            names = [f.name for f in dataclasses.fields(cls) if f.init]
+            if len(names) != len(value["f"]):
+                raise CodecError(f"{cls.__qualname__} has {len(names)} fields here but {len(value['f'])} at the sender")
+            return cls(**{name: self._unpack(item) for name, item in zip(names, value["f"])})
+        if "$e" in value:
+            return self._resolve(value["$e"])(value["v"])
+        return {key: self._unpack(item) for key, item in value.items()}
+
+    @staticmethod
+    def _resolve(tag: str) -> type:
+        cls = tagged_type(tag)
+        if cls is None:
+            raise CodecError(f"Unknown message type {tag!r}, register it with register_type_tag")
+        return cls
+
+
+_codecs: Dict[str, Codec] = {}
+_codecs_by_id: Dict[int, Codec] = {}
+_type_codecs: Dict[type, Codec] = {}
+
+
+def register_codec(codec: Codec) -> Codec:
+    if codec.codec_id in _RESERVED_IDS:
+        raise CodecError(f"Codec id {codec.codec_id:#04x} is reserved for {_RESERVED_IDS[codec.codec_id]}")
+    existing = _codecs_by_id.get(codec.codec_id)
+    if existing is not None and existing.name != codec.name:
+        raise CodecError(f"Codec id {codec.codec_id:#04x} is already used by {existing.name!r}")
+    _codecs[codec.name] = codec
+    _codecs_by_id[codec.codec_id] = codec
+    return codec
+
+
+def get_codec(codec: Union[str, Codec, None] = None) -> Codec:
+    if codec is None:
+        return _codecs["pickle"]
+    if isinstance(codec, Codec):
+        return codec
+    try:
+        return _codecs[codec]
+    except KeyError:
+        raise CodecError(f"Unknown codec {codec!r}") from None
+
+
+def register_type_codec(message_type: type, codec: Union[str, Codec]) -> None:
+    """
+    Always encode ``message_type`` and its subclasses with ``codec``, whatever the sending
+    agent's default is. The codec registered for the nearest class in the MRO wins.
+    """
+    _type_codecs[message_type] = get_codec(codec)
+    type_tag(message_type)
+
+
+def _type_codec(message_type: type) -> Optional[Codec]:
+    for cls in message_type.__mro__:
+        codec = _type_codecs.get(cls)
+        if codec is not None:
+            return codec
+    return None
+
+
+def encode_payload(message: Any, codec: Union[str, Codec, None] = None) -> bytes:
+    selected = _type_codec(type(message)) or get_codec(codec)
+    if selected.codec_id == PICKLE_CODEC_ID:
+        return selected.encode(message)
+    return b"".join((bytes((selected.codec_id,)), *selected.encode_parts(message)))
+
+
+def decode_payload(data: Union[bytes, memoryview]) -> Any:
+    view = memoryview(data)
+    if not view:
+        raise CodecError("Empty payload")
+    if view[0] == COMPRESSED_PAYLOAD_ID:
+        return decode_payload(decompress_payload(view))
+    if view[0] == CHUNK_PAYLOAD_ID:
+        raise CodecError("Payload is a single chunk of a chunked transfer")
+    if view[0] == PICKLE_CODEC_ID:
+        return pickle.loads(view)
+    codec = _codecs_by_id.get(view[0])
+    if codec is None:
+        raise CodecError(f"Unknown codec id {view[0]:#04x}")
+    return codec.decode(view[1:])
+
+
+# Largest payload a compressed frame may expand to, so a small hostile frame can not take all
+# memory. Larger payloads are sent as chunked transfers anyway.
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+
+
+class Compressor:
+    compressor_id: int
+    name: str
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, body: memoryview, max_size: int) -> bytes:
+        """Decompress ``body``, raising ``CodecError`` instead of producing more than ``max_size`` bytes."""
+        raise NotImplementedError
+
+
+def _too_large(name: str, max_size: int) -> CodecError:
+    return CodecError(f"{name} payload expands to more than {max_size} bytes")
+
+
+class ZlibCompressor(Compressor):
+    compressor_id = 0x01
+    name = "zlib"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, body: memoryview, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(body, max_size + 1)
+        if len(data) > max_size:
+            raise _too_large(self.name, max_size)
+        if not decompressor.eof:
+            raise CodecError("Truncated zlib payload")
+        return data
+
+
+class ZstdCompressor(Compressor):
+    compressor_id = 0x02
+    name = "zstd"
+
+    def __init__(self, level: int = 3):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, body: memoryview, max_size: int) -> bytes:
+        try:
+            # The output buffer is sized from the frame header when it has the content size
+            if zstandard.frame_content_size(body) > max_size:
+                raise _too_large(self.name, max_size)
+            return self._decompressor.decompress(body, max_output_size=max_size)
+        except zstandard.ZstdError as e:
+            raise CodecError(f"Invalid zstd payload: {e}") from None
+
+
+class Lz4Compressor(Compressor):
+    compressor_id = 0x03
+    name = "lz4"
+
+    def compress(self, data: bytes) -> bytes:
+        return lz4_frame.compress(data)
+
+    def decompress(self, body: memoryview, max_size: int) -> bytes:
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+        data = decompressor.decompress(body, max_length=max_size + 1)
+        if len(data) > max_size:
+            raise _too_large(self.name, max_size)
+        if not decompressor.eof:
+            raise CodecError("Truncated lz4 payload")
+        return data
+
+
+class CompressionStats:
+    """Payload sizes an agent sent before and after compression."""
+
+    def __init__(self):
+        self.payloads = 0
+        self.compressed_payloads = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    @property
+    def ratio(self) -> float:
+        """Raw size over sent size, 1.0 until something was compressed."""
+        return self.raw_bytes / self.sent_bytes if self.sent_bytes else 1.0
+
+    def record(self, raw_size: int, sent_size: int) -> None:
+        self.payloads += 1
+        self.raw_bytes += raw_size
+        self.sent_bytes += sent_size
+        if sent_size < raw_size:
+            self.compressed_payloads += 1
+
+    def __repr__(self):
+        return (f"CompressionStats(payloads={self.payloads}, compressed_payloads={self.compressed_payloads}, "
+                f"raw_bytes={self.raw_bytes}, sent_bytes={self.sent_bytes}, ratio={self.ratio:.2f})")
+
+
+_compressors: Dict[str, Compressor] = {}
+_compressors_by_id: Dict[int, Compressor] = {}
+
+
+def register_compressor(compressor: Compressor) -> Compressor:
+    existing = _compressors_by_id.get(compressor.compressor_id)
+    if existing is not None and existing.name != compressor.name:
+        raise CodecError(f"Compressor id {compressor.compressor_id:#04x} is already used by {existing.name!r}")
+    _compressors[compressor.name] = compressor
+    _compressors_by_id[compressor.compressor_id] = compressor
+    return compressor
+
+
+def get_compressor(compressor: Union[str, Compressor]) -> Compressor:
+    if isinstance(compressor, Compressor):
+        return compressor
+    try:
+        return _compressors[compressor]
+    except KeyError:
+        raise CodecError(f"Unknown or unavailable compressor {compressor!r}") from None
+
+
+def compress_payload(data: bytes, compressor: Union[str, Compressor, None], threshold: int = 0,
+                     stats: Optional[CompressionStats] = None) -> bytes:
+    """
+    Wrap an encoded payload in a compressed frame when it is at least ``threshold`` bytes and
+    compression actually makes it smaller.
+    """
+    sent = data
+    if compressor is not None and len(data) >= threshold:
+        selected = get_compressor(compressor)
+        body = selected.compress(data)
+        if len(body) + 2 < len(data):
+            sent = bytes((COMPRESSED_PAYLOAD_ID, selected.compressor_id)) + body
+    if stats is not None:
+        stats.record(len(data), len(sent))
+    return sent
+
+
+def decompress_payload(data: Union[bytes, memoryview], max_size: int = MAX_DECOMPRESSED_SIZE) -> bytes:
+    view = memoryview(data)
+    if len(view) < 2 or view[0] != COMPRESSED_PAYLOAD_ID:
+        raise CodecError("Not a compressed payload")
+    compressor = _compressors_by_id.get(view[1])
+    if compressor is None:
+        raise CodecError(f"Payload compressed with unavailable compressor id {view[1]:#04x}")
+    return compressor.decompress(view[2:], max_size)
+
+
+register_codec(PickleCodec())
+register_codec(JsonCodec())
+register_codec(DataclassCodec())
+if msgpack is not None:
+    register_codec(MsgpackCodec())
+
+register_compressor(ZlibCompressor())
+if zstandard is not None:
+    register_compressor(ZstdCompressor())
+if lz4_frame is not None:
+    register_compressor(Lz4Compressor())
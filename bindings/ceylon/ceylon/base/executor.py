@@ -0,0 +1,103 @@
+# Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (See LICENSE.md or http://www.apache.org/licenses/LICENSE-2.0).
+import asyncio
+import traceback
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from loguru import logger
+
+Job = Callable[[], Awaitable[None]]
+
+
+class _KeyQueue:
+    __slots__ = ("jobs", "slots", "worker", "pending", "high_water")
+
+    def __init__(self, max_queue_size: int):
+        self.jobs: Deque[Job] = deque()
+        self.slots = asyncio.Semaphore(max_queue_size)
+        self.worker: Optional[asyncio.Task] = None
+        # Submitters that hold or wait for a slot but have not queued their job yet
+        self.pending = 0
+        self.high_water = 0
+
+
+class KeyedExecutor:
+    """
+    Runs jobs concurrently across keys while keeping FIFO order within a key.
+
+    Every key owns a queue of at most ``max_queue_size`` jobs (queued plus running); ``submit``
+    waits while that queue is full. A key's worker task only lives while its queue has work.
+    """
+
+    def __init__(self, max_queue_size: int = 1024):
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size must be at least 1")
+        self.max_queue_size = max_queue_size
+        self._queues: Dict[Hashable, _KeyQueue] = {}
+        # Deepest any key's queue has been, kept after the key went idle
+        self.peak_depth = 0
+
+    async def submit(self, key: Hashable, job: Job) -> None:
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _KeyQueue(self.max_queue_size)
+        queue.pending += 1
+        try:
+            await queue.slots.acquire()
+        except BaseException:
+            queue.pending -= 1
+            self._discard_if_idle(key, queue)
+            raise
+        queue.pending -= 1
+        queue.jobs.append(job)
+        queue.high_water = max(queue.high_water, self._depth(queue))
+        self.peak_depth = max(self.peak_depth, queue.high_water)
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self._drain(key, queue))
+
+    async def _drain(self, key: Hashable, queue: _KeyQueue) -> None:
+        try:
+            while queue.jobs:
+                job = queue.jobs[0]
+                try:
+                    await job()
+                except Exception as e:
+                    traceback.print_exc()
+                    logger.error(f"Error processing message for {key}: {e}")
+                finally:
+                    queue.jobs.popleft()
+                    queue.slots.release()
+        finally:
+            queue.worker = None
+            self._discard_if_idle(key, queue)
+
+    def _discard_if_idle(self, key: Hashable, queue: _KeyQueue) -> None:
+        if not queue.jobs and queue.pending == 0 and queue.worker is None and self._queues.get(key) is queue:
+            del self._queues[key]
+
+    @staticmethod
+    def _depth(queue: _KeyQueue) -> int:
+        return len(queue.jobs)
+
+    def queue_depth(self, key: Hashable) -> int:
+        """Jobs queued or running for ``key``."""
+        queue = self._queues.get(key)
+        return self._depth(queue) if queue else 0
+
+    def queue_depths(self) -> Dict[Hashable, int]:
+        return {key: self._depth(queue) for key, queue in self._queues.items()}
+
+    def high_water_mark(self, key: Hashable) -> int:
+        """Deepest the queue of ``key`` has been since it became active."""
+        queue = self._queues.get(key)
+        return queue.high_water if queue else 0
+
+    async def join(self) -> None:
+        """Wait until every queued job has run."""
+        while self._queues:
+            workers = [queue.worker for queue in self._queues.values() if queue.worker is not None]
+            if not workers:
+                await asyncio.sleep(0)
+                continue
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,374 @@
+# Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+# Licensed under the Apache License, Version 2.0 (See LICENSE.md or http://www.apache.org/licenses/LICENSE-2.0).
+"""
+Schema-compiled binary codec for dataclass messages.
+
+The first time a dataclass is encoded or decoded, its ``init`` fields and type hints are read and
+an encoder and a decoder are generated for it, the same way ``dataclasses`` generates
+``__init__``. Encoded dataclasses carry their field values in declaration order, without names.
+
+Body layout: the type tags used by the message (count, then each tag), followed by one value.
+Every value starts with a one byte kind. Enums and dataclasses refer to the tag table by index,
+so a tag is sent once per message however often the type occurs. Values of types the codec has
+no kind for are pickled.
+"""
+import dataclasses
+import enum
+import pickle
+import struct
+import typing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from ceylon.base.codec import Codec, CodecError, register_codec, tag_field_types, tagged_type, type_tag
+
+K_NONE = 0
+K_FALSE = 1
+K_TRUE = 2
+K_INT = 3
+K_FLOAT = 4
+K_STR = 5
+K_BYTES = 6
+K_LIST = 7
+K_TUPLE = 8
+K_SET = 9
+K_DICT = 10
+K_ENUM = 11
+K_DATACLASS = 12
+K_PICKLE = 13
+
+_DOUBLE = struct.Struct("<d")
+
+
+class _Encoder:
+    __slots__ = ("out", "tags")
+
+    def __init__(self):
+        self.out = bytearray()
+        self.tags: Dict[str, int] = {}
+
+    def varint(self, value: int) -> None:
+        out = self.out
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def text(self, value: str) -> None:
+        data = value.encode()
+        self.varint(len(data))
+        self.out += data
+
+    def tag_index(self, message_type: type) -> int:
+        tag = type_tag(message_type)
+        index = self.tags.get(tag)
+        if index is None:
+            index = self.tags[tag] = len(self.tags)
+        return index
+
+    def finish(self) -> bytes:
+        header = _Encoder()
+        header.varint(len(self.tags))
+        for tag in self.tags:
+            header.text(tag)
+        header.out += self.out
+        return header.out
+
+
+class _Decoder:
+    __slots__ = ("buf", "pos", "types")
+
+    def __init__(self, buf: memoryview):
+        self.buf = buf
+        self.pos = 0
+        self.types: List[type] = []
+        for _ in range(self.varint()):
+            tag = self.text()
+            message_type = tagged_type(tag)
+            if message_type is None:
+                raise CodecError(f"Unknown message type {tag!r}, register it with register_type_tag")
+            self.types.append(message_type)
+
+    def varint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.buf[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def raw(self) -> memoryview:
+        size = self.varint()
+        start = self.pos
+        self.pos += size
+        if self.pos > len(self.buf):
+            raise CodecError("Schema payload ended unexpectedly")
+        return self.buf[start:self.pos]
+
+    def text(self) -> str:
+        return str(self.raw(), "utf-8")
+
+    def value(self) -> Any:
+        kind = self.buf[self.pos]
+        self.pos += 1
+        if kind >= len(_READERS):
+            raise CodecError(f"Unknown value kind {kind}")
+        return _READERS[kind](self)
+
+
+# Encoders of individual values. The typed ones are picked per field from its type hint and take
+# a fast path when the value has exactly that type; anything else goes through write_any.
+
+def write_any(enc: _Encoder, value: Any) -> None:
+    writer = _WRITERS.get(value.__class__)
+    if writer is not None:
+        writer(enc, value)
+    elif isinstance(value, enum.Enum):
+        write_enum(enc, value)
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        write_dataclass(enc, value)
+    else:
+        data = pickle.dumps(value)
+        enc.out.append(K_PICKLE)
+        enc.varint(len(data))
+        enc.out += data
+
+
+def write_none(enc: _Encoder, value: None) -> None:
+    enc.out.append(K_NONE)
+
+
+def write_bool(enc: _Encoder, value: bool) -> None:
+    enc.out.append(K_TRUE if value else K_FALSE)
+
+
+def write_int(enc: _Encoder, value: int) -> None:
+    if value.__class__ is not int:
+        return write_any(enc, value)
+    enc.out.append(K_INT)
+    # Zigzag, so small negative numbers stay short; Python ints have no fixed width
+    enc.varint(value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def write_float(enc: _Encoder, value: float) -> None:
+    if value.__class__ is not float:
+        return write_any(enc, value)
+    enc.out.append(K_FLOAT)
+    enc.out += _DOUBLE.pack(value)
+
+
+def write_str(enc: _Encoder, value: str) -> None:
+    if value.__class__ is not str:
+        return write_any(enc, value)
+    enc.out.append(K_STR)
+    enc.text(value)
+
+
+def write_bytes(enc: _Encoder, value: bytes) -> None:
+    if value.__class__ is not bytes:
+        return write_any(enc, value)
+    enc.out.append(K_BYTES)
+    enc.varint(len(value))
+    enc.out += value
+
+
+def _sequence_writer(kind: int) -> Callable[[_Encoder, Any], None]:
+    def write(enc: _Encoder, value) -> None:
+        enc.out.append(kind)
+        enc.varint(len(value))
+        for item in value:
+            write_any(enc, item)
+
+    return write
+
+
+def write_dict(enc: _Encoder, value: dict) -> None:
+    enc.out.append(K_DICT)
+    enc.varint(len(value))
+    for key, item in value.items():
+        write_any(enc, key)
+        write_any(enc, item)
+
+
+def write_enum(enc: _Encoder, value: enum.Enum) -> None:
+    enc.out.append(K_ENUM)
+    enc.varint(enc.tag_index(value.__class__))
+    write_any(enc, value.value)
+
+
+def write_dataclass(enc: _Encoder, value: Any) -> None:
+    schema = compile_schema(value.__class__)
+    enc.out.append(K_DATACLASS)
+    enc.varint(enc.tag_index(value.__class__))
+    enc.varint(schema.field_count)
+    schema.encode(enc, value)
+
+
+_WRITERS: Dict[type, Callable[[_Encoder, Any], None]] = {
+    type(None): write_none,
+    bool: write_bool,
+    int: write_int,
+    float: write_float,
+    str: write_str,
+    bytes: write_bytes,
+    list: _sequence_writer(K_LIST),
+    tuple: _sequence_writer(K_TUPLE),
+    set: _sequence_writer(K_SET),
+    frozenset: _sequence_writer(K_SET),
+    dict: write_dict,
+}
+
+
+def _typed_writer(message_type: type) -> Callable[[_Encoder, Any], None]:
+    write_typed = write_enum if issubclass(message_type, enum.Enum) else write_dataclass
+
+    def write(enc: _Encoder, value: Any) -> None:
+        if value.__class__ is message_type:
+            write_typed(enc, value)
+        else:
+            write_any(enc, value)
+
+    return write
+
+
+def _field_writer(hint: Any) -> Callable[[_Encoder, Any], None]:
+    # Optional[X] encodes like X, None takes the generic path
+    args = [arg for arg in typing.get_args(hint) if arg is not type(None)]
+    if typing.get_origin(hint) is typing.Union and len(args) == 1:
+        hint = args[0]
+    if hint in (str, int, float, bytes):
+        return _WRITERS[hint]
+    if isinstance(hint, type) and (issubclass(hint, enum.Enum) or dataclasses.is_dataclass(hint)):
+        return _typed_writer(hint)
+    return write_any
+
+
+# Decoders, indexed by kind
+
+def _read_int(dec: _Decoder) -> int:
+    value = dec.varint()
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _read_float(dec: _Decoder) -> float:
+    value, = _DOUBLE.unpack_from(dec.buf, dec.pos)
+    dec.pos += 8
+    return value
+
+
+def _read_list(dec: _Decoder) -> list:
+    return [dec.value() for _ in range(dec.varint())]
+
+
+def _read_dict(dec: _Decoder) -> dict:
+    return {dec.value(): dec.value() for _ in range(dec.varint())}
+
+
+def _read_enum(dec: _Decoder) -> enum.Enum:
+    enum_type = dec.types[dec.varint()]
+    return enum_type(dec.value())
+
+
+def _read_dataclass(dec: _Decoder) -> Any:
+    schema = compile_schema(dec.types[dec.varint()])
+    field_count = dec.varint()
+    if field_count != schema.field_count:
+        raise CodecError(f"{schema.message_type.__qualname__} has {schema.field_count} fields here but "
+                         f"{field_count} at the sender")
+    return schema.decode(dec)
+
+
+def _read_pickle(dec: _Decoder) -> Any:
+    return pickle.loads(dec.raw())
+
+
+_READERS: Tuple[Callable[[_Decoder], Any], ...] = (
+    lambda dec: None,
+    lambda dec: False,
+    lambda dec: True,
+    _read_int,
+    _read_float,
+    lambda dec: dec.text(),
+    lambda dec: bytes(dec.raw()),
+    _read_list,
+    lambda dec: tuple(_read_list(dec)),
+    lambda dec: set(_read_list(dec)),
+    _read_dict,
+    _read_enum,
+    _read_dataclass,
+    _read_pickle,
+)
+
+
+class Schema:
+    """Generated encoder and decoder of one dataclass."""
+
+    def __init__(self, message_type: type):
+        if not dataclasses.is_dataclass(message_type):
+            raise CodecError(f"{message_type!r} is not a dataclass")
+        self.message_type = message_type
+        fields = [f for f in dataclasses.fields(message_type) if f.init]
+        try:
+            hints = typing.get_type_hints(message_type)
+        except Exception as e:
+            # Unresolvable forward references, fall back to the generic writer for every field
+            logger.warning(f"Type hints of {message_type.__qualname__} can not be resolved ({e}), its schema "
+                           f"encodes every field as a tagged value, pickling the ones of unknown types")
+            hints = {}
+        self.hints = hints
+        self.field_names = tuple(f.name for f in fields)
+        self.field_count = len(fields)
+        writers = {f"_w{i}": _field_writer(hints.get(f.name, Any)) for i, f in enumerate(fields)}
+
+        encode_lines = [f"  _w{i}(enc, obj.{f.name})" for i, f in enumerate(fields)] or ["  pass"]
+        # Keywords, so kw_only fields are accepted as well
+        decode_args = ", ".join(f"{f.name}=read()" for f in fields)
+        source = "\n".join([
+            "def encode(enc, obj):",
+            *encode_lines,
+            "def decode(dec):",
+            "  read = dec.value",
+            f"  return cls({decode_args})",
+        ])
+        namespace: Dict[str, Any] = {}
+        exec(source, {"cls": message_type, **writers}, namespace)
+        self.encode: Callable[[_Encoder, Any], None] = namespace["encode"]
+        self.decode: Callable[[_Decoder], Any] = namespace["decode"]
+
+
+_schemas: Dict[type, Schema] = {}
+
+
+def compile_schema(message_type: type) -> Schema:
+    """
+    Generate, or return the cached, schema of a dataclass and register its type tag, along with
+    the tags of the dataclasses and enums its fields refer to.
+    """
+    schema = _schemas.get(message_type)
+    if schema is None:
+        schema = _schemas[message_type] = Schema(message_type)
+        type_tag(message_type)
+        tag_field_types(message_type, schema.hints)
+    return schema
+
+
+class SchemaCodec(Codec):
+    codec_id = 0x05
+    name = "schema"
+
+    def encode(self, message: Any) -> bytes:
+        enc = _Encoder()
+        write_any(enc, message)
+        return enc.finish()
+
+    def decode(self, body: memoryview) -> Any:
+        try:
+            return _Decoder(body).value()
+        except (IndexError, struct.error):
+            raise CodecError("Schema payload ended unexpectedly") from None
+
+
+register_codec(SchemaCodec())
@@ -1,24 +1,60 @@
 # Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
 # Licensed under the Apache License, Version 2.0 (See LICENSE.md or http://www.apache.org/licenses/LICENSE-2.0).
 import asyncio
+import dataclasses
 import inspect
-import pickle
+import time as _time
 import traceback
-from typing import Dict, Callable, Optional, Any
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, Callable, Optional, Any, List, NamedTuple, Tuple, Hashable, Union
 from loguru import logger
 
 from ceylon import AgentDetail
+from ceylon.base.chunking import ChunkReassembler, ChunkStream, is_chunk
+from ceylon.base.codec import Codec, decode_payload, register_type_codec, register_type_tag, tagged_type, type_tag
+from ceylon.base.executor import KeyedExecutor
+from ceylon.base.schema import compile_schema
 
 message_handlers: Dict[str, Callable] = {}
 run_handlers: Dict[str, Callable] = {}
 connect_handlers: Dict[str, Dict[str, Callable]] = {}
 
-
-def on(type):
+# Same registrations as ``message_handlers`` keyed by class name and then by the message type itself,
+# so the dispatch tables can be compiled without parsing the string keys.
+typed_message_handlers: Dict[str, Dict[type, Callable]] = {}
+
+# Compiled per agent class, dropped whenever a decorator registers a new handler.
+_handler_tables: Dict[type, "HandlerTable"] = {}
+
+def _register_message_type(message_type: type, codec: Union[str, Codec, None], tag: Optional[str] = None) -> None:
+    if tag is not None:
+        register_type_tag(message_type, tag)
+    else:
+        type_tag(message_type)
+    if dataclasses.is_dataclass(message_type):
+        compile_schema(message_type)
+    if codec is not None:
+        register_type_codec(message_type, codec)
+
+
+def on(type, codec: Union[str, Codec, None] = None, tag: Optional[str] = None):
+    """
+    Register the decorated method as handler of ``type`` messages. With ``codec``, every agent in
+    this process also sends ``type`` messages with that codec, e.g. ``@on(TaskRequest, codec="schema")``.
+
+    Messages are routed by type tag, by default ``module.QualName`` of the type. Sender and receiver
+    therefore have to import the type from the same module; a type defined in a script run as
+    ``__main__`` on one side does not match. Pass ``tag`` to name the type independently of where it
+    is defined, the same on every agent.
+    """
     def decorator(method):
         class_name = method.__qualname__.split(".")[0]
         method_key = f"{class_name}.{type}"
         message_handlers[method_key] = method
+        typed_message_handlers.setdefault(class_name, {})[type] = method
+        _register_message_type(type, codec, tag)
+        _handler_tables.clear()
         return method
 
     return decorator
@@ -28,17 +64,29 @@ def on_run():
     def decorator(method):
         class_name = method.__qualname__.split(".")[0]
         run_handlers[class_name] = method
+        _handler_tables.clear()
         return method
 
     return decorator
 
 
+def _split_connect_pattern(pattern: str) -> Tuple[str, str]:
+    """``topic`` or ``topic:role``, either part may be ``*``."""
+    parts = pattern.split(':')
+    if len(parts) > 2:
+        raise ValueError(f"Invalid on_connect pattern {pattern!r}, expected 'topic' or 'topic:role'")
+    return (parts[0], parts[1]) if len(parts) == 2 else (parts[0], '*')
+
+
 def on_connect(topic: str):
+    _split_connect_pattern(topic)
+
     def decorator(method):
         class_name = method.__qualname__.split(".")[0]
         if class_name not in connect_handlers:
             connect_handlers[class_name] = {}
         connect_handlers[class_name][topic] = method
+        _handler_tables.clear()
         return method
 
     return decorator
@@ -49,15 +97,185 @@ def has_param(func, param):
     return param in sig.parameters
 
 
-class AgentCommon:
+class MessageEnvelope:
+    """
+    One received message, shared by every handler layer. The payload is decoded at most once;
+    ``claim`` hands the decoded object to the first consumer and a private copy to any further
+    consumer unless the agent runs with ``shared_payloads`` (handlers then must not mutate it).
+    Tagged messages are only decoded when a handler actually asks for the payload.
+    """
+    __slots__ = ("sender", "data", "time", "received_at", "shared", "type_tag", "_payload", "_decoded", "_claims")
+
+    def __init__(self, sender: AgentDetail, data: bytes, time: int, shared: bool = False,
+                 type_tag: Optional[str] = None):
+        self.sender = sender
+        self.data = data
+        self.time = time
+        self.received_at = _time.time()
+        self.shared = shared
+        self.type_tag = type_tag
+        self._payload = None
+        self._decoded = False
+        self._claims = 0
+
+    @classmethod
+    def for_payload(cls, sender: AgentDetail, payload: Any, time: int, shared: bool = False) -> "MessageEnvelope":
+        """Envelope for a payload that did not arrive as one encoded message, such as a ``ChunkStream``."""
+        envelope = cls(sender, b"", time, shared)
+        envelope._payload = payload
+        envelope._decoded = True
+        return envelope
+
+    @property
+    def payload(self) -> Any:
+        if not self._decoded:
+            self._payload = decode_payload(self.data)
+            self._decoded = True
+        return self._payload
+
+    @property
+    def payload_type(self) -> Optional[type]:
+        """Type of the payload; ``None`` for a tagged message whose type is unknown to this process."""
+        if self.type_tag is not None and not self._decoded:
+            return tagged_type(self.type_tag)
+        return type(self.payload)
+
+    @property
+    def data_view(self) -> memoryview:
+        """
+        Read-only view of ``data``, for handlers that parse the raw payload themselves. Delivery is
+        copy-once: the Rust side hands every message to Python as a new ``bytes`` object, and
+        slicing this view does not copy it again. It is not a view of the received network buffer.
+        """
+        return memoryview(self.data)
+
+    def decode(self) -> Any:
+        """Decode a fresh copy of the payload, independent of the cached one."""
+        return decode_payload(self.data)
+
+    def claim(self) -> Any:
+        self._claims += 1
+        if self._claims == 1 or self.shared:
+            return self.payload
+        return self.decode()
+
+
+class HandlerSpec(NamedTuple):
+    handler: Callable
+    wants_agent: bool
+    wants_time: bool
+    wants_envelope: bool
+
+    @classmethod
+    def from_handler(cls, handler: Callable) -> "HandlerSpec":
+        params = inspect.signature(handler).parameters
+        return cls(handler, "agent" in params, "time" in params, "envelope" in params)
+
+    def kwargs(self, envelope: MessageEnvelope) -> Dict[str, Any]:
+        kwargs = {}
+        if self.wants_agent: kwargs["agent"] = envelope.sender
+        if self.wants_time: kwargs["time"] = envelope.time
+        if self.wants_envelope: kwargs["envelope"] = envelope
+        return kwargs
+
+
+class ConnectIndex:
+    """
+    ``@on_connect`` patterns bucketed by topic and role. Handlers keep the order in which the
+    uncompiled registry would have called them (MRO order, ``*`` first within a class).
+    """
+
     def __init__(self):
+        self._any: List[Tuple[int, Callable]] = []
+        self._by_topic: Dict[str, List[Tuple[int, Callable]]] = {}
+        self._by_role: Dict[str, List[Tuple[int, Callable]]] = {}
+        self._by_pair: Dict[Tuple[str, str], List[Tuple[int, Callable]]] = {}
+        self._size = 0
+
+    def add(self, pattern: str, handler: Callable):
+        topic, role = _split_connect_pattern(pattern)
+        entry = (self._size, handler)
+        self._size += 1
+        if topic == '*' and role == '*':
+            self._any.append(entry)
+        elif role == '*':
+            self._by_topic.setdefault(topic, []).append(entry)
+        elif topic == '*':
+            self._by_role.setdefault(role, []).append(entry)
+        else:
+            self._by_pair.setdefault((topic, role), []).append(entry)
+
+    def match(self, topic: str, agent_role: str) -> List[Callable]:
+        buckets = [bucket for bucket in (self._any,
+                                         self._by_topic.get(topic),
+                                         self._by_role.get(agent_role),
+                                         self._by_pair.get((topic, agent_role))) if bucket]
+        if not buckets:
+            return []
+        if len(buckets) == 1:
+            return [handler for _, handler in buckets[0]]
+        return [handler for _, handler in sorted(chain.from_iterable(buckets), key=itemgetter(0))]
+
+
+class HandlerTable:
+    """Handlers of one agent class resolved from the global registries, ready for O(1) dispatch."""
+
+    def __init__(self, agent_class: type):
+        mro = inspect.getmro(agent_class)
+
+        # The most derived class wins, like the first hit of an MRO walk.
+        self.message: Dict[type, HandlerSpec] = {}
+        for cls in reversed(mro):
+            for message_type, handler in typed_message_handlers.get(cls.__name__, {}).items():
+                self.message[message_type] = HandlerSpec.from_handler(handler)
+
+        self.run: Tuple[Callable, ...] = tuple(run_handlers[cls.__name__] for cls in mro
+                                               if cls.__name__ in run_handlers)
+
+        self.connect = ConnectIndex()
+        for cls in mro:
+            topic_handlers = connect_handlers.get(cls.__name__)
+            if not topic_handlers:
+                continue
+            if '*' in topic_handlers:
+                self.connect.add('*', topic_handlers['*'])
+            for pattern, handler in topic_handlers.items():
+                if pattern != '*':
+                    self.connect.add(pattern, handler)
+
+
+def get_handler_table(agent_class: type) -> HandlerTable:
+    table = _handler_tables.get(agent_class)
+    if table is None:
+        table = _handler_tables[agent_class] = HandlerTable(agent_class)
+    return table
+
+
+class AgentCommon:
+    def __init__(self, shared_payloads: bool = False, ordered_dispatch: bool = False,
+                 dispatch_key: Optional[Callable[[MessageEnvelope], Hashable]] = None,
+                 dispatch_queue_size: int = 1024, chunk_delivery: str = "buffer",
+                 max_reassembly_bytes: int = 256 * 1024 * 1024, chunk_timeout: float = 60.0):
         self._handlers = {}
         self._run_handlers = {}
         self._connection_handlers = {}
+        self.shared_payloads = shared_payloads
+        # Messages with the same key (the sender by default) are handled in order, different keys in parallel
+        self._dispatch_key = dispatch_key
+        self._executor: Optional[KeyedExecutor] = None
+        if ordered_dispatch or dispatch_key is not None:
+            self._executor = KeyedExecutor(dispatch_queue_size)
+        # Chunked transfers are reassembled into one buffer, or handed to @on(ChunkStream) handlers
+        if chunk_delivery not in ("buffer", "stream"):
+            raise ValueError(f"chunk_delivery must be 'buffer' or 'stream', not {chunk_delivery!r}")
+        self._stream_chunks = chunk_delivery == "stream"
+        self._reassembler = ChunkReassembler(False, max_reassembly_bytes, chunk_timeout)
+        self._stream_tasks = set()
         logger.info(f"AgentCommon initialized for {self.__class__.__name__}")
 
-    def on(self, data_type):
+    def on(self, data_type, codec: Union[str, Codec, None] = None, tag: Optional[str] = None):
         def decorator(func):
+            _register_message_type(data_type, codec, tag)
             self._handlers[data_type] = func
             return func
 
@@ -71,6 +289,8 @@ class AgentCommon:
         return decorator
 
     def on_connect(self, topic: str):
+        _split_connect_pattern(topic)
+
         def decorator(func):
             self._connection_handlers[topic] = func
             return func
@@ -81,47 +301,88 @@ class AgentCommon:
         if pattern == '*':
             return True
         if ':' in pattern:
-            pattern_topic, pattern_role = pattern.split(':')
+            pattern_topic, pattern_role = _split_connect_pattern(pattern)
             return (pattern_topic == '*' or pattern_topic == topic) and \
                 (pattern_role == '*' or pattern_role == agent_role)
         return pattern == topic
 
-    async def onmessage_handler(self, agent: AgentDetail, data: bytes, time: int):
-        message = pickle.loads(data)
-        message_type = type(message)
-        for cls in inspect.getmro(self.__class__):
-            method_key = f"{cls.__name__}.{message_type}"
-            if method_key in message_handlers:
-                handler = message_handlers[method_key]
-                kwargs = {}
-                if has_param(handler, "agent"): kwargs["agent"] = agent
-                if has_param(handler, "time"): kwargs["time"] = time
-                await handler(self, message, **kwargs)
-                break
+    async def onmessage_handler(self, agent: AgentDetail, data: bytes, time: int,
+                                envelope: Optional[MessageEnvelope] = None):
+        if envelope is None:
+            envelope = MessageEnvelope(agent, data, time, self.shared_payloads)
+        spec = get_handler_table(self.__class__).message.get(envelope.payload_type)
+        if spec is not None:
+            await spec.handler(self, envelope.claim(), **spec.kwargs(envelope))
 
     async def onrun_handler(self, inputs: Optional[bytes] = None):
-        decoded_input = pickle.loads(inputs) if inputs else None
-        for cls in inspect.getmro(self.__class__):
-            if cls.__name__ in run_handlers:
-                await run_handlers[cls.__name__](self, decoded_input)
+        decoded_input = decode_payload(inputs) if inputs else None
+        for handler in get_handler_table(self.__class__).run:
+            await handler(self, decoded_input)
 
     async def onconnect_handler(self, topic: str, agent_detail: Any):
-        for cls in inspect.getmro(self.__class__):
-            if cls.__name__ in connect_handlers:
-                topic_handlers = connect_handlers[cls.__name__]
-                if '*' in topic_handlers:
-                    await topic_handlers['*'](self, topic, agent_detail)
-                for pattern, handler in topic_handlers.items():
-                    if pattern != '*' and self._matches_pattern(pattern, topic, agent_detail.role):
-                        await handler(self, topic, agent_detail)
-
-    async def common_on_message(self, agent: AgentDetail, data: bytes, time: int):
+        for handler in get_handler_table(self.__class__).connect.match(topic, agent_detail.role):
+            await handler(self, topic, agent_detail)
+
+    def dispatch_queue_depths(self) -> Dict[Hashable, int]:
+        """Messages queued or in progress per dispatch key; empty unless ordered dispatch is enabled."""
+        return self._executor.queue_depths() if self._executor else {}
+
+    def dispatch_high_water_mark(self, key: Optional[Hashable] = None) -> int:
+        """
+        Deepest the dispatch queue of ``key`` has been since it became active, or without a key the
+        deepest any dispatch queue has been. Close to ``dispatch_queue_size`` means senders waited
+        for room. Always 0 unless ordered dispatch is enabled.
+        """
+        if self._executor is None:
+            return 0
+        return self._executor.peak_depth if key is None else self._executor.high_water_mark(key)
+
+    async def common_on_message(self, agent: AgentDetail, data: bytes, time: int, type_tag: Optional[str] = None):
+        if is_chunk(data, type_tag):
+            await self._on_chunk(agent, data, time, type_tag)
+            return
+        envelope = MessageEnvelope(agent, data, time, self.shared_payloads, type_tag)
+        if self._executor is None:
+            await self.dispatch_envelope(envelope)
+            return
+        try:
+            key = self._dispatch_key(envelope) if self._dispatch_key else agent.id
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Error computing dispatch key: {e}")
+            return
+        await self._executor.submit(key, lambda: self.dispatch_envelope(envelope))
+
+    def _accepts_streams(self) -> bool:
+        return ChunkStream in get_handler_table(self.__class__).message or ChunkStream in self._handlers
+
+    async def _on_chunk(self, agent: AgentDetail, data: bytes, time: int, type_tag: Optional[str]):
+        try:
+            # Without a handler to read it, a stream would only hold chunks nobody takes
+            result = self._reassembler.feed(agent, data, type_tag,
+                                            stream=self._stream_chunks and self._accepts_streams())
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Error reassembling chunked message: {e}")
+            return
+        if isinstance(result, ChunkStream):
+            # The handler consumes the stream while later chunks are still arriving
+            task = asyncio.create_task(self.dispatch_envelope(
+                MessageEnvelope.for_payload(agent, result, time, self.shared_payloads)))
+            self._stream_tasks.add(task)
+            task.add_done_callback(self._stream_tasks.discard)
+            task.add_done_callback(lambda _: result._close())
+        elif result is not None:
+            await self.common_on_message(agent, result, time, type_tag)
+
+    async def dispatch_envelope(self, envelope: MessageEnvelope):
         try:
-            tasks = [self.onmessage_handler(agent, data, time)]
+            agent, time = envelope.sender, envelope.time
+            tasks = [self.onmessage_handler(agent, envelope.data, time, envelope)]
 
-            decoded_data = pickle.loads(data)
-            if type(decoded_data) in self._handlers:
-                tasks.append(self._handlers[type(decoded_data)](decoded_data, agent, time))
+            handler = self._handlers.get(envelope.payload_type)
+            if handler is not None:
+                tasks.append(handler(envelope.claim(), agent, time))
 
             await asyncio.gather(*tasks)
         except Exception as e:
@@ -147,7 +408,7 @@ class AgentCommon:
         try:
             tasks = [self.onrun_handler(inputs)]
 
-            decoded_input = pickle.loads(inputs) if inputs else None
+            decoded_input = decode_payload(inputs) if inputs else None
             for handler in self._run_handlers.values():
                 tasks.append(handler(decoded_input))
 
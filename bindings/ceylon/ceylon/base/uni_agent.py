@@ -1,15 +1,18 @@
 import asyncio
-import pickle
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Awaitable, Callable, Hashable, Tuple, Union
 
 from loguru import logger
 
 from ceylon import (
     MessageHandler, EventHandler, Processor,
-    AgentDetail
+    AgentDetail, InboundMessage
 )
-from ceylon.base.support import AgentCommon
-from ceylon.ceylon import UnifiedAgent, PeerMode, UnifiedAgentConfig
+from ceylon.base.chunking import split_payload
+from ceylon.base.codec import Codec, CompressionStats, Compressor, compress_payload, decode_payload, \
+    encode_payload, get_compressor, type_tag
+from ceylon.base.support import AgentCommon, MessageEnvelope
+from ceylon.ceylon import UnifiedAgent, PeerMode, UnifiedAgentConfig, WireFormat, TransportMode, GossipProfile, \
+    OverflowPolicy, QueueError
 from ceylon.ceylon.ceylon import uniffi_set_event_loop
 
 
@@ -19,7 +22,7 @@ class BaseAgentData(AgentDetail):
     def get_extra_data(self):
         if self.extra_data is None:
             return None
-        return pickle.loads(self.extra_data)
+        return decode_payload(self.extra_data)
 
 
 class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentCommon):
@@ -39,8 +42,41 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
             workspace_id: str = "default",
             buffer_size: int = 1024,
             config_path: Optional[str] = None,
-            extra_data: Optional[Any] = None
+            extra_data: Optional[Any] = None,
+            codec: Union[str, Codec, None] = None,
+            compression: Union[str, Compressor, None] = None,
+            compression_threshold: int = 4096,
+            chunk_size: Optional[int] = None,
+            chunk_delivery: str = "buffer",
+            max_reassembly_bytes: int = 256 * 1024 * 1024,
+            chunk_timeout: float = 60.0,
+            shared_payloads: bool = False,
+            max_inflight_messages: Optional[int] = None,
+            message_batch_size: Optional[int] = None,
+            message_batch_delay_us: Optional[int] = None,
+            wire_format: Optional[WireFormat] = None,
+            transport: Optional[TransportMode] = None,
+            broker_bind_address: Optional[str] = None,
+            shared_memory: bool = False,
+            seen_cache_ttl_ms: Optional[int] = None,
+            gossip_profile: Optional[GossipProfile] = None,
+            gossip_overrides: Optional[Dict[str, int]] = None,
+            publish_batch_size: Optional[int] = None,
+            publish_batch_bytes: Optional[int] = None,
+            publish_batch_delay_us: Optional[int] = None,
+            queue_capacity: Optional[int] = None,
+            outbound_overflow: Optional[OverflowPolicy] = None,
+            inbound_overflow: Optional[OverflowPolicy] = None,
+            ordered_dispatch: bool = False,
+            dispatch_key: Optional[Callable[[MessageEnvelope], Hashable]] = None,
+            dispatch_queue_size: int = 1024
     ):
+        # Ordered dispatch queues messages per key in the order on_message is called. With several
+        # calls in flight the runtime already reorders them before they reach the queue.
+        if (ordered_dispatch or dispatch_key is not None) and (max_inflight_messages or 1) > 1:
+            raise ValueError("ordered_dispatch and dispatch_key keep per-key order only with "
+                             f"max_inflight_messages of 1, not {max_inflight_messages}")
+
         # Create configuration
         config = UnifiedAgentConfig(
             name=name,
@@ -50,12 +86,28 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
             buffer_size=buffer_size,
             work_space_id=workspace_id,
             admin_peer=admin_peer,
-            admin_ip=admin_ip
+            admin_ip=admin_ip,
+            max_inflight_messages=max_inflight_messages,
+            message_batch_size=message_batch_size,
+            message_batch_delay_us=message_batch_delay_us,
+            wire_format=wire_format,
+            transport=transport,
+            broker_bind_address=broker_bind_address,
+            shared_memory=shared_memory,
+            seen_cache_ttl_ms=seen_cache_ttl_ms,
+            gossip_profile=gossip_profile,
+            publish_batch_size=publish_batch_size,
+            publish_batch_bytes=publish_batch_bytes,
+            publish_batch_delay_us=publish_batch_delay_us,
+            queue_capacity=queue_capacity,
+            outbound_overflow=outbound_overflow,
+            inbound_overflow=inbound_overflow,
+            **{f"gossip_{name}": value for name, value in (gossip_overrides or {}).items()}
         )
 
         _extra_data = None
         if extra_data is not None:
-            _extra_data = pickle.dumps(extra_data)
+            _extra_data = encode_payload(extra_data, codec)
 
         # Initialize UnifiedAgent with self as handlers
         super().__init__(
@@ -66,7 +118,10 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
             on_event=self,
             extra_data=_extra_data
         )
-        AgentCommon.__init__(self)
+        AgentCommon.__init__(self, shared_payloads=shared_payloads, ordered_dispatch=ordered_dispatch,
+                             dispatch_key=dispatch_key, dispatch_queue_size=dispatch_queue_size,
+                             chunk_delivery=chunk_delivery, max_reassembly_bytes=max_reassembly_bytes,
+                             chunk_timeout=chunk_timeout)
         # super(AgentCommon, self).__init__()
         # Store initialization parameters
         self.name = name
@@ -77,6 +132,14 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
         self.admin_ip = admin_ip
         self.workspace_id = workspace_id
         self.buffer_size = buffer_size
+        # Default payload codec of this agent, see ceylon.base.codec
+        self.codec = codec
+        # Encoded payloads of at least compression_threshold bytes are compressed when it helps
+        self.compression = get_compressor(compression) if compression is not None else None
+        self.compression_threshold = compression_threshold
+        self.compression_stats = CompressionStats()
+        # Encoded payloads larger than chunk_size are sent as a chunked transfer
+        self.chunk_size = chunk_size
 
         # Initialize agent storage
         self.connected_agents: Dict[str, AgentDetail] = {}
@@ -91,14 +154,46 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
         logger.info(f"Starting {self.name} agent in {self.mode.name} mode")
         await self.start(inputs, workers)
 
-    async def broadcast_message(self, message: Any) -> None:
+    def _encode_message(self, message: Any) -> bytes:
+        data = encode_payload(message, self.codec)
+        if self.compression is None:
+            return data
+        return compress_payload(data, self.compression, self.compression_threshold, self.compression_stats)
+
+    def _encode_unchunked(self, message: Any) -> Tuple[Optional[str], bytes]:
+        if isinstance(message, bytes):
+            return None, message
+        data = self._encode_message(message)
+        if self.chunk_size is not None and len(data) > self.chunk_size:
+            # A transfer refused halfway through could not be taken back
+            raise ValueError(f"Message of {len(data)} bytes needs a chunked transfer, which can not be sent "
+                             f"without waiting")
+        return type_tag(type(message)), data
+
+    async def _send_chunked(self, data: bytes, send: Callable[[bytes], Awaitable[None]]) -> None:
+        if self.chunk_size is None or len(data) <= self.chunk_size:
+            await send(data)
+            return
+        for chunk in split_payload(data, self.chunk_size):
+            # Each send waits for room in the outgoing queue; yielding in between lets other
+            # messages of this agent go out between the chunks of a large transfer
+            await send(chunk)
+            await asyncio.sleep(0)
+
+    async def broadcast_message(self, message: Any, target_role: Optional[str] = None) -> None:
         """
         Broadcast a message to all connected agents with automatic serialization.
+        When target_role is given, agents with any other role drop the message before decoding it.
         """
         try:
+            tag = None
             if not isinstance(message, bytes):
-                message = pickle.dumps(message)
-            await self.broadcast(message)
+                tag = type_tag(type(message))
+                message = self._encode_message(message)
+            if tag is None:
+                await self.broadcast_tagged(message, tag, target_role)
+            else:
+                await self._send_chunked(message, lambda chunk: self.broadcast_tagged(chunk, tag, target_role))
             # logger.debug(f"Broadcast message sent: {message}")
         except Exception as e:
             logger.error(f"Error broadcasting message: {e}")
@@ -108,11 +203,50 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
         Send a direct message to a specific peer with automatic serialization.
         """
         try:
+            tag = None
             if not isinstance(message, bytes):
-                message = pickle.dumps(message)
-            await self.send_direct(peer_id, message)
+                tag = type_tag(type(message))
+                message = self._encode_message(message)
+            if tag is None:
+                await self.send_direct_tagged(peer_id, message, tag)
+            else:
+                await self._send_chunked(message, lambda chunk: self.send_direct_tagged(peer_id, chunk, tag))
+        except Exception as e:
+            logger.error(f"Error sending direct message: {e}")
+
+    def try_broadcast_message(self, message: Any, target_role: Optional[str] = None) -> bool:
+        """
+        Broadcast without waiting for room in the outgoing queue.
+        Returns False when the queue refused the message, see outbound_overflow, or when it could
+        not be encoded or needs a chunked transfer.
+        """
+        try:
+            tag, message = self._encode_unchunked(message)
+            self.try_broadcast(message, tag, target_role)
+            return True
+        except QueueError as e:
+            logger.debug(f"Broadcast refused: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error broadcasting message: {e}")
+            return False
+
+    def try_send_message(self, peer_id: str, message: Any) -> bool:
+        """
+        Send a direct message without waiting for room in the outgoing queue.
+        Returns False when the queue refused the message, see outbound_overflow, or when it could
+        not be encoded or needs a chunked transfer.
+        """
+        try:
+            tag, message = self._encode_unchunked(message)
+            self.try_send_direct(peer_id, message, tag)
+            return True
+        except QueueError as e:
+            logger.debug(f"Direct message to {peer_id} refused: {e}")
+            return False
         except Exception as e:
             logger.error(f"Error sending direct message: {e}")
+            return False
 
     # def get_connected_agents(self) -> List[AgentDetail]:
     #     """Get list of all connected agents"""
@@ -125,6 +259,18 @@ class BaseAgent(UnifiedAgent, MessageHandler, EventHandler, Processor, AgentComm
     async def on_message(self, agent: BaseAgentData, data: "bytes", time: "int"):
         await self.common_on_message(agent, data, time)
 
+    async def on_tagged_message(self, message: InboundMessage):
+        # Subclasses overriding on_message consume the raw bytes themselves, so they keep getting
+        # every message through it; otherwise the type tag goes along for lazy decoding.
+        if type(self).on_message is not BaseAgent.on_message:
+            await self.on_message(message.agent, message.data, message.time)
+        else:
+            await self.common_on_message(message.agent, message.data, message.time, message.type_tag)
+
+    async def on_message_batch(self, messages: List[InboundMessage]):
+        for message in messages:
+            await self.on_tagged_message(message)
+
     async def on_agent_connected(self, topic: "str", agent: BaseAgentData):
         await self.common_on_agent_connected(topic, agent)
 
@@ -29,7 +29,7 @@ class ProcessPlayGround(BasePlayGround):
             self.process_events[response.request_id].set()
 
     async def process_request(self, request: ProcessRequest, wait_for_completion=True) -> ProcessResponse or None:
-        await self.broadcast_message(request)
+        await self.broadcast_message(request, target_role=request.task_type)
         if wait_for_completion:
             event = asyncio.Event()
             self.process_events[request.id] = event
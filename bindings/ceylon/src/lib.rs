@@ -23,8 +23,9 @@ fn enable_log(level: String) {
 }
 
 use ceylon_core::{
-    AgentDetail, EventHandler, MessageHandler, PeerMode, Processor, UnifiedAgent,
-    UnifiedAgentConfig,
+    configure_runtime, AgentDetail, AgentDiagnostics, EventHandler, GossipProfile, InboundMessage,
+    MessageFilter, MessageHandler, OverflowPolicy, PeerMode, Processor, QueueError, QueueStats,
+    TransportMode, UnifiedAgent, UnifiedAgentConfig, WireFormat,
 };
 use std::str::FromStr;
 use tracing::{info, Level};
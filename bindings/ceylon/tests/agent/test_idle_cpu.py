@@ -0,0 +1,69 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+
+import asyncio
+import time
+
+from loguru import logger
+
+from ceylon import AgentDetail
+from ceylon import PeerMode
+from ceylon import TransportMode
+from ceylon.base.uni_agent import BaseAgent
+
+AGENT_COUNT = 20
+WARMUP_SECONDS = 10
+MEASURE_SECONDS = 10
+# CPU time of the whole process, all agents and runtime threads included, per second of wall time
+MAX_IDLE_CPU = 0.05
+# Agents of one process talk in process unless told otherwise, measure the swarm path as well
+TRANSPORTS = (TransportMode.NETWORK, TransportMode.IN_PROCESS)
+
+
+class IdleAdmin(BaseAgent):
+    def __init__(self, transport: TransportMode, name="admin", port=8888):
+        super().__init__(name=name, port=port, mode=PeerMode.ADMIN, role="idle_admin", transport=transport)
+
+    async def on_agent_connected(self, topic: str, agent: AgentDetail):
+        await super().on_agent_connected(topic, agent)
+        logger.info(f"Idle Admin: agent connected - {agent.name} ({agent.id})")
+
+
+class IdleWorker(BaseAgent):
+    def __init__(self, transport: TransportMode, name="worker", role="idle_worker"):
+        super().__init__(name=name, role=role, mode=PeerMode.CLIENT, transport=transport)
+
+
+async def measure_idle_cpu(seconds: float) -> float:
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    await asyncio.sleep(seconds)
+    return (time.process_time() - cpu_start) / (time.monotonic() - wall_start)
+
+
+async def run(transport: TransportMode, port: int):
+    admin = IdleAdmin(transport, port=port)
+    workers = [IdleWorker(transport, name=f"Agent {i}") for i in range(1, AGENT_COUNT + 1)]
+
+    run_task = asyncio.create_task(admin.start_agent(b"", workers))
+    try:
+        logger.info(f"Waiting {WARMUP_SECONDS}s for {AGENT_COUNT} agents to connect...")
+        await asyncio.sleep(WARMUP_SECONDS)
+
+        cpu = await measure_idle_cpu(MEASURE_SECONDS)
+        logger.info(f"Idle CPU with {AGENT_COUNT + 1} agents over {transport}: {cpu:.1%} of one core")
+        assert cpu < MAX_IDLE_CPU, \
+            f"Idle agents over {transport} used {cpu:.1%} of a core, expected below {MAX_IDLE_CPU:.0%}"
+    finally:
+        await admin.stop()
+        await run_task
+
+
+async def main():
+    for offset, transport in enumerate(TRANSPORTS):
+        await run(transport, port=8888 + offset)
+
+
+if __name__ == "__main__":
+    logger.info("Starting idle CPU benchmark...")
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+
+import asyncio
+import sys
+import time
+
+from loguru import logger
+
+from ceylon import AgentDetail
+from ceylon import PeerMode
+from ceylon import TransportMode
+from ceylon.base.uni_agent import BaseAgent
+
+DEFAULT_AGENT_COUNT = 100
+TIMEOUT_SECONDS = 120
+# Agents of one process talk in process unless told otherwise, measure the swarm path as well
+TRANSPORTS = (TransportMode.NETWORK, TransportMode.IN_PROCESS)
+
+
+class JoinAdmin(BaseAgent):
+    def __init__(self, expected: int, transport: TransportMode, name="admin", port=8888):
+        super().__init__(name=name, port=port, mode=PeerMode.ADMIN, role="join_admin", transport=transport)
+        self.expected = expected
+        self.connected = 0
+        self.all_connected = asyncio.Event()
+
+    async def on_agent_connected(self, topic: str, agent: AgentDetail):
+        await super().on_agent_connected(topic, agent)
+        self.connected += 1
+        if self.connected == self.expected:
+            self.all_connected.set()
+
+
+class JoinWorker(BaseAgent):
+    def __init__(self, transport: TransportMode, name="worker", role="join_worker"):
+        super().__init__(name=name, role=role, mode=PeerMode.CLIENT, transport=transport)
+
+
+async def run(agent_count: int, transport: TransportMode, port: int):
+    admin = JoinAdmin(expected=agent_count, transport=transport, port=port)
+    workers = [JoinWorker(transport, name=f"Agent {i}") for i in range(1, agent_count + 1)]
+
+    start = time.monotonic()
+    run_task = asyncio.create_task(admin.start_agent(b"", workers))
+    try:
+        await asyncio.wait_for(admin.all_connected.wait(), TIMEOUT_SECONDS)
+        elapsed = time.monotonic() - start
+        logger.info(f"All {agent_count} agents connected over {transport} in {elapsed:.2f}s")
+    except asyncio.TimeoutError:
+        logger.error(f"Only {admin.connected}/{agent_count} agents connected over {transport} "
+                     f"after {TIMEOUT_SECONDS}s")
+        raise
+    finally:
+        await admin.stop()
+        await run_task
+
+
+async def main(agent_count: int):
+    for offset, transport in enumerate(TRANSPORTS):
+        await run(agent_count, transport, port=8888 + offset)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_AGENT_COUNT
+    logger.info(f"Starting join time benchmark with {count} agents...")
+    asyncio.run(main(count))
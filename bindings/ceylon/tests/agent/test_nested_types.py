@@ -0,0 +1,82 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Round trip of a dataclass with a nested dataclass and an enum field between two processes. The
+receiving process only declares a handler of the outer type and never touches the nested ones
+before decoding, like an agent in another process would.
+"""
+
+import enum
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+from ceylon.base.codec import decode_payload, encode_payload
+from ceylon.base.support import on
+from ceylon.base.uni_agent import BaseAgent
+
+CODECS = ("schema", "dataclass")
+
+
+class ProcessState(enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+
+
+@dataclass
+class TimeSlot:
+    date: str
+    start_time: int
+    end_time: int
+
+
+@dataclass
+class Meeting:
+    name: str
+    slot: TimeSlot
+    state: ProcessState
+    alternatives: List[TimeSlot]
+    previous: Optional[TimeSlot] = None
+
+
+def sample_meeting() -> Meeting:
+    return Meeting(name="Planning", slot=TimeSlot("2024-07-21", 9, 10), state=ProcessState.DONE,
+                   alternatives=[TimeSlot("2024-07-22", 11, 12)])
+
+
+def send(codec: str) -> None:
+    print(encode_payload(sample_meeting(), codec).hex())
+
+
+def receive() -> None:
+    class MeetingAgent(BaseAgent):
+        @on(Meeting)
+        async def on_meeting(self, meeting: Meeting, time: int, agent):
+            pass
+
+    meeting = decode_payload(bytes.fromhex(sys.stdin.read()))
+    assert meeting == sample_meeting(), meeting
+
+
+def run(*args: str, data: str = "") -> str:
+    result = subprocess.run([sys.executable, __file__, *args], input=data, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    # Importing ceylon prints a banner, the payload is the last line
+    return result.stdout.splitlines()[-1] if result.stdout else ""
+
+
+def test_nested_types_round_trip():
+    for codec in CODECS:
+        run("receive", data=run("send", codec))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "send":
+        send(sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == "receive":
+        receive()
+    else:
+        test_nested_types_round_trip()
+        print("Nested types round trip passed")
@@ -0,0 +1,83 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Round trip of NumPy arrays and Arrow tables through the array codec.
+"""
+
+import pytest
+
+from ceylon.base.arrays import ArrayCodec
+from ceylon.base.codec import CodecError, decode_payload, encode_payload, get_codec, register_type_codec
+
+
+def test_ndarray_round_trip():
+    np = pytest.importorskip("numpy")
+    for array in [np.arange(12, dtype=np.float64).reshape(3, 4), np.array([], dtype=np.int32),
+                  np.array(5, dtype=np.uint8), np.arange(20, dtype=np.int16).reshape(4, 5)[:, ::2]]:
+        data = encode_payload(array, "array")
+        assert data[0] == ArrayCodec.codec_id
+        decoded = decode_payload(data)
+        assert decoded.dtype == array.dtype
+        assert decoded.shape == array.shape
+        assert np.array_equal(decoded, array)
+
+
+def test_ndarray_data_is_aligned_and_not_copied():
+    np = pytest.importorskip("numpy")
+    data = encode_payload(np.arange(100, dtype=np.float64), "array")
+    decoded = decode_payload(data)
+    # The array is a view over the received payload
+    assert not decoded.flags.writeable
+    assert (decoded.ctypes.data - np.frombuffer(data, dtype=np.uint8).ctypes.data) % 64 == 0
+
+
+def test_structured_ndarray_round_trip():
+    np = pytest.importorskip("numpy")
+    array = np.array([(1, 2.5), (2, 3.5)], dtype=[("id", "<i4"), ("value", "<f8")])
+    decoded = decode_payload(encode_payload(array, "array"))
+    assert decoded.dtype == array.dtype
+    assert np.array_equal(decoded, array)
+
+
+def test_object_ndarray_is_rejected():
+    np = pytest.importorskip("numpy")
+    with pytest.raises(CodecError):
+        encode_payload(np.array([{}, []], dtype=object), "array")
+
+
+def test_subclass_uses_codec_of_registered_base():
+    np = pytest.importorskip("numpy")
+
+    class Signal(np.ndarray):
+        pass
+
+    class Samples(Signal):
+        pass
+
+    register_type_codec(Signal, "array")
+    data = encode_payload(np.arange(4).view(Samples))
+    assert data[0] == ArrayCodec.codec_id
+    assert np.array_equal(decode_payload(data), np.arange(4))
+
+
+def test_arrow_table_round_trip():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.table({"id": [1, 2, 3], "name": ["a", "b", None]})
+    decoded = decode_payload(encode_payload(table, "array"))
+    assert isinstance(decoded, pa.Table)
+    assert decoded.equals(table)
+
+
+def test_arrow_record_batch_round_trip():
+    pa = pytest.importorskip("pyarrow")
+    batch = pa.record_batch({"value": [1.5, 2.5]})
+    decoded = decode_payload(encode_payload(batch, "array"))
+    assert isinstance(decoded, pa.RecordBatch)
+    assert decoded.equals(batch)
+
+
+def test_unsupported_type_is_rejected():
+    assert get_codec("array").codec_id == 0x06
+    with pytest.raises(CodecError):
+        encode_payload([1, 2, 3], "array")
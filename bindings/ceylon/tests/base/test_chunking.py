@@ -0,0 +1,162 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Splitting payloads into chunks and reassembling them, buffered and as a stream.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from ceylon import AgentDetail
+from ceylon.base.chunking import ChunkReassembler, ChunkStream, ChunkTransferError, is_chunk, split_payload
+
+TAG = "tests.Payload"
+
+
+def sender(name: str = "sender") -> AgentDetail:
+    return AgentDetail(name=name, id=f"{name}-id", role="worker", extra_data=None)
+
+
+def test_split_and_reassemble():
+    data = os.urandom(10_000)
+    chunks = list(split_payload(data, 1024))
+    assert len(chunks) == 10
+    assert all(is_chunk(chunk, TAG) for chunk in chunks)
+    reassembler = ChunkReassembler()
+    results = [reassembler.feed(sender(), chunk, TAG) for chunk in chunks]
+    assert results[:-1] == [None] * 9
+    assert bytes(results[-1]) == data
+    assert reassembler.active_transfers() == 0
+    assert reassembler.buffered_bytes == 0
+
+
+def test_untagged_bytes_are_not_chunks():
+    chunk = next(split_payload(b"payload", 4))
+    assert not is_chunk(chunk, None)
+
+
+def test_out_of_order_and_duplicate_chunks():
+    data = os.urandom(5000)
+    chunks = list(split_payload(data, 1000))
+    reassembler = ChunkReassembler()
+    for chunk in [chunks[3], chunks[0], chunks[3], chunks[4], chunks[1], chunks[0]]:
+        assert reassembler.feed(sender(), chunk, TAG) is None
+    assert bytes(reassembler.feed(sender(), chunks[2], TAG)) == data
+
+
+def test_transfers_of_different_senders_are_kept_apart():
+    first, second = os.urandom(3000), os.urandom(3000)
+    reassembler = ChunkReassembler()
+    results = []
+    for a, b in zip(split_payload(first, 1000), split_payload(second, 1000)):
+        results.append(reassembler.feed(sender("a"), a, TAG))
+        results.append(reassembler.feed(sender("b"), b, TAG))
+    assert bytes(results[-2]) == first
+    assert bytes(results[-1]) == second
+
+
+def test_byte_limit_rejects_large_transfer():
+    reassembler = ChunkReassembler(max_buffered_bytes=4096)
+    chunks = list(split_payload(os.urandom(8192), 1024))
+    assert all(reassembler.feed(sender(), chunk, TAG) is None for chunk in chunks)
+    assert reassembler.active_transfers() == 0
+    assert reassembler.buffered_bytes == 0
+    # Transfers within the limit still go through
+    data = os.urandom(4096)
+    assert bytes([reassembler.feed(sender(), chunk, TAG) for chunk in split_payload(data, 1024)][-1]) == data
+
+
+def test_chunk_of_wrong_size_aborts_transfer():
+    reassembler = ChunkReassembler()
+    chunks = list(split_payload(os.urandom(3000), 1000))
+    assert reassembler.feed(sender(), chunks[0], TAG) is None
+    assert reassembler.feed(sender(), chunks[1][:-1], TAG) is None
+    assert reassembler.active_transfers() == 0
+    assert reassembler.feed(sender(), chunks[2], TAG) is None
+    assert reassembler.active_transfers() == 0
+
+
+def test_stalled_transfer_times_out():
+    async def main():
+        reassembler = ChunkReassembler(timeout=0.05)
+        chunks = list(split_payload(os.urandom(3000), 1000))
+        reassembler.feed(sender(), chunks[0], TAG)
+        assert reassembler.active_transfers() == 1
+        # No further chunk arrives, the timer drops the transfer
+        await asyncio.sleep(0.2)
+        assert reassembler.active_transfers() == 0
+        assert reassembler.buffered_bytes == 0
+        assert reassembler.feed(sender(), chunks[1], TAG) is None
+
+    asyncio.run(main())
+
+
+def test_stream_in_order():
+    async def main():
+        data = os.urandom(10_000)
+        reassembler = ChunkReassembler(stream=True)
+        chunks = list(split_payload(data, 1024))
+        stream = reassembler.feed(sender(), chunks[0], TAG)
+        assert isinstance(stream, ChunkStream)
+        assert (stream.total_size, stream.chunk_count, stream.type_tag) == (len(data), 10, TAG)
+        for chunk in chunks[1:]:
+            assert reassembler.feed(sender(), chunk, TAG) is None
+        assert await stream.read() == data
+        assert reassembler.buffered_bytes == 0
+
+    asyncio.run(main())
+
+
+def test_stream_out_of_order():
+    async def main():
+        data = os.urandom(5000)
+        reassembler = ChunkReassembler(stream=True)
+        chunks = list(split_payload(data, 1000))
+        stream = reassembler.feed(sender(), chunks[2], TAG)
+        for chunk in [chunks[4], chunks[0], chunks[3], chunks[1]]:
+            reassembler.feed(sender(), chunk, TAG)
+        assert [bytes(chunk) async for chunk in stream] == [bytes(chunk[-1000:]) for chunk in chunks]
+
+    asyncio.run(main())
+
+
+def test_stream_consumer_falling_behind_aborts_transfer():
+    async def main():
+        reassembler = ChunkReassembler(stream=True, max_buffered_bytes=4096)
+        chunks = list(split_payload(os.urandom(10_000), 1024))
+        stream = reassembler.feed(sender(), chunks[0], TAG)
+        # Nobody reads the stream, feeding never waits for it
+        for chunk in chunks[1:]:
+            reassembler.feed(sender(), chunk, TAG)
+        assert reassembler.active_transfers() == 0
+        assert reassembler.buffered_bytes == 0
+        with pytest.raises(ChunkTransferError):
+            await stream.read()
+
+    asyncio.run(main())
+
+
+def test_stream_closed_by_handler_drops_transfer():
+    async def main():
+        reassembler = ChunkReassembler(stream=True)
+        chunks = list(split_payload(os.urandom(3000), 1000))
+        stream = reassembler.feed(sender(), chunks[0], TAG)
+        stream._close()
+        reassembler.feed(sender(), chunks[1], TAG)
+        assert reassembler.active_transfers() == 0
+        assert reassembler.buffered_bytes == 0
+
+    asyncio.run(main())
+
+
+def test_stream_override_per_transfer():
+    async def main():
+        data = os.urandom(3000)
+        reassembler = ChunkReassembler(stream=True)
+        results = [reassembler.feed(sender(), chunk, TAG, stream=False) for chunk in split_payload(data, 1000)]
+        assert bytes(results[-1]) == data
+
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Round trip of a payload through every codec, checking the codec id the payload starts with.
+"""
+
+import enum
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pytest
+
+from ceylon.base.codec import CodecError, decode_payload, encode_payload, get_codec, register_type_tag
+from ceylon.base.schema import SchemaCodec
+
+
+class Priority(enum.Enum):
+    LOW = 1
+    HIGH = 2
+
+
+@dataclass
+class Item:
+    name: str
+    quantity: int
+
+
+@dataclass
+class Order:
+    order_id: int
+    items: List[Item]
+    priority: Priority
+    note: Optional[str] = None
+    tags: Dict[str, str] = field(default_factory=dict)
+
+
+def sample_order() -> Order:
+    return Order(order_id=7, items=[Item("bolt", 3), Item("nut", 5)], priority=Priority.HIGH, tags={"site": "a"})
+
+
+def test_pickle_round_trip():
+    data = encode_payload(sample_order())
+    # Plain pickles, readable with pickle.loads
+    assert data[0] == 0x80
+    assert decode_payload(data) == sample_order()
+
+
+def test_json_round_trip():
+    message = {"name": "bolt", "sizes": [1, 2.5], "ok": True, "none": None}
+    data = encode_payload(message, "json")
+    assert data[0] == get_codec("json").codec_id == 0x01
+    assert decode_payload(data) == message
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    message = {"name": "bolt", "blob": b"\x00\x01", "sizes": [1, 2]}
+    data = encode_payload(message, "msgpack")
+    assert data[0] == get_codec("msgpack").codec_id == 0x02
+    assert decode_payload(data) == message
+
+
+@pytest.mark.parametrize("codec", ["dataclass", "schema"])
+def test_dataclass_round_trip(codec):
+    register_type_tag(Order)
+    data = encode_payload(sample_order(), codec)
+    assert data[0] == get_codec(codec).codec_id
+    assert decode_payload(data) == sample_order()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="kw_only dataclasses need Python 3.10")
+@pytest.mark.parametrize("codec", ["dataclass", "schema"])
+def test_kw_only_dataclass_round_trip(codec):
+    @dataclass(kw_only=True)
+    class Receipt:
+        order_id: int
+        total: float = 0.0
+
+    register_type_tag(Receipt)
+    receipt = Receipt(order_id=7, total=12.5)
+    assert decode_payload(encode_payload(receipt, codec)) == receipt
+
+
+def test_schema_codec_id():
+    assert get_codec("schema").codec_id == SchemaCodec.codec_id == 0x05
+
+
+def test_decode_payload_from_memoryview():
+    data = encode_payload({"a": 1}, "json")
+    assert decode_payload(memoryview(b"xx" + data)[2:]) == {"a": 1}
+
+
+def test_unknown_codec_id_is_rejected():
+    with pytest.raises(CodecError):
+        decode_payload(b"\x7f{}")
+    with pytest.raises(CodecError):
+        decode_payload(b"")
+
+
+def test_unknown_codec_name_is_rejected():
+    with pytest.raises(CodecError):
+        encode_payload({"a": 1}, "no-such-codec")
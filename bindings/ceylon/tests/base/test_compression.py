@@ -0,0 +1,86 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Compressed payload frames: every compressor, the compression threshold and the limit on the
+decompressed size.
+"""
+
+import os
+
+import pytest
+
+from ceylon.base.codec import COMPRESSED_PAYLOAD_ID, CodecError, CompressionStats, compress_payload, \
+    decode_payload, decompress_payload, encode_payload, get_compressor
+
+# Compressor name and the module it needs
+COMPRESSORS = [("zlib", None), ("zstd", "zstandard"), ("lz4", "lz4.frame")]
+
+
+def compressor(name: str, module):
+    if module is not None:
+        pytest.importorskip(module)
+    return get_compressor(name)
+
+
+def compressible_message() -> dict:
+    return {"rows": [{"id": i, "status": "pending"} for i in range(500)]}
+
+
+@pytest.mark.parametrize("name,module", COMPRESSORS)
+def test_round_trip(name, module):
+    selected = compressor(name, module)
+    data = encode_payload(compressible_message(), "json")
+    sent = compress_payload(data, selected)
+    assert sent[0] == COMPRESSED_PAYLOAD_ID
+    assert sent[1] == selected.compressor_id
+    assert len(sent) < len(data)
+    assert decompress_payload(sent) == data
+    assert decode_payload(sent) == compressible_message()
+
+
+@pytest.mark.parametrize("name,module", COMPRESSORS)
+def test_decompressed_size_limit(name, module):
+    selected = compressor(name, module)
+    sent = compress_payload(bytes(1024 * 1024), selected)
+    with pytest.raises(CodecError):
+        decompress_payload(sent, max_size=64 * 1024)
+    assert len(decompress_payload(sent, max_size=1024 * 1024)) == 1024 * 1024
+
+
+@pytest.mark.parametrize("name,module", COMPRESSORS)
+def test_truncated_frame_is_rejected(name, module):
+    selected = compressor(name, module)
+    sent = compress_payload(bytes(64 * 1024), selected)
+    with pytest.raises(CodecError):
+        decompress_payload(sent[:-4])
+
+
+def test_threshold():
+    data = encode_payload(compressible_message(), "json")
+    stats = CompressionStats()
+    assert compress_payload(data, "zlib", threshold=len(data) + 1, stats=stats) == data
+    assert compress_payload(data, "zlib", threshold=len(data), stats=stats)[0] == COMPRESSED_PAYLOAD_ID
+    assert stats.payloads == 2
+    assert stats.compressed_payloads == 1
+    assert stats.ratio > 1.0
+
+
+def test_incompressible_payload_is_sent_as_it_is():
+    data = encode_payload(os.urandom(4096))
+    stats = CompressionStats()
+    assert compress_payload(data, "zlib", stats=stats) == data
+    assert stats.compressed_payloads == 0
+    assert stats.ratio == 1.0
+
+
+def test_no_compressor():
+    data = encode_payload(compressible_message(), "json")
+    assert compress_payload(data, None) == data
+
+
+def test_unknown_compressor_is_rejected():
+    with pytest.raises(CodecError):
+        get_compressor("no-such-compressor")
+    with pytest.raises(CodecError):
+        decompress_payload(bytes((COMPRESSED_PAYLOAD_ID, 0xff)) + b"body")
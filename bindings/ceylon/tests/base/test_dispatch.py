@@ -0,0 +1,140 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Ordered dispatch: FIFO order per key, concurrency across keys and the queue depth statistics.
+"""
+
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from ceylon import AgentDetail, PeerMode
+from ceylon.base.codec import encode_payload, type_tag
+from ceylon.base.executor import KeyedExecutor
+from ceylon.base.support import AgentCommon, on
+from ceylon.base.uni_agent import BaseAgent
+
+
+@dataclass
+class Step:
+    index: int
+
+
+def sender(name: str) -> AgentDetail:
+    return AgentDetail(name=name, id=f"{name}-id", role="worker", extra_data=None)
+
+
+def test_keyed_executor_keeps_order_per_key():
+    async def main():
+        executor = KeyedExecutor()
+        seen = []
+
+        def job(key, index):
+            async def run():
+                # Later jobs of a key finish sooner, order must come from the queue
+                await asyncio.sleep(0.001 * (5 - index))
+                seen.append((key, index))
+
+            return run
+
+        for index in range(5):
+            for key in ("a", "b"):
+                await executor.submit(key, job(key, index))
+        await executor.join()
+        for key in ("a", "b"):
+            assert [index for k, index in seen if k == key] == list(range(5))
+
+    asyncio.run(main())
+
+
+def test_keyed_executor_runs_keys_concurrently():
+    async def main():
+        executor = KeyedExecutor()
+        started = {key: asyncio.Event() for key in "abc"}
+
+        def job(key):
+            async def run():
+                started[key].set()
+                # Only returns once every key has started, so the keys must run side by side
+                await asyncio.wait_for(asyncio.gather(*(event.wait() for event in started.values())), 1)
+
+            return run
+
+        for key in started:
+            await executor.submit(key, job(key))
+        await executor.join()
+        assert all(event.is_set() for event in started.values())
+
+    asyncio.run(main())
+
+
+def test_keyed_executor_bounds_queue_and_tracks_depth():
+    async def main():
+        executor = KeyedExecutor(max_queue_size=2)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        await executor.submit("a", blocked)
+        await executor.submit("a", blocked)
+        assert executor.queue_depth("a") == 2
+        third = asyncio.create_task(executor.submit("a", blocked))
+        await asyncio.sleep(0.01)
+        # The queue is full, the third submit waits for room
+        assert not third.done()
+        release.set()
+        await third
+        await executor.join()
+        assert executor.queue_depths() == {}
+        assert executor.peak_depth == 2
+
+    asyncio.run(main())
+
+
+def test_keyed_executor_rejects_empty_queue():
+    with pytest.raises(ValueError):
+        KeyedExecutor(max_queue_size=0)
+
+
+class OrderedAgent(AgentCommon):
+    def __init__(self):
+        super().__init__(ordered_dispatch=True, dispatch_queue_size=16)
+        self.steps = []
+
+    @on(Step)
+    async def on_step(self, step: Step, time: int, agent: AgentDetail):
+        await asyncio.sleep(0.001 * (step.index % 3))
+        self.steps.append((agent.id, step.index))
+
+
+def test_ordered_dispatch_per_sender():
+    async def main():
+        agent = OrderedAgent()
+        tag = type_tag(Step)
+        for index in range(10):
+            for name in ("a", "b"):
+                await agent.common_on_message(sender(name), encode_payload(Step(index)), 0, tag)
+        assert agent.dispatch_high_water_mark() >= 1
+        await agent._executor.join()
+        for name in ("a", "b"):
+            assert [index for agent_id, index in agent.steps if agent_id == f"{name}-id"] == list(range(10))
+        assert agent.dispatch_queue_depths() == {}
+        assert 1 <= agent.dispatch_high_water_mark() <= 16
+
+    asyncio.run(main())
+
+
+def test_dispatch_statistics_without_ordered_dispatch():
+    agent = AgentCommon()
+    assert agent.dispatch_queue_depths() == {}
+    assert agent.dispatch_high_water_mark() == 0
+    assert agent.dispatch_high_water_mark("a-id") == 0
+
+
+@pytest.mark.parametrize("options", [{"ordered_dispatch": True}, {"dispatch_key": lambda envelope: envelope.agent.id}])
+def test_ordered_dispatch_needs_single_inflight_message(options):
+    with pytest.raises(ValueError):
+        BaseAgent(name="ordered", mode=PeerMode.CLIENT, max_inflight_messages=4, **options)
@@ -0,0 +1,78 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Decoding a received message once and sharing it between handler layers.
+"""
+
+from dataclasses import dataclass
+from typing import List
+
+from ceylon import AgentDetail
+from ceylon.base.codec import encode_payload, type_tag
+from ceylon.base.support import MessageEnvelope
+
+
+@dataclass
+class Batch:
+    items: List[int]
+
+
+def envelope(shared: bool = False, tagged: bool = True) -> MessageEnvelope:
+    sender = AgentDetail(name="peer", id="peer-id", role="worker", extra_data=None)
+    return MessageEnvelope(sender, encode_payload(Batch([1, 2, 3])), 9, shared, type_tag(Batch) if tagged else None)
+
+
+def test_payload_is_decoded_once():
+    message = envelope()
+    assert message.payload is message.payload
+    assert message.payload == Batch([1, 2, 3])
+
+
+def test_tagged_type_is_known_without_decoding():
+    message = envelope()
+    assert message.payload_type is Batch
+    assert not message._decoded
+    assert envelope(tagged=False).payload_type is Batch
+
+
+def test_unknown_tag_has_no_type():
+    sender = AgentDetail(name="peer", id="peer-id", role="worker", extra_data=None)
+    message = MessageEnvelope(sender, encode_payload(Batch([1])), 0, type_tag="tests.NotRegistered")
+    assert message.payload_type is None
+
+
+def test_later_claims_get_private_copies():
+    message = envelope()
+    first, second = message.claim(), message.claim()
+    assert first is message.payload
+    assert second == first and second is not first
+    second.items.append(4)
+    assert first.items == [1, 2, 3]
+
+
+def test_shared_claims_get_the_same_object():
+    message = envelope(shared=True)
+    assert message.claim() is message.claim()
+
+
+def test_decode_returns_fresh_copy():
+    message = envelope()
+    assert message.decode() == message.payload
+    assert message.decode() is not message.payload
+
+
+def test_envelope_for_payload():
+    sender = AgentDetail(name="peer", id="peer-id", role="worker", extra_data=None)
+    payload = object()
+    message = MessageEnvelope.for_payload(sender, payload, 3)
+    assert message.payload is payload
+    assert message.payload_type is object
+
+
+def test_data_view_is_read_only_view_of_data():
+    message = envelope()
+    view = message.data_view
+    assert view.readonly
+    assert view.obj is message.data
+    assert bytes(view[1:4]) == message.data[1:4]
@@ -0,0 +1,161 @@
+#  Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+#  Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+#
+"""
+Dispatch tables compiled from the ``@on``, ``@on_run`` and ``@on_connect`` registries.
+"""
+
+import asyncio
+from dataclasses import dataclass
+
+import pytest
+
+from ceylon import AgentDetail
+from ceylon.base.codec import encode_payload, type_tag
+from ceylon.base.support import AgentCommon, ConnectIndex, get_handler_table, on, on_connect, on_run
+
+
+@dataclass
+class Ping:
+    value: int
+
+
+@dataclass
+class Pong:
+    value: int
+
+
+@dataclass
+class Renamed:
+    value: int
+
+
+def peer(role: str = "worker") -> AgentDetail:
+    return AgentDetail(name="peer", id="peer-id", role=role, extra_data=None)
+
+
+class HandlerBase(AgentCommon):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    @on(Ping)
+    async def on_ping(self, ping: Ping):
+        self.calls.append(("base ping", ping.value))
+
+    @on(Pong)
+    async def on_pong(self, pong: Pong, time: int, agent: AgentDetail):
+        self.calls.append(("base pong", pong.value, time, agent.id))
+
+    @on_run()
+    async def run_base(self, inputs):
+        self.calls.append(("base run", inputs))
+
+    @on_connect("*")
+    async def connected_any(self, topic: str, agent: AgentDetail):
+        self.calls.append(("base *", topic))
+
+
+class TaggedHandler(AgentCommon):
+    def __init__(self):
+        super().__init__()
+        self.values = []
+
+    @on(Renamed, tag="tests.renamed")
+    async def on_renamed(self, message: Renamed):
+        self.values.append(message.value)
+
+
+class HandlerChild(HandlerBase):
+    @on(Ping)
+    async def on_ping(self, ping: Ping, envelope):
+        self.calls.append(("child ping", ping.value, envelope.type_tag))
+
+    @on_run()
+    async def run_child(self, inputs):
+        self.calls.append(("child run", inputs))
+
+    @on_connect("jobs:writer")
+    async def connected_writer(self, topic: str, agent: AgentDetail):
+        self.calls.append(("child jobs:writer", topic))
+
+    @on_connect("*:reader")
+    async def connected_reader(self, topic: str, agent: AgentDetail):
+        self.calls.append(("child *:reader", topic))
+
+
+def test_most_derived_message_handler_wins():
+    table = get_handler_table(HandlerChild)
+    assert table.message[Ping].handler is HandlerChild.on_ping
+    assert table.message[Pong].handler is HandlerBase.on_pong
+    assert get_handler_table(HandlerBase).message[Ping].handler is HandlerBase.on_ping
+
+
+def test_handler_arguments_follow_signature():
+    table = get_handler_table(HandlerChild)
+    assert (table.message[Ping].wants_agent, table.message[Ping].wants_time, table.message[Ping].wants_envelope) == \
+           (False, False, True)
+    assert (table.message[Pong].wants_agent, table.message[Pong].wants_time, table.message[Pong].wants_envelope) == \
+           (True, True, False)
+
+
+def test_table_is_cached_per_class():
+    assert get_handler_table(HandlerChild) is get_handler_table(HandlerChild)
+
+
+def test_dispatch_through_table():
+    async def main():
+        agent = HandlerChild()
+        await agent.common_on_message(peer(), encode_payload(Ping(1)), 5, type_tag(Ping))
+        await agent.common_on_message(peer(), encode_payload(Pong(2)), 6, type_tag(Pong))
+        # Untagged payloads are decoded to find their type
+        await agent.common_on_message(peer(), encode_payload(Pong(3)), 7)
+        await agent.onrun_handler(encode_payload("go"))
+        assert agent.calls == [("child ping", 1, type_tag(Ping)), ("base pong", 2, 6, "peer-id"),
+                               ("base pong", 3, 7, "peer-id"), ("child run", "go"), ("base run", "go")]
+
+    asyncio.run(main())
+
+
+def test_connect_handlers_match_topic_and_role():
+    async def main():
+        agent = HandlerChild()
+        await agent.onconnect_handler("jobs", peer("writer"))
+        await agent.onconnect_handler("jobs", peer("reader"))
+        await agent.onconnect_handler("other", peer("writer"))
+        assert agent.calls == [("child jobs:writer", "jobs"), ("base *", "jobs"),
+                               ("child *:reader", "jobs"), ("base *", "jobs"),
+                               ("base *", "other")]
+
+    asyncio.run(main())
+
+
+def test_connect_index_keeps_registration_order():
+    index = ConnectIndex()
+    handlers = {pattern: object() for pattern in ("jobs:writer", "*", "jobs", "*:writer", "*:*", "jobs:*", "other")}
+    for pattern, handler in handlers.items():
+        index.add(pattern, handler)
+    assert index.match("jobs", "writer") == [handlers[p] for p in ("jobs:writer", "*", "jobs", "*:writer", "*:*",
+                                                                    "jobs:*")]
+    assert index.match("jobs", "reader") == [handlers[p] for p in ("*", "jobs", "*:*", "jobs:*")]
+    assert index.match("other", "reader") == [handlers[p] for p in ("*", "*:*", "other")]
+    assert ConnectIndex().match("jobs", "writer") == []
+
+
+def test_connect_pattern_with_extra_colon_is_rejected():
+    with pytest.raises(ValueError):
+        ConnectIndex().add("jobs:writer:extra", lambda: None)
+    with pytest.raises(ValueError):
+        on_connect("jobs:writer:extra")
+    with pytest.raises(ValueError):
+        AgentCommon().on_connect("a:b:c")
+
+
+def test_explicit_type_tag():
+    async def main():
+        assert type_tag(Renamed) == "tests.renamed"
+        agent = TaggedHandler()
+        await agent.common_on_message(peer(), encode_payload(Renamed(4)), 0, "tests.renamed")
+        assert agent.values == [4]
+
+    asyncio.run(main())
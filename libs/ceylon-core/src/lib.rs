@@ -12,8 +12,15 @@ pub use workspace::{
     MessageHandler,
     EventHandler,
     AgentDetail,
+    InboundMessage,
+    MessageFilter,
     UnifiedAgentConfig,
-    UnifiedAgent
+    UnifiedAgent,
+    AgentDiagnostics,
+    OverflowPolicy,
+    QueueError,
+    QueueStats,
+    configure_runtime
 };
 
-pub use sangedama::peer::PeerMode;
+pub use sangedama::peer::{GossipProfile, PeerMode, TransportMode, WireFormat};
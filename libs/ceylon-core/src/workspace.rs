@@ -6,8 +6,12 @@
 
 mod agent;
 mod message;
+mod queue;
+mod runtime;
 mod uniffied_agent;
 
-pub use agent::{AgentDetail, EventHandler, MessageHandler, Processor};
+pub use agent::{AgentDetail, EventHandler, InboundMessage, MessageFilter, MessageHandler, Processor};
 
-pub use uniffied_agent::{UnifiedAgent, UnifiedAgentConfig};
\ No newline at end of file
+pub use queue::{OverflowPolicy, QueueError, QueueStats};
+pub use runtime::configure_runtime;
+pub use uniffied_agent::{AgentDiagnostics, UnifiedAgent, UnifiedAgentConfig};
\ No newline at end of file
@@ -16,6 +16,39 @@ pub struct AgentDetail {
     pub extra_data: Option<Vec<u8>>,
 }
 
+/// Messages an agent accepts, checked before the payload is decoded. Every list that is set must
+/// contain the corresponding value; messages without a type tag pass the `message_types` check.
+#[derive(Debug, Clone, Default)]
+pub struct MessageFilter {
+    pub sender_ids: Option<Vec<String>>,
+    pub sender_roles: Option<Vec<String>>,
+    pub message_types: Option<Vec<String>>,
+}
+
+impl MessageFilter {
+    pub fn accepts(&self, sender: &AgentDetail, type_tag: Option<&str>) -> bool {
+        fn allowed(values: &Option<Vec<String>>, value: Option<&str>) -> bool {
+            match (values, value) {
+                (Some(values), Some(value)) => values.iter().any(|v| v == value),
+                _ => true,
+            }
+        }
+        allowed(&self.sender_ids, Some(&sender.id))
+            && allowed(&self.sender_roles, Some(&sender.role))
+            && allowed(&self.message_types, type_tag)
+    }
+}
+
+#[derive(Debug, Clone)]
+pub struct InboundMessage {
+    pub agent: AgentDetail,
+    /// The payload, shared with the received frame up to here. uniffi lowers it through a
+    /// `RustBuffer`, so foreign handlers always get their own copy.
+    pub data: Vec<u8>,
+    pub time: u64,
+    pub type_tag: Option<String>,
+}
+
 #[async_trait::async_trait]
 pub trait AgentBase {
     async fn run_(&self, inputs: Vec<u8>);
@@ -24,6 +57,19 @@ pub trait AgentBase {
 #[async_trait::async_trait]
 pub trait MessageHandler: Send + Sync + Debug {
     async fn on_message(&self, agent: AgentDetail, data: Vec<u8>, time: u64);
+
+    /// Receives single messages that carry a type tag, which `on_message` has no room for.
+    async fn on_tagged_message(&self, message: InboundMessage) {
+        self.on_message(message.agent, message.data, message.time)
+            .await;
+    }
+
+    async fn on_message_batch(&self, messages: Vec<InboundMessage>) {
+        for message in messages {
+            self.on_message(message.agent, message.data, message.time)
+                .await;
+        }
+    }
 }
 
 #[async_trait::async_trait]
@@ -6,7 +6,10 @@
 
 // In message.rs
 use crate::AgentDetail;
+use bytes::Bytes;
 use sangedama::peer::message::data::NodeMessage;
+use sangedama::peer::message::wire::{json_bytes, WireError, WireFormat, WireReader, WireWriter};
+use serde::de::IgnoredAny;
 use serde::{Deserialize, Serialize};
 
 #[derive(Debug, Serialize, Deserialize, Clone)]
@@ -19,13 +22,21 @@ pub enum MessageType {
 pub enum AgentMessage {
     SystemMessage {
         id: u64,
-        message: Vec<u8>,
+        #[serde(with = "json_bytes")]
+        message: Bytes,
     },
     NodeMessage {
         id: u64,
         sender: AgentDetail,
-        message: Vec<u8>,
+        #[serde(with = "json_bytes")]
+        message: Bytes,
         message_type: MessageType,
+        /// Identifier of the payload type, set by the sender for receiver-side filtering
+        #[serde(default)]
+        type_tag: Option<String>,
+        /// Only agents with this role handle the message
+        #[serde(default)]
+        target_role: Option<String>,
     },
     AgentIntroduction {
         id: String,
@@ -45,30 +56,172 @@ impl AgentMessage {
     }
 
     pub fn from_bytes(bytes: Vec<u8>) -> Self {
-        serde_json::from_slice(&bytes).unwrap()
+        Self::try_from_bytes(bytes.into()).unwrap()
+    }
+
+    /// Decodes a JSON or binary frame, whichever `bytes` holds. The payload of a binary frame
+    /// is a view into `bytes`.
+    pub fn try_from_bytes(bytes: Bytes) -> Result<Self, WireError> {
+        match WireFormat::detect(&bytes) {
+            Some(WireFormat::Binary) => Self::read_binary(&mut WireReader::new(&bytes)?, &bytes),
+            _ => Ok(serde_json::from_slice(&bytes)?),
+        }
+    }
+
+    pub fn encode(&self, format: WireFormat) -> Vec<u8> {
+        match format {
+            WireFormat::Json => self.to_bytes(),
+            WireFormat::Binary => self.to_binary(),
+        }
+    }
+
+    /// Reads only the routing fields of a `NodeMessage`, skipping over the payload. Returns `None`
+    /// for the other message kinds.
+    pub fn node_message_header(bytes: &[u8]) -> Option<NodeMessageHeader> {
+        match WireFormat::detect(bytes) {
+            Some(WireFormat::Binary) => {
+                let mut reader = WireReader::new(bytes).ok()?;
+                match reader.u8().ok()? {
+                    NODE_MESSAGE => {
+                        reader.u64().ok()?;
+                        NodeMessageHeader::read_binary(&mut reader).ok()
+                    }
+                    _ => None,
+                }
+            }
+            _ => match serde_json::from_slice::<AgentMessageHeader>(bytes) {
+                Ok(AgentMessageHeader::NodeMessage(header)) => Some(header),
+                _ => None,
+            },
+        }
+    }
+
+    // Binary layout: variant byte, then the fields in declaration order except that the payload of
+    // a `NodeMessage` comes last so the routing header can be read without touching it.
+    fn to_binary(&self) -> Vec<u8> {
+        match self {
+            AgentMessage::SystemMessage { id, message } => {
+                let mut writer = WireWriter::new(message.len());
+                writer.put_u8(SYSTEM_MESSAGE);
+                writer.put_u64(*id);
+                writer.put_bytes(message);
+                writer.finish()
+            }
+            AgentMessage::NodeMessage {
+                id,
+                sender,
+                message,
+                message_type,
+                type_tag,
+                target_role,
+            } => {
+                let mut writer = WireWriter::new(message.len());
+                writer.put_u8(NODE_MESSAGE);
+                writer.put_u64(*id);
+                write_agent_detail(&mut writer, sender);
+                match message_type {
+                    MessageType::Broadcast => writer.put_u8(0),
+                    MessageType::Direct { to_peer } => {
+                        writer.put_u8(1);
+                        writer.put_str(to_peer);
+                    }
+                }
+                writer.put_opt_str(type_tag.as_deref());
+                writer.put_opt_str(target_role.as_deref());
+                writer.put_bytes(message);
+                writer.finish()
+            }
+            AgentMessage::AgentIntroduction {
+                id,
+                role,
+                name,
+                topic,
+            } => {
+                let mut writer = WireWriter::new(0);
+                writer.put_u8(AGENT_INTRODUCTION);
+                writer.put_str(id);
+                writer.put_str(role);
+                writer.put_str(name);
+                writer.put_str(topic);
+                writer.finish()
+            }
+            AgentMessage::AgentRegistrationAck { id, status } => {
+                let mut writer = WireWriter::new(0);
+                writer.put_u8(AGENT_REGISTRATION_ACK);
+                writer.put_str(id);
+                writer.put_bool(*status);
+                writer.finish()
+            }
+        }
+    }
+
+    fn read_binary(reader: &mut WireReader, frame: &Bytes) -> Result<Self, WireError> {
+        match reader.u8()? {
+            SYSTEM_MESSAGE => Ok(AgentMessage::SystemMessage {
+                id: reader.u64()?,
+                message: reader.shared_bytes(frame)?,
+            }),
+            NODE_MESSAGE => {
+                let id = reader.u64()?;
+                let header = NodeMessageHeader::read_binary(reader)?;
+                Ok(AgentMessage::NodeMessage {
+                    id,
+                    sender: header.sender,
+                    message: reader.shared_bytes(frame)?,
+                    message_type: header.message_type,
+                    type_tag: header.type_tag,
+                    target_role: header.target_role,
+                })
+            }
+            AGENT_INTRODUCTION => Ok(AgentMessage::AgentIntroduction {
+                id: reader.string()?,
+                role: reader.string()?,
+                name: reader.string()?,
+                topic: reader.string()?,
+            }),
+            AGENT_REGISTRATION_ACK => Ok(AgentMessage::AgentRegistrationAck {
+                id: reader.string()?,
+                status: reader.bool()?,
+            }),
+            variant => Err(WireError::UnknownVariant("AgentMessage", variant)),
+        }
     }
 
-    pub fn create_direct_message(message: Vec<u8>, to_peer: String,sender: AgentDetail) -> Self {
+    pub fn create_direct_message(
+        message: Vec<u8>,
+        to_peer: String,
+        sender: AgentDetail,
+        type_tag: Option<String>,
+    ) -> Self {
         AgentMessage::NodeMessage {
             id: std::time::SystemTime::now()
                 .duration_since(std::time::UNIX_EPOCH)
                 .unwrap()
                 .as_nanos() as u64,
-            message,
+            message: message.into(),
             sender,
             message_type: MessageType::Direct { to_peer },
+            type_tag,
+            target_role: None,
         }
     }
 
-    pub fn create_broadcast_message(message: Vec<u8>,sender: AgentDetail) -> Self {
+    pub fn create_broadcast_message(
+        message: Vec<u8>,
+        sender: AgentDetail,
+        type_tag: Option<String>,
+        target_role: Option<String>,
+    ) -> Self {
         AgentMessage::NodeMessage {
             id: std::time::SystemTime::now()
                 .duration_since(std::time::UNIX_EPOCH)
                 .unwrap()
                 .as_nanos() as u64,
-            message,
+            message: message.into(),
             sender,
             message_type: MessageType::Broadcast,
+            type_tag,
+            target_role,
         }
     }
 
@@ -90,3 +243,193 @@ impl AgentMessage {
         AgentMessage::AgentRegistrationAck { id: peer, status }
     }
 }
+
+/// Routing fields of `AgentMessage::NodeMessage`.
+#[derive(Debug, Deserialize)]
+pub struct NodeMessageHeader {
+    pub sender: AgentDetail,
+    pub message_type: MessageType,
+    #[serde(default)]
+    pub type_tag: Option<String>,
+    #[serde(default)]
+    pub target_role: Option<String>,
+}
+
+impl NodeMessageHeader {
+    fn read_binary(reader: &mut WireReader) -> Result<Self, WireError> {
+        let sender = read_agent_detail(reader)?;
+        let message_type = match reader.u8()? {
+            0 => MessageType::Broadcast,
+            1 => MessageType::Direct {
+                to_peer: reader.string()?,
+            },
+            kind => return Err(WireError::UnknownVariant("MessageType", kind)),
+        };
+        Ok(NodeMessageHeader {
+            sender,
+            message_type,
+            type_tag: reader.opt_string()?,
+            target_role: reader.opt_string()?,
+        })
+    }
+
+    /// Whether the message is addressed to an agent with this id and role.
+    pub fn is_for(&self, peer_id: &str, role: &str) -> bool {
+        if let MessageType::Direct { to_peer } = &self.message_type {
+            if to_peer != peer_id {
+                return false;
+            }
+        }
+        self.target_role
+            .as_deref()
+            .map_or(true, |target_role| target_role == role)
+    }
+}
+
+const SYSTEM_MESSAGE: u8 = 0;
+const NODE_MESSAGE: u8 = 1;
+const AGENT_INTRODUCTION: u8 = 2;
+const AGENT_REGISTRATION_ACK: u8 = 3;
+
+fn write_agent_detail(writer: &mut WireWriter, agent: &AgentDetail) {
+    writer.put_str(&agent.name);
+    writer.put_str(&agent.id);
+    writer.put_str(&agent.role);
+    writer.put_opt_bytes(agent.extra_data.as_deref());
+}
+
+fn read_agent_detail(reader: &mut WireReader) -> Result<AgentDetail, WireError> {
+    Ok(AgentDetail {
+        name: reader.string()?,
+        id: reader.string()?,
+        role: reader.string()?,
+        extra_data: reader.opt_bytes()?,
+    })
+}
+
+// Mirrors `AgentMessage` so the header can be read without decoding the rest.
+#[derive(Deserialize)]
+enum AgentMessageHeader {
+    SystemMessage(IgnoredAny),
+    NodeMessage(NodeMessageHeader),
+    AgentIntroduction(IgnoredAny),
+    AgentRegistrationAck(IgnoredAny),
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const FORMATS: [WireFormat; 2] = [WireFormat::Json, WireFormat::Binary];
+
+    fn sender(extra_data: Option<Vec<u8>>) -> AgentDetail {
+        AgentDetail {
+            name: "worker".to_string(),
+            id: "peer-a".to_string(),
+            role: "scheduler".to_string(),
+            extra_data,
+        }
+    }
+
+    fn samples() -> Vec<AgentMessage> {
+        vec![
+            AgentMessage::SystemMessage {
+                id: 3,
+                message: Bytes::from_static(b"system"),
+            },
+            AgentMessage::create_broadcast_message(
+                vec![0, 1, 2, 255],
+                sender(None),
+                Some("meeting".to_string()),
+                Some("scheduler".to_string()),
+            ),
+            AgentMessage::create_direct_message(
+                vec![],
+                "peer-b".to_string(),
+                sender(Some(vec![4, 5])),
+                None,
+            ),
+            AgentMessage::create_introduction_message(
+                "peer-a".to_string(),
+                "worker".to_string(),
+                "scheduler".to_string(),
+                "workspace".to_string(),
+            ),
+            AgentMessage::create_registration_ack_message("peer-a".to_string(), true),
+        ]
+    }
+
+    // The message types have no `PartialEq`, messages that encode the same are taken as equal
+    fn assert_same(left: &AgentMessage, right: &AgentMessage) {
+        assert_eq!(left.to_bytes(), right.to_bytes());
+    }
+
+    #[test]
+    fn round_trip() {
+        for format in FORMATS {
+            for message in samples() {
+                let frame = message.encode(format);
+                assert_eq!(WireFormat::detect(&frame), Some(format));
+                assert_same(
+                    &AgentMessage::try_from_bytes(frame.into()).unwrap(),
+                    &message,
+                );
+            }
+        }
+    }
+
+    #[test]
+    fn node_message_header() {
+        for format in FORMATS {
+            let messages = samples();
+            let header = AgentMessage::node_message_header(&messages[1].encode(format)).unwrap();
+            assert_eq!(header.sender.id, "peer-a");
+            assert_eq!(header.type_tag.as_deref(), Some("meeting"));
+            assert!(header.is_for("peer-c", "scheduler"));
+            assert!(!header.is_for("peer-c", "planner"));
+
+            let header = AgentMessage::node_message_header(&messages[2].encode(format)).unwrap();
+            assert!(header.is_for("peer-b", "planner"));
+            assert!(!header.is_for("peer-c", "planner"));
+
+            assert!(AgentMessage::node_message_header(&messages[0].encode(format)).is_none());
+            assert!(AgentMessage::node_message_header(&messages[3].encode(format)).is_none());
+        }
+    }
+
+    #[test]
+    fn truncated_frame() {
+        for format in FORMATS {
+            for message in samples() {
+                let frame = Bytes::from(message.encode(format));
+                for end in 0..frame.len() {
+                    assert!(
+                        AgentMessage::try_from_bytes(frame.slice(..end)).is_err(),
+                        "{:?} frame of {:?} cut after {} bytes",
+                        format,
+                        message,
+                        end
+                    );
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn corrupt_frame() {
+        let mut frame = samples()[1].encode(WireFormat::Binary);
+        frame[1] = 9;
+        assert!(matches!(
+            AgentMessage::try_from_bytes(frame.into()),
+            Err(WireError::UnknownVariant("AgentMessage", 9))
+        ));
+
+        // A payload length pointing past the end of the frame
+        let mut frame = samples()[0].encode(WireFormat::Binary);
+        frame[1 + 1 + 8] = 0x7f;
+        assert!(matches!(
+            AgentMessage::try_from_bytes(frame.into()),
+            Err(WireError::UnexpectedEnd)
+        ));
+    }
+}
@@ -0,0 +1,323 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+use std::collections::VecDeque;
+use std::fmt;
+use std::sync::{Arc, Mutex};
+use tokio::sync::Notify;
+
+/// What a full queue does with a message that does not fit.
+#[derive(Clone, Copy, Debug, Default, Eq, PartialEq)]
+pub enum OverflowPolicy {
+    /// Wait for room, the sender runs at the pace of the consumer.
+    #[default]
+    Block,
+    /// Make room by dropping the message that waited longest.
+    DropOldest,
+    /// Drop the message that does not fit.
+    DropNewest,
+    /// Refuse the message and report it to the sender.
+    Error,
+}
+
+#[derive(Clone, Copy, Debug, Eq, PartialEq)]
+pub enum QueueError {
+    /// The queue is full and its policy refuses the message.
+    Full,
+    /// The agent stopped.
+    Closed,
+}
+
+impl fmt::Display for QueueError {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            QueueError::Full => write!(f, "queue is full"),
+            QueueError::Closed => write!(f, "queue is closed"),
+        }
+    }
+}
+
+impl std::error::Error for QueueError {}
+
+/// Fill level of a queue and the messages it lost since the agent was created.
+#[derive(Clone, Debug, Default)]
+pub struct QueueStats {
+    pub policy: OverflowPolicy,
+    pub capacity: u32,
+    pub depth: u32,
+    pub high_water_mark: u32,
+    /// Messages dropped or refused because the queue was full.
+    pub dropped: u64,
+}
+
+struct State<T> {
+    items: VecDeque<T>,
+    closed: bool,
+    high_water_mark: usize,
+    dropped: u64,
+}
+
+struct Shared<T> {
+    state: Mutex<State<T>>,
+    capacity: usize,
+    policy: OverflowPolicy,
+    not_empty: Notify,
+    not_full: Notify,
+}
+
+enum Offer<T> {
+    Wait(T),
+    Failed(QueueError),
+}
+
+/// Bounded FIFO from any number of senders to a single consumer. Unlike an mpsc channel it can
+/// make room by dropping its oldest message, and it keeps track of how full it got.
+pub struct MessageQueue<T> {
+    shared: Arc<Shared<T>>,
+}
+
+impl<T> Clone for MessageQueue<T> {
+    fn clone(&self) -> Self {
+        Self {
+            shared: self.shared.clone(),
+        }
+    }
+}
+
+impl<T> MessageQueue<T> {
+    pub fn new(capacity: usize, policy: OverflowPolicy) -> Self {
+        Self {
+            shared: Arc::new(Shared {
+                state: Mutex::new(State {
+                    items: VecDeque::new(),
+                    closed: false,
+                    high_water_mark: 0,
+                    dropped: 0,
+                }),
+                capacity: capacity.max(1),
+                policy,
+                not_empty: Notify::new(),
+                not_full: Notify::new(),
+            }),
+        }
+    }
+
+    /// Queues a message, waiting for room when the policy is `Block`.
+    pub async fn push(&self, mut item: T) -> Result<(), QueueError> {
+        loop {
+            // Registered before looking at the queue, so room made in between is not missed
+            let room = self.shared.not_full.notified();
+            tokio::pin!(room);
+            room.as_mut().enable();
+            match self.offer(item, true) {
+                Ok(()) => return Ok(()),
+                Err(Offer::Wait(back)) => item = back,
+                Err(Offer::Failed(e)) => return Err(e),
+            }
+            room.await;
+        }
+    }
+
+    /// Queues a message without waiting. A full queue with the `Block` policy refuses it like
+    /// `Error` does.
+    pub fn try_push(&self, item: T) -> Result<(), QueueError> {
+        self.offer(item, false).map_err(|offer| match offer {
+            Offer::Wait(_) => QueueError::Full,
+            Offer::Failed(e) => e,
+        })
+    }
+
+    fn offer(&self, item: T, wait: bool) -> Result<(), Offer<T>> {
+        let shared = &*self.shared;
+        let mut state = shared.state.lock().unwrap();
+        if state.closed {
+            return Err(Offer::Failed(QueueError::Closed));
+        }
+        if state.items.len() >= shared.capacity {
+            match shared.policy {
+                OverflowPolicy::Block if wait => return Err(Offer::Wait(item)),
+                OverflowPolicy::DropOldest => {
+                    state.items.pop_front();
+                    state.dropped += 1;
+                }
+                OverflowPolicy::DropNewest => {
+                    state.dropped += 1;
+                    return Ok(());
+                }
+                OverflowPolicy::Block | OverflowPolicy::Error => {
+                    state.dropped += 1;
+                    return Err(Offer::Failed(QueueError::Full));
+                }
+            }
+        }
+        state.items.push_back(item);
+        state.high_water_mark = state.high_water_mark.max(state.items.len());
+        drop(state);
+        shared.not_empty.notify_one();
+        Ok(())
+    }
+
+    /// Takes the oldest message, waiting for one. `None` once the queue is closed and drained.
+    pub async fn pop(&self) -> Option<T> {
+        loop {
+            let ready = self.shared.not_empty.notified();
+            tokio::pin!(ready);
+            ready.as_mut().enable();
+            {
+                let mut state = self.shared.state.lock().unwrap();
+                if let Some(item) = state.items.pop_front() {
+                    drop(state);
+                    self.shared.not_full.notify_one();
+                    return Some(item);
+                }
+                if state.closed {
+                    return None;
+                }
+            }
+            ready.await;
+        }
+    }
+
+    /// Refuses further messages and wakes everyone waiting on the queue.
+    pub fn close(&self) {
+        self.shared.state.lock().unwrap().closed = true;
+        self.shared.not_empty.notify_waiters();
+        self.shared.not_full.notify_waiters();
+    }
+
+    pub fn stats(&self) -> QueueStats {
+        let state = self.shared.state.lock().unwrap();
+        QueueStats {
+            policy: self.shared.policy,
+            capacity: self.shared.capacity as u32,
+            depth: state.items.len() as u32,
+            high_water_mark: state.high_water_mark as u32,
+            dropped: state.dropped,
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::time::Duration;
+    use tokio::time::timeout;
+
+    const WAIT: Duration = Duration::from_millis(50);
+
+    async fn full_queue(policy: OverflowPolicy) -> MessageQueue<u32> {
+        let queue = MessageQueue::new(2, policy);
+        queue.push(1).await.unwrap();
+        queue.push(2).await.unwrap();
+        queue
+    }
+
+    async fn drain(queue: &MessageQueue<u32>) -> Vec<u32> {
+        queue.close();
+        let mut items = Vec::new();
+        while let Some(item) = queue.pop().await {
+            items.push(item);
+        }
+        items
+    }
+
+    #[tokio::test]
+    async fn block_waits_for_room() {
+        let queue = full_queue(OverflowPolicy::Block).await;
+        assert_eq!(queue.try_push(3), Err(QueueError::Full));
+
+        let pusher = tokio::spawn({
+            let queue = queue.clone();
+            async move { queue.push(3).await }
+        });
+        tokio::time::sleep(WAIT).await;
+        assert!(!pusher.is_finished());
+
+        assert_eq!(queue.pop().await, Some(1));
+        assert_eq!(timeout(WAIT, pusher).await.unwrap().unwrap(), Ok(()));
+        assert_eq!(drain(&queue).await, vec![2, 3]);
+        // The refused try_push
+        assert_eq!(queue.stats().dropped, 1);
+    }
+
+    #[tokio::test]
+    async fn drop_oldest_makes_room() {
+        let queue = full_queue(OverflowPolicy::DropOldest).await;
+        assert_eq!(queue.push(3).await, Ok(()));
+        assert_eq!(queue.try_push(4), Ok(()));
+        let stats = queue.stats();
+        assert_eq!((stats.depth, stats.dropped), (2, 2));
+        assert_eq!(drain(&queue).await, vec![3, 4]);
+    }
+
+    #[tokio::test]
+    async fn drop_newest_discards_the_message() {
+        let queue = full_queue(OverflowPolicy::DropNewest).await;
+        assert_eq!(queue.push(3).await, Ok(()));
+        assert_eq!(queue.try_push(4), Ok(()));
+        assert_eq!(queue.stats().dropped, 2);
+        assert_eq!(drain(&queue).await, vec![1, 2]);
+    }
+
+    #[tokio::test]
+    async fn error_refuses_the_message() {
+        let queue = full_queue(OverflowPolicy::Error).await;
+        assert_eq!(queue.push(3).await, Err(QueueError::Full));
+        assert_eq!(queue.try_push(4), Err(QueueError::Full));
+        assert_eq!(queue.stats().dropped, 2);
+        assert_eq!(drain(&queue).await, vec![1, 2]);
+    }
+
+    #[tokio::test]
+    async fn close_wakes_blocked_pushers() {
+        let queue = full_queue(OverflowPolicy::Block).await;
+        let pushers: Vec<_> = (3..6)
+            .map(|item| {
+                let queue = queue.clone();
+                tokio::spawn(async move { queue.push(item).await })
+            })
+            .collect();
+        tokio::time::sleep(WAIT).await;
+
+        queue.close();
+        for pusher in pushers {
+            assert_eq!(
+                timeout(WAIT, pusher).await.unwrap().unwrap(),
+                Err(QueueError::Closed)
+            );
+        }
+        assert_eq!(queue.try_push(6), Err(QueueError::Closed));
+        // Messages queued before closing are still handed out
+        assert_eq!(drain(&queue).await, vec![1, 2]);
+    }
+
+    #[tokio::test]
+    async fn close_wakes_a_waiting_consumer() {
+        let queue = MessageQueue::<u32>::new(2, OverflowPolicy::Block);
+        let consumer = tokio::spawn({
+            let queue = queue.clone();
+            async move { queue.pop().await }
+        });
+        tokio::time::sleep(WAIT).await;
+        queue.close();
+        assert_eq!(timeout(WAIT, consumer).await.unwrap().unwrap(), None);
+    }
+
+    #[tokio::test]
+    async fn stats_track_the_fill_level() {
+        let queue = MessageQueue::<u32>::new(0, OverflowPolicy::DropOldest);
+        assert_eq!(queue.stats().capacity, 1);
+
+        let queue = full_queue(OverflowPolicy::Block).await;
+        queue.pop().await;
+        let stats = queue.stats();
+        assert_eq!(stats.policy, OverflowPolicy::Block);
+        assert_eq!(
+            (stats.capacity, stats.depth, stats.high_water_mark),
+            (2, 1, 2)
+        );
+    }
+}
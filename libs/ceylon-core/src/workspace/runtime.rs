@@ -0,0 +1,69 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// Process wide Tokio runtime shared by every agent.
+//
+// The runtime is built the first time an agent starts, with the settings of the last
+// `configure_runtime` call made before that. A current thread runtime gets one dedicated thread
+// that drives it, since the foreign executor awaiting the agents never enters it.
+use std::sync::{Mutex, OnceLock};
+use tokio::runtime::{Builder, Runtime};
+use tracing::debug;
+
+#[derive(Clone, Copy, Debug, Default)]
+struct RuntimeSettings {
+    worker_threads: Option<u32>,
+    current_thread: bool,
+}
+
+static RUNTIME: OnceLock<Runtime> = OnceLock::new();
+static SETTINGS: Mutex<RuntimeSettings> = Mutex::new(RuntimeSettings {
+    worker_threads: None,
+    current_thread: false,
+});
+
+/// Sets up the shared runtime. `worker_threads` defaults to the number of cores and is ignored
+/// by a current thread runtime. Returns false, changing nothing, once the runtime exists.
+pub fn configure_runtime(worker_threads: Option<u32>, current_thread: bool) -> bool {
+    if RUNTIME.get().is_some() {
+        return false;
+    }
+    *SETTINGS.lock().unwrap() = RuntimeSettings {
+        worker_threads: worker_threads.filter(|threads| *threads > 0),
+        current_thread,
+    };
+    true
+}
+
+pub(crate) fn shared_runtime() -> &'static Runtime {
+    let mut driver_needed = false;
+    let runtime = RUNTIME.get_or_init(|| {
+        let settings = *SETTINGS.lock().unwrap();
+        debug!("Starting shared runtime {:?}", settings);
+        if settings.current_thread {
+            driver_needed = true;
+            return Builder::new_current_thread().enable_all().build().unwrap();
+        }
+        let mut builder = Builder::new_multi_thread();
+        if let Some(threads) = settings.worker_threads {
+            builder.worker_threads(threads as usize);
+        }
+        builder
+            .thread_name("ceylon-runtime")
+            .enable_all()
+            .build()
+            .unwrap()
+    });
+    if driver_needed {
+        // Only Runtime::block_on runs spawned tasks and the IO and timer drivers of a current
+        // thread runtime, so it needs the static reference and cannot start inside get_or_init
+        std::thread::Builder::new()
+            .name("ceylon-runtime".to_string())
+            .spawn(move || runtime.block_on(std::future::pending::<()>()))
+            .unwrap();
+    }
+    runtime
+}
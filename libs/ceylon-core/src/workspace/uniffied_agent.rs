@@ -7,24 +7,45 @@
 use crate::workspace::agent::{
     AgentDetail, ENV_WORKSPACE_ID, ENV_WORKSPACE_IP, ENV_WORKSPACE_PEER, ENV_WORKSPACE_PORT,
 };
-use crate::workspace::agent::{EventHandler, MessageHandler, Processor};
+use crate::workspace::agent::{
+    EventHandler, InboundMessage, MessageFilter, MessageHandler, Processor,
+};
 use crate::workspace::message::{AgentMessage, MessageType};
+use crate::workspace::queue::{MessageQueue, OverflowPolicy, QueueError, QueueStats};
+use crate::workspace::runtime::shared_runtime;
 use futures::future::join_all;
 use sangedama::peer::message::data::{EventType, NodeMessage, NodeMessageTransporter};
-use sangedama::peer::node::node::{UnifiedPeerConfig, UnifiedPeerImpl};
+use sangedama::peer::node::node::{CoalescingSettings, UnifiedPeerConfig, UnifiedPeerImpl};
 use sangedama::peer::node::peer_builder::{create_key, create_key_from_bytes, get_peer_id};
-use sangedama::peer::PeerMode;
+use sangedama::peer::{GossipProfile, GossipSettings, PeerMode, TransportMode, WireFormat};
 use std::collections::HashMap;
 use std::fs;
+use std::net::{IpAddr, Ipv4Addr};
 use std::sync::Arc;
 use tokio::runtime::Handle;
 use tokio::sync::Mutex;
-use tokio::sync::{mpsc, RwLock};
+use tokio::sync::{mpsc, RwLock, Semaphore};
 use tokio::task::JoinHandle;
+use tokio::time::{Duration, Instant};
 use tokio::{select, signal};
 use tokio_util::sync::CancellationToken;
 use tracing::{debug, error, info};
 const CHANNEL_BUFFER_SIZE: usize = 1024; // Increased from default
+const PUBLISH_BATCH_BYTES: u32 = 64 * 1024;
+const PUBLISH_BATCH_DELAY_US: u64 = 1000;
+const INTRO_RETRY_INITIAL: Duration = Duration::from_millis(100);
+const INTRO_RETRY_MAX: Duration = Duration::from_secs(5);
+// About 25 seconds of retries, a peer that stayed silent that long crashed or cannot ack
+const INTRO_RETRY_ATTEMPTS: u32 = 10;
+
+// Exponential backoff with equal jitter: half of each delay is random, so members that joined
+// together spread out their retries instead of hitting the admin in waves
+fn intro_retry_delay(attempt: u32) -> Duration {
+    let delay = INTRO_RETRY_INITIAL
+        .saturating_mul(1 << attempt.min(16))
+        .min(INTRO_RETRY_MAX);
+    delay / 2 + delay.mul_f64(rand::random::<f64>() / 2.0)
+}
 
 #[derive(Clone, Default, Debug)]
 pub struct UnifiedAgentConfig {
@@ -36,13 +57,88 @@ pub struct UnifiedAgentConfig {
     pub admin_peer: Option<String>,
     pub admin_ip: Option<String>,
     pub buffer_size: Option<u16>,
+    /// Upper bound of concurrently running `on_message` calls. `None` or `1` delivers messages
+    /// one at a time in arrival order.
+    pub max_inflight_messages: Option<u32>,
+    /// Deliver up to this many queued messages per `on_message_batch` call. `None` or `1`
+    /// keeps one `on_message` call per message.
+    pub message_batch_size: Option<u32>,
+    /// How long a batch may wait for more messages after the first one arrived.
+    pub message_batch_delay_us: Option<u64>,
+    /// Encoding of outgoing messages, `None` keeps JSON. Peers decode both formats, so switch
+    /// to `Binary` once every agent in the workspace runs a version that reads it.
+    pub wire_format: Option<WireFormat>,
+    /// How agents in the same process reach each other, `None` uses channels for them and the
+    /// network for everyone else. `Broker` relays everything through the admin instead.
+    /// Channels (`Auto`, `InProcess`) never hold up the sender: under load, messages for a
+    /// receiver whose channel and spill queue are full are dropped with a warning. The network
+    /// path applies backpressure instead, see `outbound_overflow`.
+    pub transport: Option<TransportMode>,
+    /// Address the broker of an admin listens on, `None` keeps loopback so only members on its
+    /// host can join. Broker connections are not encrypted or authenticated, so anyone reaching
+    /// this address can read and inject messages; only use other addresses on trusted networks.
+    pub broker_bind_address: Option<String>,
+    /// Whether agents in other processes on this host are reached over shared memory rings,
+    /// `None` keeps the network for them. Ignored by the in-process transport.
+    pub shared_memory: Option<bool>,
+    /// How long gossipsub remembers the ids of seen messages, `None` keeps 60 seconds. Shorter
+    /// windows use less memory in busy workspaces.
+    pub seen_cache_ttl_ms: Option<u64>,
+    /// Gossipsub starting point, `None` keeps `Standard`. The `gossip_*` values below override
+    /// single settings of it; overrides gossipsub cannot run with are ignored.
+    pub gossip_profile: Option<GossipProfile>,
+    pub gossip_heartbeat_ms: Option<u64>,
+    pub gossip_mesh_n: Option<u32>,
+    pub gossip_mesh_n_low: Option<u32>,
+    pub gossip_mesh_n_high: Option<u32>,
+    pub gossip_history_length: Option<u32>,
+    pub gossip_history_gossip: Option<u32>,
+    /// Pack up to this many outgoing broadcasts into one published frame. `None` or `1`
+    /// publishes every message on its own. Agents of earlier versions cannot read packed frames.
+    pub publish_batch_size: Option<u32>,
+    /// Publish a packed frame once it holds this many bytes, 64 KiB when `None`.
+    pub publish_batch_bytes: Option<u32>,
+    /// How long the first broadcast of a packed frame may wait for more, 1 ms when `None`.
+    pub publish_batch_delay_us: Option<u64>,
+    /// Capacity of the outbound and inbound queues, `None` falls back to `buffer_size`.
+    pub queue_capacity: Option<u32>,
+    /// What sending does while the outbound queue is full, `None` waits for room. With `Error`
+    /// the send fails with `QueueError::Full`.
+    pub outbound_overflow: Option<OverflowPolicy>,
+    /// What happens to arriving messages while the handlers are behind, `None` waits for room,
+    /// which holds up the peer and everything it receives. `Error` drops them like
+    /// `DropNewest`, there is no sender to report to.
+    pub inbound_overflow: Option<OverflowPolicy>,
+}
+
+/// Settings an agent runs with, once defaults and profiles are resolved.
+#[derive(Clone, Debug)]
+pub struct AgentDiagnostics {
+    pub transport: TransportMode,
+    pub wire_format: WireFormat,
+    pub gossip_profile: GossipProfile,
+    pub gossip_heartbeat_ms: u64,
+    pub gossip_mesh_n: u32,
+    pub gossip_mesh_n_low: u32,
+    pub gossip_mesh_n_high: u32,
+    pub gossip_history_length: u32,
+    pub gossip_history_gossip: u32,
+    pub gossip_flood_publish: bool,
+    pub seen_cache_ttl_ms: u64,
 }
 
 impl UnifiedAgentConfig {
     fn to_str(&self) -> String {
         format!(
-            "name: {}, role: {:?}, work_space_id: {:?}, admin_peer: {:?}, admin_port: {:?}, admin_ip: {:?}, config_file {:?} ",
-            self.name, self.role, self.work_space_id, self.admin_peer, self.port, self.admin_ip, self.buffer_size
+            "name: {}, mode: {:?}, role: {:?}, work_space_id: {:?}, admin_peer: {:?}, admin_port: {:?}, admin_ip: {:?}, buffer_size {:?}, max_inflight_messages {:?}, message_batch_size {:?}, message_batch_delay_us {:?}, wire_format {:?}, transport {:?}, broker_bind_address {:?}, shared_memory {:?}, seen_cache_ttl_ms {:?}, gossip_profile {:?}, gossip_heartbeat_ms {:?}, gossip_mesh_n {:?}, gossip_mesh_n_low {:?}, gossip_mesh_n_high {:?}, gossip_history_length {:?}, gossip_history_gossip {:?}, publish_batch_size {:?}, publish_batch_bytes {:?}, publish_batch_delay_us {:?}, queue_capacity {:?}, outbound_overflow {:?}, inbound_overflow {:?} ",
+            self.name, self.mode, self.role, self.work_space_id, self.admin_peer, self.port, self.admin_ip, self.buffer_size, self.max_inflight_messages,
+            self.message_batch_size, self.message_batch_delay_us, self.wire_format, self.transport,
+            self.broker_bind_address,
+            self.shared_memory, self.seen_cache_ttl_ms, self.gossip_profile,
+            self.gossip_heartbeat_ms, self.gossip_mesh_n, self.gossip_mesh_n_low, self.gossip_mesh_n_high,
+            self.gossip_history_length, self.gossip_history_gossip,
+            self.publish_batch_size, self.publish_batch_bytes, self.publish_batch_delay_us,
+            self.queue_capacity, self.outbound_overflow, self.inbound_overflow
         )
     }
 }
@@ -110,6 +206,27 @@ impl UnifiedAgentConfig {
         self.admin_peer = _conf.admin_peer.clone();
         self.admin_ip = _conf.admin_ip.clone();
         self.buffer_size = _conf.buffer_size.clone();
+        self.max_inflight_messages = _conf.max_inflight_messages;
+        self.message_batch_size = _conf.message_batch_size;
+        self.message_batch_delay_us = _conf.message_batch_delay_us;
+        self.wire_format = _conf.wire_format;
+        self.transport = _conf.transport;
+        self.broker_bind_address = _conf.broker_bind_address.clone();
+        self.shared_memory = _conf.shared_memory;
+        self.seen_cache_ttl_ms = _conf.seen_cache_ttl_ms;
+        self.gossip_profile = _conf.gossip_profile;
+        self.gossip_heartbeat_ms = _conf.gossip_heartbeat_ms;
+        self.gossip_mesh_n = _conf.gossip_mesh_n;
+        self.gossip_mesh_n_low = _conf.gossip_mesh_n_low;
+        self.gossip_mesh_n_high = _conf.gossip_mesh_n_high;
+        self.gossip_history_length = _conf.gossip_history_length;
+        self.gossip_history_gossip = _conf.gossip_history_gossip;
+        self.publish_batch_size = _conf.publish_batch_size;
+        self.publish_batch_bytes = _conf.publish_batch_bytes;
+        self.publish_batch_delay_us = _conf.publish_batch_delay_us;
+        self.queue_capacity = _conf.queue_capacity;
+        self.outbound_overflow = _conf.outbound_overflow;
+        self.inbound_overflow = _conf.inbound_overflow;
     }
 }
 
@@ -117,11 +234,11 @@ pub struct UnifiedAgent {
     _config: UnifiedAgentConfig,
     _config_path: Option<String>,
     _processor: Arc<Mutex<Arc<dyn Processor>>>,
-    _on_message: Arc<Mutex<Arc<dyn MessageHandler>>>,
+    _on_message: Arc<dyn MessageHandler>,
     _on_event: Arc<Mutex<Arc<dyn EventHandler>>>,
 
-    pub broadcast_emitter: mpsc::Sender<NodeMessageTransporter>,
-    pub broadcast_receiver: Arc<Mutex<mpsc::Receiver<NodeMessageTransporter>>>,
+    _outbound_queue: MessageQueue<NodeMessageTransporter>,
+    _inbound_queue: MessageQueue<InboundMessage>,
 
     _peer_id: String,
     _key: Vec<u8>,
@@ -131,6 +248,8 @@ pub struct UnifiedAgent {
 
     _connected_agents: Arc<RwLock<HashMap<String, AgentDetail>>>,
 
+    _message_filter: Arc<RwLock<Option<MessageFilter>>>,
+
     _cancel_token: CancellationToken,
 
     _extra_data: Option<Vec<u8>>,
@@ -145,12 +264,19 @@ impl UnifiedAgent {
         on_event: Arc<dyn EventHandler>,
         extra_data: Option<Vec<u8>>,
     ) -> Self {
-        let (broadcast_emitter, broadcast_receiver) = mpsc::channel(
-            config
-                .clone()
-                .unwrap_or_default()
+        let queue_config = config.clone().unwrap_or_default();
+        let queue_capacity = queue_config.queue_capacity.unwrap_or(
+            queue_config
                 .buffer_size
-                .unwrap_or(CHANNEL_BUFFER_SIZE as u16) as usize,
+                .unwrap_or(CHANNEL_BUFFER_SIZE as u16) as u32,
+        ) as usize;
+        let outbound_queue = MessageQueue::new(
+            queue_capacity,
+            queue_config.outbound_overflow.unwrap_or_default(),
+        );
+        let inbound_queue = MessageQueue::new(
+            queue_capacity,
+            queue_config.inbound_overflow.unwrap_or_default(),
         );
         let admin_peer_key = create_key();
         let id = get_peer_id(&admin_peer_key).to_string();
@@ -179,11 +305,11 @@ impl UnifiedAgent {
                 Some("./.ceylon_network".to_string())
             },
             _processor: Arc::new(Mutex::new(processor)),
-            _on_message: Arc::new(Mutex::new(on_message)),
+            _on_message: on_message,
             _on_event: Arc::new(Mutex::new(on_event)),
 
-            broadcast_emitter,
-            broadcast_receiver: Arc::new(Mutex::new(broadcast_receiver)),
+            _outbound_queue: outbound_queue,
+            _inbound_queue: inbound_queue,
 
             _peer_id: id,
             _key: admin_peer_key.to_protobuf_encoding().unwrap(),
@@ -193,42 +319,185 @@ impl UnifiedAgent {
 
             _connected_agents: Arc::new(RwLock::new(HashMap::new())),
 
+            _message_filter: Arc::new(RwLock::new(None)),
+
             _cancel_token: CancellationToken::new(),
 
             _extra_data: extra_data,
         }
     }
 
-    pub async fn send_direct(&self, to_peer: String, message: Vec<u8>) {
-        let node_message =
-            AgentMessage::create_direct_message(message, to_peer.clone(), self.details().clone());
+    pub async fn send_direct(&self, to_peer: String, message: Vec<u8>) -> Result<(), QueueError> {
+        self.send_direct_tagged(to_peer, message, None).await
+    }
+
+    pub async fn send_direct_tagged(
+        &self,
+        to_peer: String,
+        message: Vec<u8>,
+        type_tag: Option<String>,
+    ) -> Result<(), QueueError> {
         debug!("Sending direct message to {}", to_peer);
-        match self
-            .broadcast_emitter
-            .send((self.details().id, node_message.to_bytes(), Some(to_peer)))
-            .await
-        {
-            Ok(_) => {}
-            Err(e) => {
-                error!("Failed to send direct message: {:?}", e);
-            }
+        let frame = self.direct_frame(to_peer, message, type_tag);
+        self._outbound_queue.push(frame).await
+    }
+
+    /// Same as `send_direct_tagged` without waiting for room, a full queue refuses the message
+    /// with `QueueError::Full` unless its policy drops messages instead.
+    pub fn try_send_direct(
+        &self,
+        to_peer: String,
+        message: Vec<u8>,
+        type_tag: Option<String>,
+    ) -> Result<(), QueueError> {
+        let frame = self.direct_frame(to_peer, message, type_tag);
+        self._outbound_queue.try_push(frame)
+    }
+
+    pub async fn broadcast(&self, message: Vec<u8>) -> Result<(), QueueError> {
+        self.broadcast_tagged(message, None, None).await
+    }
+
+    /// Broadcast with an optional payload type tag and an optional role that should handle it.
+    pub async fn broadcast_tagged(
+        &self,
+        message: Vec<u8>,
+        type_tag: Option<String>,
+        target_role: Option<String>,
+    ) -> Result<(), QueueError> {
+        let frame = self.broadcast_frame(message, type_tag, target_role);
+        self._outbound_queue.push(frame).await
+    }
+
+    /// Same as `broadcast_tagged` without waiting for room, see `try_send_direct`.
+    pub fn try_broadcast(
+        &self,
+        message: Vec<u8>,
+        type_tag: Option<String>,
+        target_role: Option<String>,
+    ) -> Result<(), QueueError> {
+        let frame = self.broadcast_frame(message, type_tag, target_role);
+        self._outbound_queue.try_push(frame)
+    }
+
+    fn direct_frame(
+        &self,
+        to_peer: String,
+        message: Vec<u8>,
+        type_tag: Option<String>,
+    ) -> NodeMessageTransporter {
+        let node_message = AgentMessage::create_direct_message(
+            message,
+            to_peer.clone(),
+            self.details().clone(),
+            type_tag,
+        );
+        (
+            self.details().id,
+            node_message.encode(self.wire_format()),
+            Some(to_peer),
+        )
+    }
+
+    fn broadcast_frame(
+        &self,
+        message: Vec<u8>,
+        type_tag: Option<String>,
+        target_role: Option<String>,
+    ) -> NodeMessageTransporter {
+        let node_message = AgentMessage::create_broadcast_message(
+            message,
+            self.details().clone(),
+            type_tag,
+            target_role,
+        );
+        (
+            self.details().id,
+            node_message.encode(self.wire_format()),
+            None,
+        )
+    }
+
+    pub fn outbound_queue_stats(&self) -> QueueStats {
+        self._outbound_queue.stats()
+    }
+
+    pub fn inbound_queue_stats(&self) -> QueueStats {
+        self._inbound_queue.stats()
+    }
+
+    fn wire_format(&self) -> WireFormat {
+        match self._config.wire_format {
+            Some(wire_format) => wire_format,
+            // No other peer version has to read the frames
+            None if self.transport() == TransportMode::InProcess => WireFormat::Binary,
+            None => WireFormat::default(),
         }
     }
 
-    pub async fn broadcast(&self, message: Vec<u8>) {
-        let node_message = AgentMessage::create_broadcast_message(message, self.details().clone());
-        match self
-            .broadcast_emitter
-            .send((self.details().id, node_message.to_bytes(), None))
-            .await
-        {
-            Ok(_) => {}
-            Err(e) => {
-                error!("Failed to send broadcast message: {:?}", e);
-            }
+    fn gossip_settings(&self) -> GossipSettings {
+        let config = &self._config;
+        let mut gossip = GossipSettings {
+            profile: config.gossip_profile.unwrap_or_default(),
+            heartbeat: config.gossip_heartbeat_ms.map(Duration::from_millis),
+            mesh_n: config.gossip_mesh_n.map(|n| n as usize),
+            mesh_n_low: config.gossip_mesh_n_low.map(|n| n as usize),
+            mesh_n_high: config.gossip_mesh_n_high.map(|n| n as usize),
+            history_length: config.gossip_history_length.map(|n| n as usize),
+            history_gossip: config.gossip_history_gossip.map(|n| n as usize),
+            ..GossipSettings::default()
+        };
+        if let Some(ttl) = config.seen_cache_ttl_ms {
+            gossip.seen_ttl = Duration::from_millis(ttl);
+        }
+        gossip
+    }
+
+    fn coalescing_settings(&self) -> Option<CoalescingSettings> {
+        let config = &self._config;
+        let max_messages = config.publish_batch_size.filter(|size| *size > 1)?;
+        Some(CoalescingSettings {
+            max_messages: max_messages as usize,
+            max_bytes: config.publish_batch_bytes.unwrap_or(PUBLISH_BATCH_BYTES) as usize,
+            max_delay: Duration::from_micros(
+                config.publish_batch_delay_us.unwrap_or(PUBLISH_BATCH_DELAY_US),
+            ),
+        })
+    }
+
+    pub fn diagnostics(&self) -> AgentDiagnostics {
+        let gossip = self.gossip_settings();
+        let params = gossip.params();
+        AgentDiagnostics {
+            transport: self.transport(),
+            wire_format: self.wire_format(),
+            gossip_profile: gossip.profile,
+            gossip_heartbeat_ms: params.heartbeat.as_millis() as u64,
+            gossip_mesh_n: params.mesh_n as u32,
+            gossip_mesh_n_low: params.mesh_n_low as u32,
+            gossip_mesh_n_high: params.mesh_n_high as u32,
+            gossip_history_length: params.history_length as u32,
+            gossip_history_gossip: params.history_gossip as u32,
+            gossip_flood_publish: params.flood_publish,
+            seen_cache_ttl_ms: params.seen_ttl.as_millis() as u64,
+        }
+    }
+
+    fn broker_bind(&self) -> IpAddr {
+        let loopback = Ipv4Addr::LOCALHOST.into();
+        match &self._config.broker_bind_address {
+            Some(address) => address.parse().unwrap_or_else(|e| {
+                error!("Invalid broker bind address {}: {}", address, e);
+                loopback
+            }),
+            None => loopback,
         }
     }
 
+    fn transport(&self) -> TransportMode {
+        self._config.transport.unwrap_or_default()
+    }
+
     pub fn details(&self) -> AgentDetail {
         AgentDetail {
             name: self._config.name.clone(),
@@ -243,11 +512,14 @@ impl UnifiedAgent {
         agents.values().cloned().collect()
     }
 
+    /// Inbound messages rejected by the filter are dropped before their payload is decoded and
+    /// never reach the message handler. `None` accepts everything.
+    pub async fn set_message_filter(&self, filter: Option<MessageFilter>) {
+        *self._message_filter.write().await = filter;
+    }
+
     pub async fn start(&self, inputs: Vec<u8>, agents: Option<Vec<Arc<UnifiedAgent>>>) {
-        let runtime = tokio::runtime::Builder::new_multi_thread()
-            .enable_all()
-            .build()
-            .unwrap();
+        let runtime = shared_runtime();
 
         let cancel_token = self._cancel_token.clone();
 
@@ -368,7 +640,14 @@ impl UnifiedAgent {
                 config.admin_ip.clone().unwrap_or_default(),
                 config.buffer_size,
             ),
-        };
+        }
+        .with_wire_format(self.wire_format())
+        .with_transport(self.transport())
+        .with_broker_bind(self.broker_bind())
+        .with_shared_memory(self._config.shared_memory.unwrap_or(false))
+        .with_gossip(self.gossip_settings())
+        .with_coalescing(self.coalescing_settings());
+        let wire_format = self.wire_format();
 
         // let worker_details: RwLock<HashMap<String, AgentDetail>> = RwLock::new(HashMap::new());
         // Create peer and listener
@@ -381,30 +660,51 @@ impl UnifiedAgent {
         let peer_emitter_clone = peer.emitter().clone();
         let broadcast_emitter_clone = peer.emitter().clone();
 
-        // Spawn peer runner with proper cancellation
+        // Spawn peer runner, it stops on the token itself. Dropping it from a select on the token
+        // would skip its cleanup, e.g. leaving the in-process bus.
         let cancel_token_clone = cancel_token.clone();
         let task_peer = handle.spawn(async move {
-            select! {
-                _ = peer.run(cancel_token_clone.clone()) => {
-                    debug!("Peer run completed");
-                }
-                _ = cancel_token_clone.cancelled() => {
-                    debug!("Peer run cancelled");
-                }
-            }
+            peer.run(cancel_token_clone).await;
+            debug!("Peer run completed");
         });
 
-        let registration_intro_send_cancel_token = CancellationToken::new();
-
         let on_message = self._on_message.clone();
         let on_event = self._on_event.clone();
         let peer_id = self._peer_id.clone();
         let cancel_token_clone = cancel_token.clone();
 
+        let inflight = config
+            .max_inflight_messages
+            .filter(|limit| *limit > 1)
+            .map(|limit| Arc::new(Semaphore::new(limit as usize)));
+
+        let inbound_queue = self._inbound_queue.clone();
+        let task_dispatcher = match config.message_batch_size.filter(|size| *size > 1) {
+            Some(batch_size) => handle.spawn(run_batch_dispatcher(
+                inbound_queue.clone(),
+                on_message.clone(),
+                inflight.clone(),
+                batch_size as usize,
+                Duration::from_micros(config.message_batch_delay_us.unwrap_or(0)),
+                cancel_token.clone(),
+            )),
+            None => handle.spawn(run_dispatcher(
+                inbound_queue.clone(),
+                on_message.clone(),
+                inflight.clone(),
+                cancel_token.clone(),
+            )),
+        };
+
+        let message_filter = self._message_filter.clone();
+
         let my_self_details = self.details().clone();
         // Handle peer events
         let task_peer_listener = handle.spawn(async move {
             let mut is_call_agent_on_connect_list: HashMap<String, bool> = HashMap::new();
+            let admin_peer_id = config.admin_peer.clone();
+            // Retries of a member's introduction to the admin, until it acks
+            let mut admin_intro: Option<CancellationToken> = None;
 
             loop {
                 select! {
@@ -421,27 +721,47 @@ impl UnifiedAgent {
                             // debug!( "Node Message: {:?}", node_message);
                             match node_message {
                                 NodeMessage::Message{ data, created_by, time, .. } => {
-                                    let agent_message = AgentMessage::from_bytes(data);
+                                    if let Some(filter) = message_filter.read().await.as_ref() {
+                                        if let Some(header) = AgentMessage::node_message_header(&data) {
+                                            if !header.is_for(&peer_id, &my_self_details.role)
+                                                || !filter.accepts(&header.sender, header.type_tag.as_deref()) {
+                                                debug!("Filtered message from {}", header.sender.id);
+                                                continue;
+                                            }
+                                        }
+                                    }
+                                    let agent_message = match AgentMessage::try_from_bytes(data) {
+                                        Ok(agent_message) => agent_message,
+                                        Err(e) => {
+                                            error!("Dropping undecodable message from {}: {}", created_by, e);
+                                            continue;
+                                        }
+                                    };
                                     debug!( "Agent message from data: {:#?}", agent_message);
                                     match agent_message {
-                                        AgentMessage::NodeMessage { message, message_type,sender, .. } => {
+                                        AgentMessage::NodeMessage { message, message_type, sender, target_role, type_tag, .. } => {
                                             debug!( "Agent message: {:#?}", message);
+                                            if target_role.as_ref().is_some_and(|role| *role != my_self_details.role) {
+                                                continue;
+                                            }
                                             match message_type {
                                                 MessageType::Direct { to_peer } => {
                                                     if to_peer == peer_id {
-                                                        on_message.lock().await.on_message(
-                                                            sender,
-                                                            message,
+                                                        queue_inbound(&inbound_queue, InboundMessage {
+                                                            agent: sender,
+                                                            data: message.into(),
                                                             time,
-                                                        ).await;
+                                                            type_tag,
+                                                        }).await;
                                                     }
                                                 }
                                                 MessageType::Broadcast => {
-                                                    on_message.lock().await.on_message(
-                                                        sender,
-                                                        message,
+                                                    queue_inbound(&inbound_queue, InboundMessage {
+                                                        agent: sender,
+                                                        data: message.into(),
                                                         time,
-                                                    ).await;
+                                                        type_tag,
+                                                    }).await;
                                                 }
                                             }
                                         }
@@ -455,27 +775,31 @@ impl UnifiedAgent {
                                                 role,
                                                 extra_data: None,
                                             };
-                                            worker_details.write().await.insert(id_key, _ag.clone());
+                                            let is_new = worker_details.write().await.insert(id_key, _ag.clone()).is_none();
+                                            // Acked every time, the ack before may have been lost
                                             let agent_intro_message = AgentMessage::create_registration_ack_message(
                                                     peer_id.clone(),
                                                     true,
                                                 );
                                                 peer_emitter_clone.send(
-                                                    (my_self_details.id.clone(),agent_intro_message.to_bytes(),None)
+                                                    (my_self_details.id.clone(),agent_intro_message.encode(wire_format),Some(peer_id))
                                                 ).await.unwrap();
 
-
-                                            on_event.lock().await.on_agent_connected(
-                                                topic.clone(),
-                                                _ag.clone()
-                                            ).await;
+                                            if is_new {
+                                                on_event.lock().await.on_agent_connected(
+                                                    topic.clone(),
+                                                    _ag.clone()
+                                                ).await;
+                                            }
 
                                             debug!( "{:?} Worker details: {:#?}", my_self_details.clone().id, worker_details.read().await);
                                         }
                                         AgentMessage::AgentRegistrationAck { id,status } => {
-                                            debug!( "Agent registration ack: {:#?}", status);
-                                            if (status){
-                                                registration_intro_send_cancel_token.cancel();
+                                            debug!( "Agent registration ack from {}: {:#?}", created_by, status);
+                                            if status && id == peer_id && admin_peer_id.as_ref() == Some(&created_by) {
+                                                if let Some(retry) = admin_intro.take() {
+                                                    retry.cancel();
+                                                }
                                             }
                                         }
                                         _ => {}
@@ -494,28 +818,48 @@ impl UnifiedAgent {
                                                     my_self_details.clone().name,
                                                     my_self_details.clone().role,
                                                     topic.clone(),
-                                                );
-                                                let _cancel_token = registration_intro_send_cancel_token.clone();
+                                                ).encode(wire_format);
                                                 let _emitter = peer_emitter_clone.clone();
                                                 let _id = my_self_details.id.clone();
 
-
-                                                if config.mode == PeerMode::Admin {
+                                                // Introductions go to the subscribing peer only, once. Only a
+                                                // member retries, and only towards the admin until it acks, so
+                                                // retries grow with the members instead of every pair of them.
+                                                let to_admin = config.mode == PeerMode::Client
+                                                    && admin_peer_id.as_ref() == Some(&peer_id);
+                                                if !to_admin {
                                                     _emitter.send(
-                                                            (_id.clone(),agent_intro_message.to_bytes(),None)
+                                                            (_id.clone(),agent_intro_message,Some(peer_id))
                                                         ).await.unwrap();
-                                                }else{
+                                                } else if admin_intro.as_ref().map_or(true, |retry| retry.is_cancelled()) {
+                                                    // Retries that gave up cancelled their own token
+                                                    let _cancel_token = cancel_token_clone.child_token();
+                                                    admin_intro = Some(_cancel_token.clone());
                                                     tokio::spawn(async move {
-                                                    loop{
-                                                        if _cancel_token.is_cancelled() {
-                                                            break;
+                                                        for attempt in 0..INTRO_RETRY_ATTEMPTS {
+                                                            if _emitter.send(
+                                                                (_id.clone(),agent_intro_message.clone(),Some(peer_id.clone()))
+                                                            ).await.is_err() {
+                                                                break;
+                                                            }
+                                                            select! {
+                                                                _ = _cancel_token.cancelled() => break,
+                                                                _ = tokio::time::sleep(intro_retry_delay(attempt)) => {}
+                                                            }
                                                         }
-                                                        tokio::time::sleep(tokio::time::Duration::from_millis(100)).await;
-                                                            _emitter.send(
-                                                            (_id.clone(),agent_intro_message.to_bytes(),None)
-                                                        ).await.unwrap();
-                                                    }
-                                                });
+                                                        if !_cancel_token.is_cancelled() {
+                                                            debug!("No ack from {} after {} introductions", peer_id, INTRO_RETRY_ATTEMPTS);
+                                                        }
+                                                        _cancel_token.cancel();
+                                                    });
+                                                }
+                                            }
+                                        }
+                                        EventType::Unsubscribe{ peer_id, .. } => {
+                                            // Nobody left to ack the introduction
+                                            if admin_peer_id.as_ref() == Some(&peer_id) {
+                                                if let Some(retry) = admin_intro.take() {
+                                                    retry.cancel();
                                                 }
                                             }
                                         }
@@ -525,6 +869,10 @@ impl UnifiedAgent {
                                     }
                                 }
                             }
+                        } else {
+                            // The peer stopped and closed its channel, which would now be always ready
+                            debug!("Peer listener shutting down");
+                            break;
                         }
                     }
                 }
@@ -536,29 +884,25 @@ impl UnifiedAgent {
         let cancel_token_clone = cancel_token.clone();
         let task_processor = handle.spawn(async move {
             processor.lock().await.run(inputs).await;
-            loop {
-                if cancel_token_clone.is_cancelled() {
-                    debug!("Processor shutting down");
-                    break;
-                }
-                tokio::time::sleep(tokio::time::Duration::from_nanos(100)).await;
-            }
+            cancel_token_clone.cancelled().await;
+            debug!("Processor shutting down");
         });
 
         // Spawn broadcast handler with proper cancellation
-        let broadcast_receiver = self.broadcast_receiver.clone();
+        let outbound_queue = self._outbound_queue.clone();
         let cancel_token_clone = cancel_token.clone();
         let task_broadcast = handle.spawn(async move {
-            let mut broadcast_receiver_lock = broadcast_receiver.lock().await;
             loop {
                 select! {
                     _ = cancel_token_clone.cancelled() => {
                         debug!("Broadcast handler shutting down");
                         break;
                     }
-                    msg = broadcast_receiver_lock.recv() => {
-                        if let Some(raw_data) = msg {
-                            broadcast_emitter_clone.send(raw_data).await.unwrap();
+                    msg = outbound_queue.pop() => {
+                        match msg {
+                            Some(raw_data) => broadcast_emitter_clone.send(raw_data).await.unwrap(),
+                            // A closed queue is always ready, waiting on it again would spin
+                            None => break,
                         }
                     }
                 }
@@ -569,18 +913,14 @@ impl UnifiedAgent {
 
         let cancel_token_clone = cancel_token.clone();
         let run_holder_process = handle.spawn(async move {
-            loop {
-                if cancel_token_clone.is_cancelled() {
-                    break;
-                }
-                tokio::time::sleep(tokio::time::Duration::from_secs(1)).await;
-            }
+            cancel_token_clone.cancelled().await;
         });
         vec![
             task_peer,
             task_peer_listener,
             task_processor,
             task_broadcast,
+            task_dispatcher,
             run_holder_process,
         ]
     }
@@ -588,8 +928,9 @@ impl UnifiedAgent {
     async fn cleanup(&self) {
         // Release any resources that need explicit cleanup
         debug!("Cleaning up agent resources");
-        // Close channels
-        drop(self.broadcast_emitter.clone());
+        // Close queues, senders still waiting for room give up
+        self._outbound_queue.close();
+        self._inbound_queue.close();
         // Any other cleanup...
     }
 
@@ -600,3 +941,137 @@ impl UnifiedAgent {
         self.cleanup().await;
     }
 }
+
+/// Hands a received message to the dispatcher. Under a dropping policy a full queue sheds
+/// messages here, so slow handlers never hold up the peer.
+async fn queue_inbound(queue: &MessageQueue<InboundMessage>, message: InboundMessage) {
+    if let Err(e) = queue.push(message).await {
+        debug!("Dropped inbound message: {}", e);
+    }
+}
+
+/// Delivers queued messages one at a time, see `dispatch_message`.
+async fn run_dispatcher(
+    inbound: MessageQueue<InboundMessage>,
+    on_message: Arc<dyn MessageHandler>,
+    inflight: Option<Arc<Semaphore>>,
+    cancel_token: CancellationToken,
+) {
+    loop {
+        let message = select! {
+            _ = cancel_token.cancelled() => {
+                debug!("Message dispatcher shutting down");
+                break;
+            }
+            message = inbound.pop() => match message {
+                Some(message) => message,
+                None => break,
+            }
+        };
+        dispatch_message(on_message.clone(), inflight.clone(), message).await;
+    }
+}
+
+/// Hands a message to the foreign handler. Without a limit the call is awaited inline, which keeps
+/// strict arrival order; with one the call runs on its own task once a slot is free, so the
+/// dispatcher only waits when `max_inflight_messages` handlers are already busy.
+async fn dispatch_message(
+    on_message: Arc<dyn MessageHandler>,
+    inflight: Option<Arc<Semaphore>>,
+    message: InboundMessage,
+) {
+    match inflight {
+        Some(semaphore) => {
+            let permit = match semaphore.acquire_owned().await {
+                Ok(permit) => permit,
+                Err(e) => {
+                    error!("Message dispatch closed: {:?}", e);
+                    return;
+                }
+            };
+            tokio::spawn(async move {
+                call_handler(on_message.as_ref(), message).await;
+                drop(permit);
+            });
+        }
+        None => {
+            call_handler(on_message.as_ref(), message).await;
+        }
+    }
+}
+
+async fn call_handler(on_message: &dyn MessageHandler, message: InboundMessage) {
+    if message.type_tag.is_some() {
+        on_message.on_tagged_message(message).await;
+    } else {
+        on_message
+            .on_message(message.agent, message.data, message.time)
+            .await;
+    }
+}
+
+/// Same as `dispatch_message` for a whole batch, which takes a single in-flight slot.
+async fn dispatch_batch(
+    on_message: Arc<dyn MessageHandler>,
+    inflight: Option<Arc<Semaphore>>,
+    mut batch: Vec<InboundMessage>,
+) {
+    if batch.len() == 1 {
+        dispatch_message(on_message, inflight, batch.pop().unwrap()).await;
+        return;
+    }
+    match inflight {
+        Some(semaphore) => {
+            let permit = match semaphore.acquire_owned().await {
+                Ok(permit) => permit,
+                Err(e) => {
+                    error!("Message dispatch closed: {:?}", e);
+                    return;
+                }
+            };
+            tokio::spawn(async move {
+                on_message.on_message_batch(batch).await;
+                drop(permit);
+            });
+        }
+        None => {
+            on_message.on_message_batch(batch).await;
+        }
+    }
+}
+
+/// Drains the inbound queue into batches of at most `batch_size` messages. A batch is closed when
+/// it is full, when the queue is empty and `max_delay` has passed since its first message, or
+/// straight away when the queue is empty and no delay is configured.
+async fn run_batch_dispatcher(
+    inbound: MessageQueue<InboundMessage>,
+    on_message: Arc<dyn MessageHandler>,
+    inflight: Option<Arc<Semaphore>>,
+    batch_size: usize,
+    max_delay: Duration,
+    cancel_token: CancellationToken,
+) {
+    loop {
+        let first = select! {
+            _ = cancel_token.cancelled() => {
+                debug!("Batch dispatcher shutting down");
+                break;
+            }
+            message = inbound.pop() => match message {
+                Some(message) => message,
+                None => break,
+            }
+        };
+
+        let mut batch = Vec::with_capacity(batch_size);
+        batch.push(first);
+        let deadline = Instant::now() + max_delay;
+        while batch.len() < batch_size {
+            match tokio::time::timeout_at(deadline, inbound.pop()).await {
+                Ok(Some(message)) => batch.push(message),
+                _ => break,
+            }
+        }
+        dispatch_batch(on_message.clone(), inflight.clone(), batch).await;
+    }
+}
@@ -99,10 +99,10 @@ async fn run_agent_with_commands(
         while let Some(cmd) = command_rx.recv().await {
             match cmd {
                 AgentCommand::Broadcast(message) => {
-                    agent_clone.broadcast(message).await;
+                    agent_clone.broadcast(message).await.unwrap();
                 }
                 AgentCommand::DirectMessage { to, message } => {
-                    agent_clone.send_direct(to, message).await;
+                    agent_clone.send_direct(to, message).await.unwrap();
                 }
                 AgentCommand::Stop => {
                     agent_clone.stop().await;
@@ -140,6 +140,7 @@ async fn test_unified_agent_communication() {
         admin_peer: None,
         admin_ip: None,
         buffer_size: Some(100),
+        ..Default::default()
     };
 
     let admin_agent = UnifiedAgent::new(
@@ -175,6 +176,7 @@ async fn test_unified_agent_communication() {
         admin_peer: Some(admin_id.clone()),
         admin_ip: Some("127.0.0.1".to_string()),
         buffer_size: Some(100),
+        ..Default::default()
     };
 
     let worker_agent = UnifiedAgent::new(
@@ -58,7 +58,7 @@ async fn main() {
                         match event {
                             NodeMessage::Message{ data, created_by, ..} => {
                                 info!("Admin listener Message {:?} from {:?}",
-                                    String::from_utf8(data),
+                                    String::from_utf8_lossy(&data),
                                     created_by
                                 );
                             }
@@ -182,7 +182,7 @@ async fn create_client(
                                 info!("{} {} listener Message {:?} from {:?}",
                                     name_clone,
                                     peer_id,
-                                    String::from_utf8(data),
+                                    String::from_utf8_lossy(&data),
                                     created_by
                                 );
                             }
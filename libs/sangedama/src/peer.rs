@@ -9,10 +9,13 @@ pub mod message;
 pub mod node;
 mod peer_swarm;
 
+pub use behaviour::peer::{GossipParams, GossipProfile, GossipSettings};
 pub use behaviour::peer::PeerMode;
 pub use behaviour::peer::UnifiedPeer;
 pub use behaviour::peer::UnifiedPeerEvent;
 pub use message::data::NodeMessage;
+pub use message::wire::WireFormat;
+pub use node::local::TransportMode;
 pub use node::node::UnifiedPeerConfig;
 pub use node::node::UnifiedPeerImpl;
 pub use peer_swarm::create_swarm;
@@ -4,4 +4,5 @@
  *
  */
 
+pub mod direct;
 pub mod peer;
\ No newline at end of file
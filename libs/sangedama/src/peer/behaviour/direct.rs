@@ -0,0 +1,270 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// Point-to-point protocol for direct messages.
+//
+// A request carries the target peer id and an encoded `NodeMessage` frame, so a peer that is
+// not the target (the admin, for members that only know the admin) can forward it unchanged.
+// Both fields are prefixed with their length as a little endian u32. The response is a single
+// status byte.
+use std::io;
+use std::time::Duration;
+
+use async_trait::async_trait;
+use bytes::Bytes;
+use futures::{AsyncRead, AsyncReadExt, AsyncWrite, AsyncWriteExt};
+use libp2p::{request_response, StreamProtocol};
+
+pub const DIRECT_PROTOCOL: StreamProtocol = StreamProtocol::new("/ceylon/direct/1.0.0");
+// Same limit as the gossipsub max transmit size
+const MAX_FRAME_SIZE: usize = 1024 * 1024 * 512;
+const MAX_PEER_ID_SIZE: usize = 128;
+
+#[derive(Clone, Debug)]
+pub struct DirectRequest {
+    pub to_peer: String,
+    pub frame: Bytes,
+}
+
+#[derive(Clone, Copy, Debug, Eq, PartialEq)]
+pub enum DirectResponse {
+    /// The target received the message.
+    Delivered,
+    /// The receiving peer forwarded the message to the target.
+    Relayed,
+    /// The receiving peer is not the target and has no connection to it.
+    Unreachable,
+}
+
+impl DirectResponse {
+    fn to_byte(self) -> u8 {
+        match self {
+            DirectResponse::Delivered => 0,
+            DirectResponse::Relayed => 1,
+            DirectResponse::Unreachable => 2,
+        }
+    }
+
+    fn from_byte(byte: u8) -> io::Result<Self> {
+        match byte {
+            0 => Ok(DirectResponse::Delivered),
+            1 => Ok(DirectResponse::Relayed),
+            2 => Ok(DirectResponse::Unreachable),
+            other => Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                format!("unknown direct message status {}", other),
+            )),
+        }
+    }
+}
+
+pub type DirectEvent = request_response::Event<DirectRequest, DirectResponse>;
+
+#[derive(Clone, Default)]
+pub struct DirectMessageCodec;
+
+async fn read_field<T>(io: &mut T, max_size: usize) -> io::Result<Vec<u8>>
+where
+    T: AsyncRead + Unpin + Send,
+{
+    let mut len = [0u8; 4];
+    io.read_exact(&mut len).await?;
+    let len = u32::from_le_bytes(len) as usize;
+    if len > max_size {
+        return Err(io::Error::new(
+            io::ErrorKind::InvalidData,
+            format!("direct message field of {} bytes exceeds {}", len, max_size),
+        ));
+    }
+    let mut buf = vec![0u8; len];
+    io.read_exact(&mut buf).await?;
+    Ok(buf)
+}
+
+async fn write_field<T>(io: &mut T, value: &[u8]) -> io::Result<()>
+where
+    T: AsyncWrite + Unpin + Send,
+{
+    io.write_all(&(value.len() as u32).to_le_bytes()).await?;
+    io.write_all(value).await
+}
+
+#[async_trait]
+impl request_response::Codec for DirectMessageCodec {
+    type Protocol = StreamProtocol;
+    type Request = DirectRequest;
+    type Response = DirectResponse;
+
+    async fn read_request<T>(&mut self, _: &StreamProtocol, io: &mut T) -> io::Result<DirectRequest>
+    where
+        T: AsyncRead + Unpin + Send,
+    {
+        let to_peer = String::from_utf8(read_field(io, MAX_PEER_ID_SIZE).await?)
+            .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+        let frame = read_field(io, MAX_FRAME_SIZE).await?.into();
+        Ok(DirectRequest { to_peer, frame })
+    }
+
+    async fn read_response<T>(
+        &mut self,
+        _: &StreamProtocol,
+        io: &mut T,
+    ) -> io::Result<DirectResponse>
+    where
+        T: AsyncRead + Unpin + Send,
+    {
+        let mut status = [0u8; 1];
+        io.read_exact(&mut status).await?;
+        DirectResponse::from_byte(status[0])
+    }
+
+    async fn write_request<T>(
+        &mut self,
+        _: &StreamProtocol,
+        io: &mut T,
+        request: DirectRequest,
+    ) -> io::Result<()>
+    where
+        T: AsyncWrite + Unpin + Send,
+    {
+        write_field(io, request.to_peer.as_bytes()).await?;
+        write_field(io, &request.frame).await?;
+        io.close().await
+    }
+
+    async fn write_response<T>(
+        &mut self,
+        _: &StreamProtocol,
+        io: &mut T,
+        response: DirectResponse,
+    ) -> io::Result<()>
+    where
+        T: AsyncWrite + Unpin + Send,
+    {
+        io.write_all(&[response.to_byte()]).await?;
+        io.close().await
+    }
+}
+
+pub fn create_direct_behaviour() -> request_response::Behaviour<DirectMessageCodec> {
+    request_response::Behaviour::new(
+        [(DIRECT_PROTOCOL, request_response::ProtocolSupport::Full)],
+        // Large frames need longer than the default 10 seconds
+        request_response::Config::default().with_request_timeout(Duration::from_secs(60)),
+    )
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use futures::io::Cursor;
+    use libp2p::request_response::Codec;
+
+    fn request() -> DirectRequest {
+        DirectRequest {
+            to_peer: "12D3KooWPeer".to_string(),
+            frame: Bytes::from_static(b"\x01frame"),
+        }
+    }
+
+    async fn encode_request(request: DirectRequest) -> Vec<u8> {
+        let mut io = Cursor::new(Vec::new());
+        DirectMessageCodec
+            .write_request(&DIRECT_PROTOCOL, &mut io, request)
+            .await
+            .unwrap();
+        io.into_inner()
+    }
+
+    async fn decode_request(bytes: &[u8]) -> io::Result<DirectRequest> {
+        DirectMessageCodec
+            .read_request(&DIRECT_PROTOCOL, &mut Cursor::new(bytes))
+            .await
+    }
+
+    #[tokio::test]
+    async fn request_round_trip() {
+        for frame in [Bytes::new(), Bytes::from(vec![7u8; 100_000])] {
+            let sent = DirectRequest { frame, ..request() };
+            let received = decode_request(&encode_request(sent.clone()).await)
+                .await
+                .unwrap();
+            assert_eq!(received.to_peer, sent.to_peer);
+            assert_eq!(received.frame, sent.frame);
+        }
+    }
+
+    #[tokio::test]
+    async fn response_round_trip() {
+        for response in [
+            DirectResponse::Delivered,
+            DirectResponse::Relayed,
+            DirectResponse::Unreachable,
+        ] {
+            let mut io = Cursor::new(Vec::new());
+            DirectMessageCodec
+                .write_response(&DIRECT_PROTOCOL, &mut io, response)
+                .await
+                .unwrap();
+            let received = DirectMessageCodec
+                .read_response(&DIRECT_PROTOCOL, &mut Cursor::new(io.into_inner()))
+                .await
+                .unwrap();
+            assert_eq!(received, response);
+        }
+    }
+
+    #[tokio::test]
+    async fn truncated_request() {
+        let bytes = encode_request(request()).await;
+        for end in 0..bytes.len() {
+            let error = decode_request(&bytes[..end]).await.unwrap_err();
+            assert_eq!(
+                error.kind(),
+                io::ErrorKind::UnexpectedEof,
+                "request cut after {} bytes",
+                end
+            );
+        }
+    }
+
+    #[tokio::test]
+    async fn corrupt_request() {
+        // Peer id longer than any peer id
+        let mut bytes = encode_request(request()).await;
+        bytes[..4].copy_from_slice(&(MAX_PEER_ID_SIZE as u32 + 1).to_le_bytes());
+        let error = decode_request(&bytes).await.unwrap_err();
+        assert_eq!(error.kind(), io::ErrorKind::InvalidData);
+
+        // Peer id that is not UTF-8
+        let mut bytes = encode_request(request()).await;
+        bytes[4] = 0xff;
+        let error = decode_request(&bytes).await.unwrap_err();
+        assert_eq!(error.kind(), io::ErrorKind::InvalidData);
+
+        // Frame length beyond the limit, refused before reading the frame
+        let mut bytes = Vec::new();
+        write_field(&mut bytes, b"12D3KooWPeer").await.unwrap();
+        bytes.extend_from_slice(&(MAX_FRAME_SIZE as u32 + 1).to_le_bytes());
+        let error = decode_request(&bytes).await.unwrap_err();
+        assert_eq!(error.kind(), io::ErrorKind::InvalidData);
+    }
+
+    #[tokio::test]
+    async fn corrupt_response() {
+        let error = DirectMessageCodec
+            .read_response(&DIRECT_PROTOCOL, &mut Cursor::new(vec![3u8]))
+            .await
+            .unwrap_err();
+        assert_eq!(error.kind(), io::ErrorKind::InvalidData);
+
+        let error = DirectMessageCodec
+            .read_response(&DIRECT_PROTOCOL, &mut Cursor::new(Vec::new()))
+            .await
+            .unwrap_err();
+        assert_eq!(error.kind(), io::ErrorKind::UnexpectedEof);
+    }
+}
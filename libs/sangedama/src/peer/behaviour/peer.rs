@@ -10,13 +10,153 @@ use std::time::Duration;
 
 use libp2p::swarm::NetworkBehaviour;
 use libp2p::{gossipsub, identify, identity, ping, rendezvous};
+use libp2p::request_response;
 use serde::{Deserialize, Serialize};
+use tracing::error;
+
+use crate::peer::behaviour::direct::{create_direct_behaviour, DirectEvent, DirectMessageCodec};
 
 pub trait PeerBehaviour
 where
     Self: NetworkBehaviour,
 {
-    fn new(local_public_key: libp2p::identity::Keypair) -> Self;
+    fn new(local_public_key: libp2p::identity::Keypair, gossip: &GossipSettings) -> Self;
+}
+
+/// Starting points for the gossipsub settings of a workspace.
+#[derive(Clone, Copy, Debug, Default, Eq, PartialEq)]
+pub enum GossipProfile {
+    /// The settings of earlier versions: 100 ms heartbeat, mesh of 32 kept between 16 and 64.
+    #[default]
+    Standard,
+    /// A few dozen agents: every peer fits in the mesh and publishes flood, so heartbeats only
+    /// have to repair it now and then.
+    SmallCluster,
+    /// Hundreds of agents: a small mesh and lazy gossip instead of publishing to everyone.
+    LargeFanout,
+    /// Slow or metered links: small mesh, rare heartbeats and a short gossip history.
+    Wan,
+}
+
+impl GossipProfile {
+    fn params(self, seen_ttl: Duration) -> GossipParams {
+        let (heartbeat_ms, mesh, history, flood_publish) = match self {
+            GossipProfile::Standard => (100, (16, 32, 64), (128, 128), true),
+            GossipProfile::SmallCluster => (500, (4, 8, 16), (10, 5), true),
+            GossipProfile::LargeFanout => (1000, (6, 8, 12), (5, 3), false),
+            GossipProfile::Wan => (2000, (4, 6, 8), (4, 2), false),
+        };
+        GossipParams {
+            heartbeat: Duration::from_millis(heartbeat_ms),
+            mesh_n_low: mesh.0,
+            mesh_n: mesh.1,
+            mesh_n_high: mesh.2,
+            history_length: history.0,
+            history_gossip: history.1,
+            flood_publish,
+            seen_ttl,
+        }
+    }
+}
+
+/// Gossipsub settings that can differ between peers: a profile and overrides of its values.
+#[derive(Clone, Debug)]
+pub struct GossipSettings {
+    pub profile: GossipProfile,
+    pub heartbeat: Option<Duration>,
+    pub mesh_n: Option<usize>,
+    pub mesh_n_low: Option<usize>,
+    pub mesh_n_high: Option<usize>,
+    /// Heartbeats a published message stays in the cache served to peers asking for it.
+    pub history_length: Option<usize>,
+    /// Heartbeats a published message is advertised to peers outside the mesh.
+    pub history_gossip: Option<usize>,
+    /// How long the ids of seen messages are kept to drop copies arriving over other mesh
+    /// links. Ids have a fixed size, so the cache holds at most this long times the message
+    /// rate of the workspace.
+    pub seen_ttl: Duration,
+}
+
+impl Default for GossipSettings {
+    fn default() -> Self {
+        Self {
+            profile: GossipProfile::default(),
+            heartbeat: None,
+            mesh_n: None,
+            mesh_n_low: None,
+            mesh_n_high: None,
+            history_length: None,
+            history_gossip: None,
+            seen_ttl: Duration::from_secs(60),
+        }
+    }
+}
+
+impl GossipSettings {
+    fn overridden(&self) -> GossipParams {
+        let profile = self.profile.params(self.seen_ttl);
+        GossipParams {
+            heartbeat: self.heartbeat.unwrap_or(profile.heartbeat),
+            mesh_n: self.mesh_n.unwrap_or(profile.mesh_n),
+            mesh_n_low: self.mesh_n_low.unwrap_or(profile.mesh_n_low),
+            mesh_n_high: self.mesh_n_high.unwrap_or(profile.mesh_n_high),
+            history_length: self.history_length.unwrap_or(profile.history_length),
+            history_gossip: self.history_gossip.unwrap_or(profile.history_gossip),
+            ..profile
+        }
+    }
+
+    /// Values in effect: the profile with the overrides applied, or the plain profile when the
+    /// overrides break a gossipsub invariant.
+    pub fn params(&self) -> GossipParams {
+        let params = self.overridden();
+        match params.validate() {
+            Ok(()) => params,
+            Err(_) => self.profile.params(self.seen_ttl),
+        }
+    }
+}
+
+/// Resolved gossipsub values of a peer.
+#[derive(Clone, Copy, Debug, Eq, PartialEq)]
+pub struct GossipParams {
+    pub heartbeat: Duration,
+    pub mesh_n: usize,
+    pub mesh_n_low: usize,
+    pub mesh_n_high: usize,
+    pub history_length: usize,
+    pub history_gossip: usize,
+    pub flood_publish: bool,
+    pub seen_ttl: Duration,
+}
+
+impl GossipParams {
+    // Outbound mesh peers gossipsub keeps, within the bounds it requires of it
+    fn mesh_outbound_min(&self) -> usize {
+        2.min(self.mesh_n / 2).min(self.mesh_n_low)
+    }
+
+    pub fn validate(&self) -> Result<(), String> {
+        if self.heartbeat.is_zero() {
+            return Err("heartbeat must be positive".to_string());
+        }
+        if !(1 <= self.mesh_n_low
+            && self.mesh_n_low <= self.mesh_n
+            && self.mesh_n <= self.mesh_n_high)
+        {
+            return Err(format!(
+                "mesh sizes must hold 1 <= mesh_n_low ({}) <= mesh_n ({}) <= mesh_n_high ({})",
+                self.mesh_n_low, self.mesh_n, self.mesh_n_high
+            ));
+        }
+        if !(1 <= self.history_gossip && self.history_gossip <= self.history_length) {
+            return Err(format!(
+                "history must hold 1 <= history_gossip ({}) <= history_length ({})",
+                self.history_gossip, self.history_length
+            ));
+        }
+        Ok(())
+    }
 }
 
 // Custom enum to handle both client and server rendezvous behaviors
@@ -53,6 +193,7 @@ pub struct UnifiedPeerBehaviour {
     pub ping: ping::Behaviour,
     pub gossip_sub: gossipsub::Behaviour,
     pub rendezvous: RendezvousBehaviour,
+    pub direct: request_response::Behaviour<DirectMessageCodec>,
 }
 
 #[derive(Debug)]
@@ -61,6 +202,7 @@ pub enum UnifiedPeerEvent {
     Ping(ping::Event),
     Identify(identify::Event),
     Rendezvous(RendezvousEvent),
+    Direct(DirectEvent),
 }
 
 impl From<gossipsub::Event> for UnifiedPeerEvent {
@@ -87,6 +229,12 @@ impl From<RendezvousEvent> for UnifiedPeerEvent {
     }
 }
 
+impl From<DirectEvent> for UnifiedPeerEvent {
+    fn from(event: DirectEvent) -> Self {
+        UnifiedPeerEvent::Direct(event)
+    }
+}
+
 impl RendezvousBehaviour {
     pub fn new(local_public_key: identity::Keypair) -> Self {
         Self {
@@ -97,8 +245,8 @@ impl RendezvousBehaviour {
 }
 
 impl PeerBehaviour for UnifiedPeerBehaviour {
-    fn new(local_public_key: identity::Keypair) -> Self {
-        let gossip_sub_config = create_gossip_sub_config();
+    fn new(local_public_key: identity::Keypair, gossip: &GossipSettings) -> Self {
+        let gossip_sub_config = create_gossip_sub_config(gossip);
         let gossip_sub = gossipsub::Behaviour::new(
             gossipsub::MessageAuthenticity::Signed(local_public_key.clone()),
             gossip_sub_config,
@@ -114,11 +262,14 @@ impl PeerBehaviour for UnifiedPeerBehaviour {
 
         let rendezvous = RendezvousBehaviour::new(local_public_key.clone());
 
+        let direct = create_direct_behaviour();
+
         Self {
             identify,
             ping,
             gossip_sub,
             rendezvous,
+            direct,
         }
     }
 }
@@ -138,7 +289,7 @@ pub enum PeerMode {
 impl UnifiedPeer {
     pub fn new(local_public_key: identity::Keypair, mode: PeerMode) -> Self {
         Self {
-            behaviour: UnifiedPeerBehaviour::new(local_public_key),
+            behaviour: UnifiedPeerBehaviour::new(local_public_key, &GossipSettings::default()),
             mode,
         }
     }
@@ -156,23 +307,46 @@ impl UnifiedPeer {
     }
 }
 
+// Sender and sequence number of the signed envelope: no work per payload byte, and a payload
+// sent twice is two messages. Gossipsub numbers messages from the start time of the peer on, so
+// ids stay unique across restarts.
 pub fn message_id_fn(message: &gossipsub::Message) -> gossipsub::MessageId {
-    let mut s = DefaultHasher::new();
-    message.data.hash(&mut s);
-    gossipsub::MessageId::from(s.finish().to_string())
+    match (message.source, message.sequence_number) {
+        (Some(source), Some(sequence_number)) => {
+            let mut id = source.to_bytes();
+            id.extend_from_slice(&sequence_number.to_be_bytes());
+            gossipsub::MessageId::new(&id)
+        }
+        // Only unsigned messages lack them, and strict validation rejects those
+        _ => {
+            let mut s = DefaultHasher::new();
+            message.data.hash(&mut s);
+            gossipsub::MessageId::from(s.finish().to_string())
+        }
+    }
 }
 
-pub fn create_gossip_sub_config() -> gossipsub::Config {
+pub fn create_gossip_sub_config(gossip: &GossipSettings) -> gossipsub::Config {
+    if let Err(e) = gossip.overridden().validate() {
+        error!(
+            "Ignoring gossipsub overrides, {}; using the {:?} profile",
+            e, gossip.profile
+        );
+    }
+    let params = gossip.params();
     gossipsub::ConfigBuilder::default()
-        .heartbeat_interval(Duration::from_millis(100)) // Reduced for faster updates
-        .mesh_n_low(16) // Increased mesh size
-        .mesh_n(32)
-        .mesh_n_high(64)
-        .history_length(128) // Reduced to lower memory overhead
-        .history_gossip(128)
+        .heartbeat_interval(params.heartbeat)
+        .mesh_n_low(params.mesh_n_low)
+        .mesh_n(params.mesh_n)
+        .mesh_n_high(params.mesh_n_high)
+        .mesh_outbound_min(params.mesh_outbound_min())
+        .history_length(params.history_length)
+        .history_gossip(params.history_gossip)
+        .flood_publish(params.flood_publish)
         .max_transmit_size(1024 * 1024 * 512) // Increased max size
         .validation_mode(gossipsub::ValidationMode::Strict)
         .message_id_fn(message_id_fn)
+        .duplicate_cache_time(params.seen_ttl)
         .build()
         .unwrap()
 }
@@ -5,16 +5,23 @@
  */
 
 // In data.rs
+use crate::peer::message::wire::{
+    json_bytes, WireError, WireFormat, WireReader, WireWriter, BINARY_WIRE_VERSION,
+};
+use bytes::Bytes;
 use serde::{Deserialize, Serialize};
 use serde_json::json;
 
-#[derive(Debug, Serialize, Deserialize)]
+// Binary variant of a frame packing several encoded messages, after those of `NodeMessage`
+const BATCH_VARIANT: u8 = 2;
+
+#[derive(Clone, Debug, Serialize, Deserialize)]
 pub enum MessageType {
     Broadcast,
     Direct { to_peer: String },
 }
 
-#[derive(Debug, Serialize, Deserialize)]
+#[derive(Clone, Debug, Serialize, Deserialize)]
 pub enum EventType {
     Subscribe { topic: String, peer_id: String },
     Unsubscribe { topic: String, peer_id: String },
@@ -22,7 +29,7 @@ pub enum EventType {
     PeerDisconnected { peer_id: String },
 }
 
-#[derive(Debug, Serialize, Deserialize)]
+#[derive(Clone, Debug, Serialize, Deserialize)]
 pub enum NodeMessage {
     Event {
         time: u64,
@@ -32,14 +39,58 @@ pub enum NodeMessage {
     Message {
         time: u64,
         created_by: String,
+        /// Numbers the messages of `created_by`, so copies arriving over several transports are
+        /// recognised. `0` for messages from peers that do not number them.
+        #[serde(default)]
+        seq: u64,
         message_type: MessageType,
-        data: Vec<u8>,
+        /// Shares the buffer of the received frame, cloning it does not copy the payload.
+        #[serde(with = "json_bytes")]
+        data: Bytes,
     },
 }
 
 impl NodeMessage {
     pub fn from_bytes(bytes: Vec<u8>) -> Self {
-        serde_json::from_slice(&bytes).unwrap()
+        Self::try_from_bytes(bytes.into()).unwrap()
+    }
+
+    /// Decodes a JSON or binary frame, whichever `bytes` holds. The payload of a binary frame
+    /// is a view into `bytes`.
+    pub fn try_from_bytes(bytes: Bytes) -> Result<Self, WireError> {
+        match WireFormat::detect(&bytes) {
+            Some(WireFormat::Binary) => Self::read_binary(&mut WireReader::new(&bytes)?, &bytes),
+            _ => Ok(serde_json::from_slice(&bytes)?),
+        }
+    }
+
+    /// Packs encoded messages into one frame, which `decode_frame` unpacks again. The frames may
+    /// use either format; peers of earlier versions cannot read the batch.
+    pub fn encode_batch(frames: &[Bytes]) -> Vec<u8> {
+        let mut writer = WireWriter::new(frames.iter().map(|frame| frame.len() + 4).sum());
+        writer.put_u8(BATCH_VARIANT);
+        writer.put_len(frames.len());
+        for frame in frames {
+            writer.put_bytes(frame);
+        }
+        writer.finish()
+    }
+
+    /// Decodes a frame holding a single message or a batch of them. Payloads are views into
+    /// `bytes`.
+    pub fn decode_frame(bytes: Bytes) -> Result<Vec<Self>, WireError> {
+        if bytes.len() < 2 || bytes[0] != BINARY_WIRE_VERSION || bytes[1] != BATCH_VARIANT {
+            return Self::try_from_bytes(bytes).map(|message| vec![message]);
+        }
+        let mut reader = WireReader::new(&bytes)?;
+        reader.u8()?;
+        let count = reader.len()?;
+        // The count is not trusted for the allocation, every message takes at least a byte
+        let mut messages = Vec::with_capacity(count.min(bytes.len()));
+        for _ in 0..count {
+            messages.push(Self::try_from_bytes(reader.shared_bytes(&bytes)?)?);
+        }
+        Ok(messages)
     }
 
     pub fn to_json(&self) -> String {
@@ -50,6 +101,112 @@ impl NodeMessage {
         serde_json::to_vec(self).unwrap()
     }
 
+    pub fn encode(&self, format: WireFormat) -> Vec<u8> {
+        match format {
+            WireFormat::Json => self.to_bytes(),
+            WireFormat::Binary => self.to_binary(),
+        }
+    }
+
+    fn to_binary(&self) -> Vec<u8> {
+        match self {
+            NodeMessage::Event {
+                time,
+                created_by,
+                event,
+            } => {
+                let mut writer = WireWriter::new(0);
+                writer.put_u8(0);
+                writer.put_u64(*time);
+                writer.put_str(created_by);
+                let (kind, topic, peer_id) = match event {
+                    EventType::Subscribe { topic, peer_id } => (0, Some(topic), peer_id),
+                    EventType::Unsubscribe { topic, peer_id } => (1, Some(topic), peer_id),
+                    EventType::PeerDiscovered { peer_id } => (2, None, peer_id),
+                    EventType::PeerDisconnected { peer_id } => (3, None, peer_id),
+                };
+                writer.put_u8(kind);
+                if let Some(topic) = topic {
+                    writer.put_str(topic);
+                }
+                writer.put_str(peer_id);
+                writer.finish()
+            }
+            NodeMessage::Message {
+                time,
+                created_by,
+                seq,
+                message_type,
+                data,
+            } => {
+                let mut writer = WireWriter::new(data.len());
+                writer.put_u8(1);
+                writer.put_u64(*time);
+                writer.put_str(created_by);
+                writer.put_u64(*seq);
+                match message_type {
+                    MessageType::Broadcast => writer.put_u8(0),
+                    MessageType::Direct { to_peer } => {
+                        writer.put_u8(1);
+                        writer.put_str(to_peer);
+                    }
+                }
+                writer.put_bytes(data);
+                writer.finish()
+            }
+        }
+    }
+
+    fn read_binary(reader: &mut WireReader, frame: &Bytes) -> Result<Self, WireError> {
+        let variant = reader.u8()?;
+        let time = reader.u64()?;
+        let created_by = reader.string()?;
+        match variant {
+            0 => {
+                let event = match reader.u8()? {
+                    0 => EventType::Subscribe {
+                        topic: reader.string()?,
+                        peer_id: reader.string()?,
+                    },
+                    1 => EventType::Unsubscribe {
+                        topic: reader.string()?,
+                        peer_id: reader.string()?,
+                    },
+                    2 => EventType::PeerDiscovered {
+                        peer_id: reader.string()?,
+                    },
+                    3 => EventType::PeerDisconnected {
+                        peer_id: reader.string()?,
+                    },
+                    kind => return Err(WireError::UnknownVariant("EventType", kind)),
+                };
+                Ok(NodeMessage::Event {
+                    time,
+                    created_by,
+                    event,
+                })
+            }
+            1 => {
+                let seq = reader.u64()?;
+                let message_type = match reader.u8()? {
+                    0 => MessageType::Broadcast,
+                    1 => MessageType::Direct {
+                        to_peer: reader.string()?,
+                    },
+                    kind => return Err(WireError::UnknownVariant("MessageType", kind)),
+                };
+                Ok(NodeMessage::Message {
+                    time,
+                    created_by,
+                    seq,
+                    message_type,
+                    data: reader.shared_bytes(frame)?,
+                })
+            }
+            variant => Err(WireError::UnknownVariant("NodeMessage", variant)),
+        }
+    }
+
     pub fn create_direct_message(from: String, to: String, data: Vec<u8>) -> Self {
         NodeMessage::Message {
             time: std::time::SystemTime::now()
@@ -57,8 +214,9 @@ impl NodeMessage {
                 .unwrap()
                 .as_secs_f64() as u64,
             created_by: from,
+            seq: 0,
             message_type: MessageType::Direct { to_peer: to },
-            data,
+            data: data.into(),
         }
     }
 
@@ -69,10 +227,194 @@ impl NodeMessage {
                 .unwrap()
                 .as_secs_f64() as u64,
             created_by: from,
+            seq: 0,
             message_type: MessageType::Broadcast,
-            data,
+            data: data.into(),
         }
     }
 }
 // (from, data, to)
 pub type NodeMessageTransporter = (String, Vec<u8>, Option<String>);
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    const FORMATS: [WireFormat; 2] = [WireFormat::Json, WireFormat::Binary];
+
+    fn samples() -> Vec<NodeMessage> {
+        let event = |event| NodeMessage::Event {
+            time: 17,
+            created_by: "peer-a".to_string(),
+            event,
+        };
+        vec![
+            event(EventType::Subscribe {
+                topic: "workspace".to_string(),
+                peer_id: "peer-b".to_string(),
+            }),
+            event(EventType::Unsubscribe {
+                topic: "workspace".to_string(),
+                peer_id: "peer-b".to_string(),
+            }),
+            event(EventType::PeerDiscovered {
+                peer_id: "peer-b".to_string(),
+            }),
+            event(EventType::PeerDisconnected {
+                peer_id: "peer-b".to_string(),
+            }),
+            NodeMessage::create_broadcast_message("peer-a".to_string(), vec![0, 1, 2, 255]),
+            NodeMessage::create_direct_message("peer-a".to_string(), "peer-b".to_string(), vec![]),
+            NodeMessage::Message {
+                time: 17,
+                created_by: "peer-a".to_string(),
+                seq: u64::MAX,
+                message_type: MessageType::Broadcast,
+                data: Bytes::from_static(b"numbered"),
+            },
+        ]
+    }
+
+    // The message types have no `PartialEq`, messages that encode the same are taken as equal
+    fn assert_same(left: &NodeMessage, right: &NodeMessage) {
+        assert_eq!(left.to_json(), right.to_json());
+    }
+
+    #[test]
+    fn round_trip() {
+        for format in FORMATS {
+            for message in samples() {
+                let frame = message.encode(format);
+                assert_eq!(WireFormat::detect(&frame), Some(format));
+                assert_same(
+                    &NodeMessage::try_from_bytes(frame.into()).unwrap(),
+                    &message,
+                );
+            }
+        }
+    }
+
+    #[test]
+    fn unnumbered_json_message() {
+        let frame = br#"{"Message":{"time":17,"created_by":"peer-a","message_type":"Broadcast","data":[1]}}"#;
+        let NodeMessage::Message { seq, .. } =
+            NodeMessage::try_from_bytes(frame[..].into()).unwrap()
+        else {
+            panic!("expected a message");
+        };
+        assert_eq!(seq, 0);
+    }
+
+    #[test]
+    fn binary_payload_is_a_view_into_the_frame() {
+        let message = NodeMessage::create_broadcast_message("peer-a".to_string(), vec![9; 64]);
+        let frame = Bytes::from(message.encode(WireFormat::Binary));
+        let NodeMessage::Message { data, .. } = NodeMessage::try_from_bytes(frame.clone()).unwrap()
+        else {
+            panic!("expected a message");
+        };
+        assert_eq!(data.as_ptr(), frame[frame.len() - 64..].as_ptr());
+    }
+
+    #[test]
+    fn truncated_frame() {
+        for format in FORMATS {
+            for message in samples() {
+                let frame = Bytes::from(message.encode(format));
+                for end in 0..frame.len() {
+                    assert!(
+                        NodeMessage::try_from_bytes(frame.slice(..end)).is_err(),
+                        "{:?} frame of {:?} cut after {} bytes",
+                        format,
+                        message,
+                        end
+                    );
+                }
+            }
+        }
+    }
+
+    #[test]
+    fn unknown_variant() {
+        let mut frame = samples()[0].encode(WireFormat::Binary);
+        frame[1] = 9;
+        assert!(matches!(
+            NodeMessage::try_from_bytes(frame.into()),
+            Err(WireError::UnknownVariant("NodeMessage", 9))
+        ));
+
+        let mut frame = samples()[0].encode(WireFormat::Binary);
+        // Version, variant, time and the length prefixed creator come before the event kind
+        frame[1 + 1 + 8 + 1 + "peer-a".len()] = 9;
+        assert!(matches!(
+            NodeMessage::try_from_bytes(frame.into()),
+            Err(WireError::UnknownVariant("EventType", 9))
+        ));
+    }
+
+    #[test]
+    fn batch_round_trip() {
+        let messages = samples();
+        let frames: Vec<Bytes> = messages
+            .iter()
+            .zip(FORMATS.iter().cycle())
+            .map(|(message, format)| message.encode(*format).into())
+            .collect();
+        let decoded = NodeMessage::decode_frame(NodeMessage::encode_batch(&frames).into()).unwrap();
+        assert_eq!(decoded.len(), messages.len());
+        for (decoded, message) in decoded.iter().zip(&messages) {
+            assert_same(decoded, message);
+        }
+
+        assert!(
+            NodeMessage::decode_frame(NodeMessage::encode_batch(&[]).into())
+                .unwrap()
+                .is_empty()
+        );
+    }
+
+    #[test]
+    fn decode_frame_takes_single_messages() {
+        for format in FORMATS {
+            let message = &samples()[4];
+            let decoded = NodeMessage::decode_frame(message.encode(format).into()).unwrap();
+            assert_eq!(decoded.len(), 1);
+            assert_same(&decoded[0], message);
+        }
+    }
+
+    #[test]
+    fn truncated_batch() {
+        let frames: Vec<Bytes> = samples()
+            .iter()
+            .map(|message| message.encode(WireFormat::Binary).into())
+            .collect();
+        let batch = Bytes::from(NodeMessage::encode_batch(&frames));
+        for end in 0..batch.len() {
+            assert!(
+                NodeMessage::decode_frame(batch.slice(..end)).is_err(),
+                "batch cut after {} bytes",
+                end
+            );
+        }
+    }
+
+    #[test]
+    fn corrupt_batch() {
+        // A count far beyond the frame must fail without allocating for it
+        let mut writer = WireWriter::new(0);
+        writer.put_u8(BATCH_VARIANT);
+        writer.put_len(usize::MAX);
+        assert!(matches!(
+            NodeMessage::decode_frame(writer.finish().into()),
+            Err(WireError::UnexpectedEnd)
+        ));
+
+        // A corrupt message inside the batch fails the whole batch
+        let mut writer = WireWriter::new(0);
+        writer.put_u8(BATCH_VARIANT);
+        writer.put_len(1);
+        writer.put_bytes(&[BINARY_WIRE_VERSION, 9]);
+        assert!(NodeMessage::decode_frame(writer.finish().into()).is_err());
+    }
+}
@@ -0,0 +1,376 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// Compact binary framing shared by the envelope types of sangedama and ceylon-core.
+//
+// A binary frame starts with a version byte followed by the fields of the message in a fixed
+// order. Integers are little endian, strings and byte fields are prefixed with their length as
+// an unsigned LEB128 varint and copied as is, optional fields are prefixed with a 0/1 flag.
+// JSON frames always start with `{`, so readers tell both formats apart by the first byte and
+// peers using either format can share a topic.
+use bytes::Bytes;
+use std::fmt;
+
+/// First byte of a version 1 binary frame.
+pub const BINARY_WIRE_VERSION: u8 = 0x01;
+const JSON_OBJECT_START: u8 = b'{';
+
+/// Encoding used for outgoing messages. Incoming messages are accepted in either format.
+#[derive(Clone, Copy, Debug, Default, Eq, PartialEq)]
+pub enum WireFormat {
+    /// Understood by every peer version, the payload is sent as a JSON array of numbers.
+    #[default]
+    Json,
+    /// Length prefixed framing with raw byte fields, needs peers that read binary frames.
+    Binary,
+}
+
+impl WireFormat {
+    /// Format of an encoded message, `None` if the first byte matches neither.
+    pub fn detect(bytes: &[u8]) -> Option<WireFormat> {
+        match bytes.first() {
+            Some(&JSON_OBJECT_START) => Some(WireFormat::Json),
+            Some(&BINARY_WIRE_VERSION) => Some(WireFormat::Binary),
+            _ => None,
+        }
+    }
+}
+
+#[derive(Debug)]
+pub enum WireError {
+    UnexpectedEnd,
+    UnknownVersion(Option<u8>),
+    UnknownVariant(&'static str, u8),
+    InvalidUtf8,
+    LengthOverflow,
+    Json(serde_json::Error),
+}
+
+impl fmt::Display for WireError {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            WireError::UnexpectedEnd => write!(f, "frame ended unexpectedly"),
+            WireError::UnknownVersion(Some(version)) => {
+                write!(f, "unknown wire version {:#04x}", version)
+            }
+            WireError::UnknownVersion(None) => write!(f, "empty frame"),
+            WireError::UnknownVariant(kind, tag) => write!(f, "unknown {} variant {}", kind, tag),
+            WireError::InvalidUtf8 => write!(f, "string field is not valid UTF-8"),
+            WireError::LengthOverflow => write!(f, "length prefix is too large"),
+            WireError::Json(e) => write!(f, "invalid JSON frame: {}", e),
+        }
+    }
+}
+
+impl std::error::Error for WireError {}
+
+impl From<serde_json::Error> for WireError {
+    fn from(e: serde_json::Error) -> Self {
+        WireError::Json(e)
+    }
+}
+
+pub struct WireWriter {
+    buf: Vec<u8>,
+}
+
+impl WireWriter {
+    /// Starts a binary frame, `capacity` should cover the large byte fields to avoid regrowing.
+    pub fn new(capacity: usize) -> Self {
+        let mut buf = Vec::with_capacity(capacity + 64);
+        buf.push(BINARY_WIRE_VERSION);
+        Self { buf }
+    }
+
+    pub fn put_u8(&mut self, value: u8) {
+        self.buf.push(value);
+    }
+
+    pub fn put_bool(&mut self, value: bool) {
+        self.buf.push(value as u8);
+    }
+
+    pub fn put_u64(&mut self, value: u64) {
+        self.buf.extend_from_slice(&value.to_le_bytes());
+    }
+
+    pub fn put_len(&mut self, mut value: usize) {
+        while value >= 0x80 {
+            self.buf.push((value as u8) | 0x80);
+            value >>= 7;
+        }
+        self.buf.push(value as u8);
+    }
+
+    pub fn put_bytes(&mut self, value: &[u8]) {
+        self.put_len(value.len());
+        self.buf.extend_from_slice(value);
+    }
+
+    pub fn put_str(&mut self, value: &str) {
+        self.put_bytes(value.as_bytes());
+    }
+
+    pub fn put_opt_str(&mut self, value: Option<&str>) {
+        self.put_bool(value.is_some());
+        if let Some(value) = value {
+            self.put_str(value);
+        }
+    }
+
+    pub fn put_opt_bytes(&mut self, value: Option<&[u8]>) {
+        self.put_bool(value.is_some());
+        if let Some(value) = value {
+            self.put_bytes(value);
+        }
+    }
+
+    pub fn finish(self) -> Vec<u8> {
+        self.buf
+    }
+}
+
+pub struct WireReader<'a> {
+    buf: &'a [u8],
+    pos: usize,
+}
+
+impl<'a> WireReader<'a> {
+    /// Checks the version byte of a binary frame and positions the reader after it.
+    pub fn new(buf: &'a [u8]) -> Result<Self, WireError> {
+        match buf.first() {
+            Some(&BINARY_WIRE_VERSION) => Ok(Self { buf, pos: 1 }),
+            other => Err(WireError::UnknownVersion(other.copied())),
+        }
+    }
+
+    fn take(&mut self, len: usize) -> Result<&'a [u8], WireError> {
+        let end = self.pos.checked_add(len).ok_or(WireError::LengthOverflow)?;
+        let slice = self
+            .buf
+            .get(self.pos..end)
+            .ok_or(WireError::UnexpectedEnd)?;
+        self.pos = end;
+        Ok(slice)
+    }
+
+    pub fn u8(&mut self) -> Result<u8, WireError> {
+        Ok(self.take(1)?[0])
+    }
+
+    pub fn bool(&mut self) -> Result<bool, WireError> {
+        Ok(self.u8()? != 0)
+    }
+
+    pub fn u64(&mut self) -> Result<u64, WireError> {
+        let mut bytes = [0u8; 8];
+        bytes.copy_from_slice(self.take(8)?);
+        Ok(u64::from_le_bytes(bytes))
+    }
+
+    pub fn len(&mut self) -> Result<usize, WireError> {
+        let mut value: usize = 0;
+        let mut shift = 0;
+        loop {
+            let byte = self.u8()?;
+            if shift >= usize::BITS {
+                return Err(WireError::LengthOverflow);
+            }
+            value |= ((byte & 0x7f) as usize) << shift;
+            if byte & 0x80 == 0 {
+                return Ok(value);
+            }
+            shift += 7;
+        }
+    }
+
+    pub fn bytes(&mut self) -> Result<&'a [u8], WireError> {
+        let len = self.len()?;
+        self.take(len)
+    }
+
+    /// Like `bytes`, but returns a view into `frame` instead of copying. `frame` must be the
+    /// buffer this reader was created from.
+    pub fn shared_bytes(&mut self, frame: &Bytes) -> Result<Bytes, WireError> {
+        Ok(frame.slice_ref(self.bytes()?))
+    }
+
+    pub fn str(&mut self) -> Result<&'a str, WireError> {
+        std::str::from_utf8(self.bytes()?).map_err(|_| WireError::InvalidUtf8)
+    }
+
+    pub fn string(&mut self) -> Result<String, WireError> {
+        self.str().map(str::to_string)
+    }
+
+    pub fn opt_string(&mut self) -> Result<Option<String>, WireError> {
+        if self.bool()? {
+            self.string().map(Some)
+        } else {
+            Ok(None)
+        }
+    }
+
+    pub fn opt_bytes(&mut self) -> Result<Option<Vec<u8>>, WireError> {
+        if self.bool()? {
+            self.bytes().map(|bytes| Some(bytes.to_vec()))
+        } else {
+            Ok(None)
+        }
+    }
+}
+
+/// Serde adapter that keeps `Bytes` payload fields in the JSON format of `Vec<u8>`.
+pub mod json_bytes {
+    use bytes::Bytes;
+    use serde::{Deserialize, Deserializer, Serializer};
+
+    pub fn serialize<S: Serializer>(value: &Bytes, serializer: S) -> Result<S::Ok, S::Error> {
+        serializer.collect_seq(value.iter())
+    }
+
+    pub fn deserialize<'de, D: Deserializer<'de>>(deserializer: D) -> Result<Bytes, D::Error> {
+        Vec::<u8>::deserialize(deserializer).map(Bytes::from)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn sample_frame() -> Vec<u8> {
+        let mut writer = WireWriter::new(0);
+        writer.put_u8(7);
+        writer.put_bool(true);
+        writer.put_u64(u64::MAX - 1);
+        writer.put_len(300);
+        writer.put_bytes(b"payload");
+        writer.put_str("name");
+        writer.put_opt_str(None);
+        writer.put_opt_str(Some("role"));
+        writer.put_opt_bytes(Some(b"extra"));
+        writer.finish()
+    }
+
+    fn read_sample(reader: &mut WireReader) -> Result<(), WireError> {
+        assert_eq!(reader.u8()?, 7);
+        assert!(reader.bool()?);
+        assert_eq!(reader.u64()?, u64::MAX - 1);
+        assert_eq!(reader.len()?, 300);
+        assert_eq!(reader.bytes()?, b"payload");
+        assert_eq!(reader.str()?, "name");
+        assert_eq!(reader.opt_string()?, None);
+        assert_eq!(reader.opt_string()?, Some("role".to_string()));
+        assert_eq!(reader.opt_bytes()?, Some(b"extra".to_vec()));
+        Ok(())
+    }
+
+    #[test]
+    fn round_trip() {
+        let frame = sample_frame();
+        assert_eq!(WireFormat::detect(&frame), Some(WireFormat::Binary));
+        read_sample(&mut WireReader::new(&frame).unwrap()).unwrap();
+    }
+
+    #[test]
+    fn length_prefix_round_trip() {
+        for len in [
+            0,
+            1,
+            0x7f,
+            0x80,
+            0x3fff,
+            0x4000,
+            u32::MAX as usize,
+            usize::MAX,
+        ] {
+            let mut writer = WireWriter::new(0);
+            writer.put_len(len);
+            let frame = writer.finish();
+            assert_eq!(WireReader::new(&frame).unwrap().len().unwrap(), len);
+        }
+    }
+
+    #[test]
+    fn truncated_frame() {
+        let frame = sample_frame();
+        for end in 1..frame.len() {
+            let mut reader = WireReader::new(&frame[..end]).unwrap();
+            assert!(
+                matches!(read_sample(&mut reader), Err(WireError::UnexpectedEnd)),
+                "frame cut after {} bytes",
+                end
+            );
+        }
+    }
+
+    #[test]
+    fn unknown_version() {
+        assert!(matches!(
+            WireReader::new(&[]),
+            Err(WireError::UnknownVersion(None))
+        ));
+        assert!(matches!(
+            WireReader::new(b"{}"),
+            Err(WireError::UnknownVersion(Some(b'{')))
+        ));
+        assert_eq!(WireFormat::detect(&[0x02]), None);
+    }
+
+    #[test]
+    fn corrupt_length_prefix() {
+        // A length that never ends
+        let mut frame = vec![BINARY_WIRE_VERSION];
+        frame.extend_from_slice(&[0xff; 11]);
+        assert!(matches!(
+            WireReader::new(&frame).unwrap().len(),
+            Err(WireError::LengthOverflow)
+        ));
+
+        // A length pointing past the end of the frame
+        let mut writer = WireWriter::new(0);
+        writer.put_len(1000);
+        writer.put_u8(1);
+        let frame = writer.finish();
+        assert!(matches!(
+            WireReader::new(&frame).unwrap().bytes(),
+            Err(WireError::UnexpectedEnd)
+        ));
+
+        // A length that overflows the position
+        let mut writer = WireWriter::new(0);
+        writer.put_len(usize::MAX);
+        let frame = writer.finish();
+        assert!(matches!(
+            WireReader::new(&frame).unwrap().bytes(),
+            Err(WireError::LengthOverflow)
+        ));
+    }
+
+    #[test]
+    fn invalid_utf8() {
+        let mut writer = WireWriter::new(0);
+        writer.put_bytes(&[0xff, 0xfe]);
+        let frame = writer.finish();
+        assert!(matches!(
+            WireReader::new(&frame).unwrap().str(),
+            Err(WireError::InvalidUtf8)
+        ));
+    }
+
+    #[test]
+    fn shared_bytes_point_into_the_frame() {
+        let mut writer = WireWriter::new(0);
+        writer.put_bytes(b"payload");
+        let frame = Bytes::from(writer.finish());
+        let payload = WireReader::new(&frame)
+            .unwrap()
+            .shared_bytes(&frame)
+            .unwrap();
+        assert_eq!(&payload[..], b"payload");
+        assert_eq!(payload.as_ptr(), frame[2..].as_ptr());
+    }
+}
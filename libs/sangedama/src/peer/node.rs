@@ -6,5 +6,9 @@
 
 pub mod peer_builder;
 pub mod node;
+pub mod local;
+pub mod shm;
+pub mod broker;
+pub mod spill;
 
 pub use peer_builder::{create_key, create_key_from_bytes, get_peer_id};
@@ -0,0 +1,505 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// Broker transport: the admin relays every message of its workspace.
+//
+// Members keep a single TCP connection to the admin, or a Unix domain socket connection when the
+// admin runs on the same host, and send it their messages. The admin hands broadcasts to itself
+// and every other member, and directs to their target only. There is no gossip fanout, signing,
+// rendezvous, identify or ping, which keeps latency and CPU low for small single admin
+// workspaces.
+//
+// A frame is the length of the rest as a little endian u32, a kind byte, the length of a peer id
+// as a byte, the peer id and the payload. Members open with a hello frame carrying their peer id
+// and the workspace id; afterwards payloads are encoded `NodeMessage`s. The admin forwards
+// frames of members unchanged, so they are only decoded by the peers delivering them.
+//
+// Unlike the libp2p transports, connections are neither encrypted nor authenticated: anyone who
+// can reach the port can join with any peer id, read what the admin relays and inject messages.
+// The admin therefore listens on loopback unless it is given another address, which should only
+// be done on a trusted network.
+use bytes::{Bytes, BytesMut};
+use std::collections::HashMap;
+use std::io;
+use std::net::{IpAddr, SocketAddr};
+use std::path::PathBuf;
+use std::sync::{Arc, RwLock};
+use std::time::Duration;
+use tokio::io::{AsyncRead, AsyncReadExt, AsyncWrite, AsyncWriteExt, BufReader, BufWriter};
+use tokio::net::{TcpListener, TcpStream};
+use tokio::sync::mpsc;
+use tokio_util::sync::CancellationToken;
+use tracing::{debug, error, info, warn};
+
+use crate::peer::message::data::{EventType, NodeMessage};
+use crate::peer::node::spill::SpillSender;
+
+// Same limit as the gossipsub max transmit size
+const MAX_FRAME_SIZE: usize = 1024 * 1024 * 512;
+// Frames queued for a connection, as many again are spilled before frames get dropped
+const QUEUE_SIZE: usize = 1024;
+const RECONNECT_DELAY: Duration = Duration::from_secs(1);
+
+const KIND_HELLO: u8 = 0;
+const KIND_BROADCAST: u8 = 1;
+const KIND_DIRECT: u8 = 2;
+
+type Reader = Box<dyn AsyncRead + Unpin + Send>;
+type Writer = Box<dyn AsyncWrite + Unpin + Send>;
+type Routes = Arc<RwLock<HashMap<String, SpillSender<Bytes>>>>;
+
+fn encode_frame(kind: u8, peer: &str, payload: &[u8]) -> Bytes {
+    let len = 2 + peer.len() + payload.len();
+    let mut frame = BytesMut::with_capacity(4 + len);
+    frame.extend_from_slice(&(len as u32).to_le_bytes());
+    frame.extend_from_slice(&[kind, peer.len() as u8]);
+    frame.extend_from_slice(peer.as_bytes());
+    frame.extend_from_slice(payload);
+    frame.freeze()
+}
+
+struct Frame {
+    kind: u8,
+    peer: String,
+    payload: Bytes,
+    // The whole frame, length included, for forwarding it unchanged
+    raw: Bytes,
+}
+
+fn invalid(message: String) -> io::Error {
+    io::Error::new(io::ErrorKind::InvalidData, message)
+}
+
+async fn read_frame<R: AsyncRead + Unpin>(reader: &mut R) -> io::Result<Frame> {
+    let mut len = [0u8; 4];
+    reader.read_exact(&mut len).await?;
+    let body_len = u32::from_le_bytes(len) as usize;
+    if !(2..=MAX_FRAME_SIZE).contains(&body_len) {
+        return Err(invalid(format!("broker frame of {} bytes", body_len)));
+    }
+    let mut raw = BytesMut::zeroed(4 + body_len);
+    raw[..4].copy_from_slice(&len);
+    reader.read_exact(&mut raw[4..]).await?;
+    let raw = raw.freeze();
+    let (kind, peer_len) = (raw[4], raw[5] as usize);
+    if 2 + peer_len > body_len {
+        return Err(invalid(format!(
+            "broker frame peer id of {} bytes",
+            peer_len
+        )));
+    }
+    let peer = std::str::from_utf8(&raw[6..6 + peer_len])
+        .map_err(|e| invalid(e.to_string()))?
+        .to_string();
+    Ok(Frame {
+        kind,
+        peer,
+        payload: raw.slice(6 + peer_len..),
+        raw,
+    })
+}
+
+// Writes queued frames, flushing whenever the queue runs empty. Returns once the queue closes.
+async fn write_frames(
+    writer: &mut BufWriter<Writer>,
+    queue: &mut mpsc::Receiver<Bytes>,
+) -> io::Result<()> {
+    while let Some(frame) = queue.recv().await {
+        writer.write_all(&frame).await?;
+        while let Ok(frame) = queue.try_recv() {
+            writer.write_all(&frame).await?;
+        }
+        writer.flush().await?;
+    }
+    Ok(())
+}
+
+// Never waits for room, like the in-process bus: frames that do not fit are spilled in order.
+fn queue(tx: &SpillSender<Bytes>, frame: Bytes) {
+    if !tx.send(frame) && tx.is_closed() {
+        debug!("Dropping frame for a closed broker connection");
+    }
+}
+
+fn peer_event(workspace_id: &str, peer_id: &str, subscribed: bool, time: u64) -> NodeMessage {
+    let (topic, peer_id) = (workspace_id.to_string(), peer_id.to_string());
+    NodeMessage::Event {
+        time,
+        created_by: peer_id.clone(),
+        event: if subscribed {
+            EventType::Subscribe { topic, peer_id }
+        } else {
+            EventType::Unsubscribe { topic, peer_id }
+        },
+    }
+}
+
+fn now() -> u64 {
+    std::time::SystemTime::now()
+        .duration_since(std::time::UNIX_EPOCH)
+        .unwrap()
+        .as_nanos() as u64
+}
+
+/// Unix domain socket of the broker of `workspace_id` on `port`, used by members on its host.
+pub fn socket_path(workspace_id: &str, port: u16) -> PathBuf {
+    let workspace: String = workspace_id
+        .chars()
+        .map(|c| if c.is_ascii_alphanumeric() { c } else { '_' })
+        .collect();
+    std::env::temp_dir().join(format!("ceylon-broker-{}-{}.sock", workspace, port))
+}
+
+/// Connection of a peer to its workspace when the admin is the broker.
+pub enum Broker {
+    /// The admin side, relaying between the connected members.
+    Hub(BrokerHub),
+    /// A member side, queueing frames for the admin.
+    Link(SpillSender<Bytes>),
+}
+
+impl Broker {
+    /// Starts the broker of an admin on `port` of `bind`, and on its Unix domain socket.
+    pub async fn admin(
+        peer_id: &str,
+        workspace_id: &str,
+        bind: IpAddr,
+        port: u16,
+        outside_tx: mpsc::Sender<NodeMessage>,
+        cancellation_token: CancellationToken,
+    ) -> io::Result<Self> {
+        let hub = BrokerHub {
+            peer_id: peer_id.to_string(),
+            workspace_id: workspace_id.to_string(),
+            routes: Arc::new(RwLock::new(HashMap::new())),
+            outside_tx,
+        };
+        let listener = TcpListener::bind(SocketAddr::new(bind, port)).await?;
+        info!("Broker listening on {:?}", listener.local_addr()?);
+        if !bind.is_loopback() {
+            warn!(
+                "Broker of {} accepts unauthenticated plaintext connections on {}",
+                workspace_id, bind
+            );
+        }
+        tokio::spawn(hub.clone().accept_tcp(listener, cancellation_token.clone()));
+        #[cfg(unix)]
+        {
+            let path = socket_path(workspace_id, port);
+            // A socket left by an earlier run would make the bind fail
+            let _ = std::fs::remove_file(&path);
+            match tokio::net::UnixListener::bind(&path) {
+                Ok(listener) => {
+                    tokio::spawn(hub.clone().accept_unix(listener, path, cancellation_token));
+                }
+                Err(e) => debug!("Broker socket {:?} unavailable: {}", path, e),
+            }
+        }
+        Ok(Broker::Hub(hub))
+    }
+
+    /// Connects a member to the broker at `address`, reconnecting whenever the connection drops.
+    pub fn member(
+        peer_id: &str,
+        workspace_id: &str,
+        address: SocketAddr,
+        outside_tx: mpsc::Sender<NodeMessage>,
+        cancellation_token: CancellationToken,
+    ) -> Self {
+        let (tx, rx) = mpsc::channel(QUEUE_SIZE);
+        let tx = SpillSender::new(tx, None);
+        let hello = encode_frame(KIND_HELLO, peer_id, workspace_id.as_bytes());
+        let local = (address.ip().is_loopback() || address.ip().is_unspecified())
+            .then(|| socket_path(workspace_id, address.port()));
+        tokio::spawn(run_member(
+            address,
+            local,
+            hello,
+            rx,
+            outside_tx,
+            cancellation_token,
+        ));
+        Broker::Link(tx)
+    }
+
+    /// Sends an encoded `NodeMessage` to `to_peer`, or to the whole workspace.
+    pub fn send(&self, to_peer: Option<&str>, message: &[u8]) {
+        match (self, to_peer) {
+            (Broker::Hub(hub), Some(to_peer)) => hub.send_direct(to_peer, message),
+            (Broker::Hub(hub), None) => hub.broadcast(message),
+            (Broker::Link(tx), Some(to_peer)) => {
+                queue(tx, encode_frame(KIND_DIRECT, to_peer, message))
+            }
+            (Broker::Link(tx), None) => queue(tx, encode_frame(KIND_BROADCAST, "", message)),
+        }
+    }
+}
+
+#[derive(Clone)]
+pub struct BrokerHub {
+    peer_id: String,
+    workspace_id: String,
+    routes: Routes,
+    outside_tx: mpsc::Sender<NodeMessage>,
+}
+
+impl BrokerHub {
+    async fn accept_tcp(self, listener: TcpListener, cancellation_token: CancellationToken) {
+        loop {
+            tokio::select! {
+                _ = cancellation_token.cancelled() => break,
+                accepted = listener.accept() => match accepted {
+                    Ok((stream, address)) => {
+                        debug!("Broker connection from {}", address);
+                        let _ = stream.set_nodelay(true);
+                        let (reader, writer) = stream.into_split();
+                        tokio::spawn(self.clone().serve(
+                            Box::new(reader),
+                            Box::new(writer),
+                            cancellation_token.clone(),
+                        ));
+                    }
+                    Err(e) => error!("Broker failed to accept a connection: {}", e),
+                },
+            }
+        }
+    }
+
+    #[cfg(unix)]
+    async fn accept_unix(
+        self,
+        listener: tokio::net::UnixListener,
+        path: PathBuf,
+        cancellation_token: CancellationToken,
+    ) {
+        loop {
+            tokio::select! {
+                _ = cancellation_token.cancelled() => break,
+                accepted = listener.accept() => match accepted {
+                    Ok((stream, _)) => {
+                        let (reader, writer) = stream.into_split();
+                        tokio::spawn(self.clone().serve(
+                            Box::new(reader),
+                            Box::new(writer),
+                            cancellation_token.clone(),
+                        ));
+                    }
+                    Err(e) => error!("Broker failed to accept a connection: {}", e),
+                },
+            }
+        }
+        let _ = std::fs::remove_file(path);
+    }
+
+    async fn serve(self, reader: Reader, writer: Writer, cancellation_token: CancellationToken) {
+        let mut reader = BufReader::new(reader);
+        let member = match read_frame(&mut reader).await {
+            Ok(frame)
+                if frame.kind == KIND_HELLO && frame.payload == self.workspace_id.as_bytes() =>
+            {
+                frame.peer
+            }
+            Ok(_) => {
+                error!(
+                    "Broker rejected a connection without a hello for {}",
+                    self.workspace_id
+                );
+                return;
+            }
+            Err(e) => {
+                debug!("Broker connection closed before its hello: {}", e);
+                return;
+            }
+        };
+
+        let (tx, mut rx) = mpsc::channel(QUEUE_SIZE);
+        let tx = SpillSender::new(tx, None);
+        // A reconnecting member replaces its earlier connection
+        self.routes
+            .write()
+            .unwrap()
+            .insert(member.clone(), tx.clone());
+        tokio::spawn(async move {
+            let mut writer = BufWriter::new(writer);
+            if let Err(e) = write_frames(&mut writer, &mut rx).await {
+                debug!("Broker connection write failed: {}", e);
+            }
+        });
+        // Members only see the admin subscribe, like they do over rendezvous
+        let welcome = peer_event(&self.workspace_id, &self.peer_id, true, now());
+        queue(&tx, encode_frame(KIND_BROADCAST, "", &welcome.to_bytes()));
+        self.deliver(peer_event(&self.workspace_id, &member, true, now()))
+            .await;
+        debug!("{} joined the broker of {}", member, self.workspace_id);
+
+        loop {
+            let frame = tokio::select! {
+                _ = cancellation_token.cancelled() => break,
+                frame = read_frame(&mut reader) => match frame {
+                    Ok(frame) => frame,
+                    Err(e) => {
+                        debug!("Broker connection of {} closed: {}", member, e);
+                        break;
+                    }
+                },
+            };
+            self.route(&member, frame).await;
+        }
+
+        {
+            let mut routes = self.routes.write().unwrap();
+            if routes
+                .get(&member)
+                .is_some_and(|route| route.same_channel(&tx))
+            {
+                routes.remove(&member);
+            }
+        }
+        self.deliver(peer_event(&self.workspace_id, &member, false, now()))
+            .await;
+    }
+
+    async fn route(&self, from: &str, frame: Frame) {
+        match frame.kind {
+            KIND_BROADCAST => {
+                let others: Vec<_> = self
+                    .routes
+                    .read()
+                    .unwrap()
+                    .iter()
+                    .filter(|(id, _)| id.as_str() != from)
+                    .map(|(_, tx)| tx.clone())
+                    .collect();
+                for tx in others {
+                    queue(&tx, frame.raw.clone());
+                }
+                self.deliver_frame(frame.payload).await;
+            }
+            KIND_DIRECT if frame.peer == self.peer_id => self.deliver_frame(frame.payload).await,
+            KIND_DIRECT => {
+                let route = self.routes.read().unwrap().get(&frame.peer).cloned();
+                match route {
+                    Some(tx) => queue(&tx, frame.raw),
+                    None => debug!("Dropping direct message to unconnected {}", frame.peer),
+                }
+            }
+            other => error!(
+                "Dropping broker frame of unknown kind {} from {}",
+                other, from
+            ),
+        }
+    }
+
+    async fn deliver_frame(&self, payload: Bytes) {
+        match NodeMessage::try_from_bytes(payload) {
+            Ok(message) => self.deliver(message).await,
+            Err(e) => error!("Dropping undecodable broker message: {}", e),
+        }
+    }
+
+    async fn deliver(&self, message: NodeMessage) {
+        if let Err(e) = self.outside_tx.send(message).await {
+            error!("Failed to forward broker message: {:?}", e);
+        }
+    }
+
+    fn broadcast(&self, message: &[u8]) {
+        let frame = encode_frame(KIND_BROADCAST, "", message);
+        for tx in self.routes.read().unwrap().values() {
+            queue(tx, frame.clone());
+        }
+    }
+
+    fn send_direct(&self, to_peer: &str, message: &[u8]) {
+        match self.routes.read().unwrap().get(to_peer) {
+            Some(tx) => queue(tx, encode_frame(KIND_DIRECT, to_peer, message)),
+            None => error!("Dropping direct message to unconnected {}", to_peer),
+        }
+    }
+}
+
+async fn connect(address: SocketAddr, local: Option<&PathBuf>) -> io::Result<(Reader, Writer)> {
+    #[cfg(unix)]
+    if let Some(path) = local {
+        match tokio::net::UnixStream::connect(path).await {
+            Ok(stream) => {
+                let (reader, writer) = stream.into_split();
+                return Ok((Box::new(reader), Box::new(writer)));
+            }
+            Err(e) => debug!("Broker socket {:?} unavailable, using TCP: {}", path, e),
+        }
+    }
+    #[cfg(not(unix))]
+    let _ = local;
+    let stream = TcpStream::connect(address).await?;
+    stream.set_nodelay(true)?;
+    let (reader, writer) = stream.into_split();
+    Ok((Box::new(reader), Box::new(writer)))
+}
+
+async fn read_member_frames(
+    reader: Reader,
+    outside_tx: mpsc::Sender<NodeMessage>,
+) -> io::Result<()> {
+    let mut reader = BufReader::new(reader);
+    loop {
+        let frame = read_frame(&mut reader).await?;
+        match NodeMessage::try_from_bytes(frame.payload) {
+            Ok(message) => {
+                if outside_tx.send(message).await.is_err() {
+                    return Ok(());
+                }
+            }
+            Err(e) => error!("Dropping undecodable broker message: {}", e),
+        }
+    }
+}
+
+async fn run_member(
+    address: SocketAddr,
+    local: Option<PathBuf>,
+    hello: Bytes,
+    mut outgoing: mpsc::Receiver<Bytes>,
+    outside_tx: mpsc::Sender<NodeMessage>,
+    cancellation_token: CancellationToken,
+) {
+    loop {
+        let connected = tokio::select! {
+            _ = cancellation_token.cancelled() => return,
+            connected = connect(address, local.as_ref()) => connected,
+        };
+        match connected {
+            Ok((reader, writer)) => {
+                debug!("Connected to the broker at {}", address);
+                let mut writer = BufWriter::new(writer);
+                let sent = async {
+                    writer.write_all(&hello).await?;
+                    writer.flush().await
+                };
+                if let Err(e) = sent.await {
+                    debug!("Broker hello failed: {}", e);
+                } else {
+                    tokio::select! {
+                        _ = cancellation_token.cancelled() => return,
+                        read = read_member_frames(reader, outside_tx.clone()) => {
+                            debug!("Lost the broker connection: {:?}", read);
+                        }
+                        written = write_frames(&mut writer, &mut outgoing) => match written {
+                            // The peer stopped
+                            Ok(()) => return,
+                            Err(e) => debug!("Lost the broker connection: {}", e),
+                        },
+                    }
+                }
+            }
+            Err(e) => debug!("Broker at {} unreachable: {}", address, e),
+        }
+        tokio::select! {
+            _ = cancellation_token.cancelled() => return,
+            _ = tokio::time::sleep(RECONNECT_DELAY) => {}
+        }
+    }
+}
@@ -0,0 +1,153 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// In-process bus of the peers running in this process.
+//
+// Peers that use it register the sender of their outside channel per workspace. Messages between
+// members are handed over as `NodeMessage` values, so the payload is shared instead of framed,
+// signed, encrypted and sent through the network stack.
+//
+// Delivery never waits for a slow receiver. Once its channel and spill queue are full, further
+// messages for it are dropped with a warning and counted in `dropped_messages`.
+use std::collections::HashMap;
+use std::sync::{OnceLock, RwLock};
+use tokio::sync::mpsc;
+use tracing::{debug, warn};
+
+use crate::peer::behaviour::peer::PeerMode;
+use crate::peer::message::data::{EventType, NodeMessage};
+use crate::peer::node::spill::SpillSender;
+
+pub use crate::peer::node::spill::dropped_messages;
+
+/// How a peer reaches the other peers of its workspace.
+#[derive(Clone, Copy, Debug, Default, Eq, PartialEq)]
+pub enum TransportMode {
+    /// Only the network, even for peers in the same process.
+    Network,
+    /// Channels for peers in the same process, the network for all others. Messages between
+    /// peers in the process are dropped once a receiver falls too far behind.
+    #[default]
+    Auto,
+    /// Only channels, the workspace has to live entirely in this process. Drops messages for
+    /// receivers that fall too far behind, like `Auto`.
+    InProcess,
+    /// Only the admin, relaying every message over TCP or Unix domain sockets. No gossipsub
+    /// mesh, rendezvous or message signing, meant for small workspaces.
+    Broker,
+}
+
+impl TransportMode {
+    pub fn uses_bus(self) -> bool {
+        matches!(self, TransportMode::Auto | TransportMode::InProcess)
+    }
+
+    pub fn uses_network(self) -> bool {
+        matches!(self, TransportMode::Network | TransportMode::Auto)
+    }
+}
+
+struct LocalPeer {
+    mode: PeerMode,
+    tx: SpillSender<NodeMessage>,
+}
+
+type Workspaces = HashMap<String, HashMap<String, LocalPeer>>;
+
+fn workspaces() -> &'static RwLock<Workspaces> {
+    static WORKSPACES: OnceLock<RwLock<Workspaces>> = OnceLock::new();
+    WORKSPACES.get_or_init(|| RwLock::new(HashMap::new()))
+}
+
+fn subscribe_event(workspace_id: &str, peer_id: &str, time: u64) -> NodeMessage {
+    NodeMessage::Event {
+        time,
+        created_by: peer_id.to_string(),
+        event: EventType::Subscribe {
+            topic: workspace_id.to_string(),
+            peer_id: peer_id.to_string(),
+        },
+    }
+}
+
+/// Adds a peer to the bus. With `announce`, admins and members that are already registered
+/// and the new peer see each other subscribe, as they would over gossipsub.
+pub fn join(
+    workspace_id: &str,
+    peer_id: &str,
+    mode: PeerMode,
+    tx: mpsc::Sender<NodeMessage>,
+    announce: bool,
+    time: u64,
+) {
+    let tx = SpillSender::new(tx, None);
+    let mut workspaces = workspaces().write().unwrap();
+    let peers = workspaces.entry(workspace_id.to_string()).or_default();
+    if announce {
+        // Members only talk to the admin, like they do over rendezvous
+        for (id, peer) in peers.iter().filter(|(_, peer)| peer.mode != mode) {
+            deliver(&peer.tx, subscribe_event(workspace_id, peer_id, time));
+            deliver(&tx, subscribe_event(workspace_id, id, time));
+        }
+    }
+    peers.insert(peer_id.to_string(), LocalPeer { mode, tx });
+    debug!("{} joined the in-process bus of {}", peer_id, workspace_id);
+}
+
+pub fn leave(workspace_id: &str, peer_id: &str) {
+    let mut workspaces = workspaces().write().unwrap();
+    if let Some(peers) = workspaces.get_mut(workspace_id) {
+        peers.remove(peer_id);
+        if peers.is_empty() {
+            workspaces.remove(workspace_id);
+        }
+    }
+}
+
+pub fn is_member(workspace_id: &str, peer_id: &str) -> bool {
+    workspaces()
+        .read()
+        .unwrap()
+        .get(workspace_id)
+        .is_some_and(|peers| peers.contains_key(peer_id))
+}
+
+/// Hands `message` to `to_peer` if it is on the bus, gives it back if it is not.
+pub fn send_direct(
+    workspace_id: &str,
+    to_peer: &str,
+    message: NodeMessage,
+) -> Result<(), NodeMessage> {
+    let workspaces = workspaces().read().unwrap();
+    match workspaces
+        .get(workspace_id)
+        .and_then(|peers| peers.get(to_peer))
+    {
+        Some(peer) => {
+            deliver(&peer.tx, message);
+            Ok(())
+        }
+        None => Err(message),
+    }
+}
+
+/// Hands `message` to every peer on the bus except its sender.
+pub fn broadcast(workspace_id: &str, from_peer: &str, message: &NodeMessage) {
+    let workspaces = workspaces().read().unwrap();
+    if let Some(peers) = workspaces.get(workspace_id) {
+        for (_, peer) in peers.iter().filter(|(id, _)| id.as_str() != from_peer) {
+            deliver(&peer.tx, message.clone());
+        }
+    }
+}
+
+// Never waits for room, the caller is a swarm loop. A full receiver gets its messages in order
+// from a bounded spill queue, see `SpillSender`.
+fn deliver(tx: &SpillSender<NodeMessage>, message: NodeMessage) {
+    if !tx.send(message) && tx.is_closed() {
+        warn!("Dropping in-process message for a stopped peer");
+    }
+}
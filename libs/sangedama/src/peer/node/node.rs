@@ -4,30 +4,49 @@
  *
  */
 
+use bytes::Bytes;
 use futures::StreamExt;
 use libp2p::multiaddr::Protocol;
 use libp2p::swarm::{
     dial_opts::{DialOpts, PeerCondition},
     SwarmEvent,
 };
-use libp2p::{gossipsub, identity, rendezvous, Multiaddr, PeerId, Swarm};
+use libp2p::{gossipsub, identity, rendezvous, request_response, Multiaddr, PeerId, Swarm};
 use std::collections::HashMap;
-use std::net::Ipv4Addr;
+use std::net::{IpAddr, Ipv4Addr, SocketAddr};
 use std::str::FromStr;
-use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
 use std::time::Duration;
 use tokio::select;
+use tokio::time::Instant;
 use tokio_util::sync::CancellationToken;
 use tracing::{debug, error, info};
 
+use crate::peer::behaviour::direct::{DirectEvent, DirectRequest, DirectResponse};
 use crate::peer::behaviour::peer::{
-    PeerMode, RendezvousEvent, UnifiedPeerBehaviour, UnifiedPeerEvent,
+    GossipSettings, PeerMode, RendezvousEvent, UnifiedPeerBehaviour, UnifiedPeerEvent,
 };
 use crate::peer::message::data::{EventType, MessageType, NodeMessage, NodeMessageTransporter};
+use crate::peer::message::wire::WireFormat;
+use crate::peer::node::broker::Broker;
+use crate::peer::node::local::{self, TransportMode};
+use crate::peer::node::shm::{RecentMessages, ShmInbox, ShmOutbox, ShmRegistry, DEFAULT_RING_SIZE};
 use crate::peer::peer_swarm::create_swarm;
 
-static CACHED_TIMESTAMP: AtomicU64 = AtomicU64::new(0);
 const DEFAULT_BUFFER_SIZE: u16 = 100;
+// Broadcasts remembered to drop the second copy when both shared memory and gossipsub carry them
+const RECENT_MESSAGES: usize = 4096;
+// How long a stopping peer keeps polling the swarm so its last coalesced broadcasts go out
+const STOP_FLUSH_GRACE: Duration = Duration::from_millis(200);
+
+/// Window in which broadcasts are packed into one published frame. Whichever limit is reached
+/// first publishes the frame.
+#[derive(Clone, Copy, Debug)]
+pub struct CoalescingSettings {
+    pub max_messages: usize,
+    pub max_bytes: usize,
+    pub max_delay: Duration,
+}
 
 #[derive(Clone)]
 pub struct UnifiedPeerConfig {
@@ -38,6 +57,18 @@ pub struct UnifiedPeerConfig {
     pub buffer_size: Option<u16>,
     pub admin_peer: Option<PeerId>,
     pub rendezvous_point_address: Option<Multiaddr>,
+    /// Encoding of published messages, received messages are decoded in either format.
+    pub wire_format: WireFormat,
+    /// Whether peers in the same process are reached over channels instead of the network.
+    pub transport: TransportMode,
+    /// Whether peers in other processes on the same host are reached over shared memory.
+    pub shared_memory: bool,
+    pub gossip: GossipSettings,
+    /// Packs bursts of broadcasts into batch frames, which peers of earlier versions cannot read.
+    pub coalescing: Option<CoalescingSettings>,
+    /// Address the broker of an admin listens on. Loopback by default, broker connections are
+    /// not encrypted or authenticated.
+    pub broker_bind: IpAddr,
 }
 
 impl UnifiedPeerConfig {
@@ -50,6 +81,12 @@ impl UnifiedPeerConfig {
             buffer_size,
             admin_peer: None,
             rendezvous_point_address: None,
+            wire_format: WireFormat::default(),
+            transport: TransportMode::default(),
+            shared_memory: false,
+            gossip: GossipSettings::default(),
+            coalescing: None,
+            broker_bind: Ipv4Addr::LOCALHOST.into(),
         }
     }
 
@@ -76,9 +113,59 @@ impl UnifiedPeerConfig {
             buffer_size,
             admin_peer: Some(PeerId::from_str(&admin_peer).unwrap()),
             rendezvous_point_address: Some(rendezvous_point_address),
+            wire_format: WireFormat::default(),
+            transport: TransportMode::default(),
+            shared_memory: false,
+            gossip: GossipSettings::default(),
+            coalescing: None,
+            broker_bind: Ipv4Addr::LOCALHOST.into(),
         }
     }
 
+    pub fn with_wire_format(mut self, wire_format: WireFormat) -> Self {
+        self.wire_format = wire_format;
+        self
+    }
+
+    pub fn with_transport(mut self, transport: TransportMode) -> Self {
+        self.transport = transport;
+        self
+    }
+
+    pub fn with_gossip(mut self, gossip: GossipSettings) -> Self {
+        self.gossip = gossip;
+        self
+    }
+
+    pub fn with_coalescing(mut self, coalescing: Option<CoalescingSettings>) -> Self {
+        self.coalescing = coalescing;
+        self
+    }
+
+    pub fn with_shared_memory(mut self, shared_memory: bool) -> Self {
+        self.shared_memory = shared_memory;
+        self
+    }
+
+    pub fn with_broker_bind(mut self, broker_bind: IpAddr) -> Self {
+        self.broker_bind = broker_bind;
+        self
+    }
+
+    /// Address of the admin for members of a broker transport, the rendezvous address over TCP.
+    pub fn get_broker_address(&self) -> Option<SocketAddr> {
+        let address = self.rendezvous_point_address.as_ref()?;
+        let ip = address.iter().find_map(|protocol| match protocol {
+            Protocol::Ip4(ip) => Some(ip),
+            _ => None,
+        })?;
+        let port = address.iter().find_map(|protocol| match protocol {
+            Protocol::Udp(port) | Protocol::Tcp(port) => Some(port),
+            _ => None,
+        })?;
+        Some(SocketAddr::from((ip, port)))
+    }
+
     pub fn get_listen_address(&self) -> Multiaddr {
         Multiaddr::empty()
             .with(Protocol::Ip4(Ipv4Addr::UNSPECIFIED))
@@ -92,6 +179,18 @@ pub struct UnifiedPeerImpl {
     swarm: Swarm<UnifiedPeerBehaviour>,
     pub config: UnifiedPeerConfig,
     connected_peers: HashMap<gossipsub::TopicHash, Vec<PeerId>>,
+    // Frames of direct messages in flight, published to the topic if the direct route fails
+    pending_direct: HashMap<request_response::OutboundRequestId, Bytes>,
+    // Broadcast frames waiting for the coalescing window to close
+    pending_publish: Vec<Bytes>,
+    pending_publish_bytes: usize,
+    publish_deadline: Option<Instant>,
+    shm: Option<ShmOutbox>,
+    broker: Option<Broker>,
+    recent: Option<Arc<Mutex<RecentMessages>>>,
+    // Sequence number of the next message sent, starts at the start time like gossipsub does so
+    // a restarted peer does not repeat the numbers of its previous run
+    next_seq: u64,
     outside_tx: tokio::sync::mpsc::Sender<NodeMessage>,
     inside_rx: tokio::sync::mpsc::Receiver<NodeMessageTransporter>,
     inside_tx: tokio::sync::mpsc::Sender<NodeMessageTransporter>,
@@ -102,7 +201,7 @@ impl UnifiedPeerImpl {
         config: UnifiedPeerConfig,
         key: identity::Keypair,
     ) -> (Self, tokio::sync::mpsc::Receiver<NodeMessage>) {
-        let swarm = create_swarm::<UnifiedPeerBehaviour>(key.clone()).await;
+        let swarm = create_swarm::<UnifiedPeerBehaviour>(key.clone(), &config.gossip).await;
 
         let (outside_tx, outside_rx) = tokio::sync::mpsc::channel::<NodeMessage>(
             config.buffer_size.unwrap_or(DEFAULT_BUFFER_SIZE) as usize,
@@ -118,6 +217,14 @@ impl UnifiedPeerImpl {
                 id: swarm.local_peer_id().to_string(),
                 swarm,
                 connected_peers: HashMap::new(),
+                pending_direct: HashMap::new(),
+                pending_publish: Vec::new(),
+                pending_publish_bytes: 0,
+                publish_deadline: None,
+                shm: None,
+                broker: None,
+                recent: None,
+                next_seq: Self::get_current_timestamp(),
                 outside_tx,
                 inside_rx,
                 inside_tx,
@@ -127,7 +234,10 @@ impl UnifiedPeerImpl {
     }
 
     fn get_current_timestamp() -> u64 {
-        CACHED_TIMESTAMP.load(Ordering::Relaxed)
+        std::time::SystemTime::now()
+            .duration_since(std::time::UNIX_EPOCH)
+            .unwrap()
+            .as_nanos() as u64
     }
 
     pub fn emitter(&self) -> tokio::sync::mpsc::Sender<NodeMessageTransporter> {
@@ -137,39 +247,37 @@ impl UnifiedPeerImpl {
     pub async fn run(&mut self, cancellation_token: CancellationToken) {
         debug!("Peer {:?}: {:?} Starting..", self.config.name, self.id);
 
-        match self.config.mode {
-            PeerMode::Admin => {
-                let listen_addr = self.config.get_listen_address();
-                self.swarm.listen_on(listen_addr.clone()).unwrap();
-                debug!("Admin listening on: {:?}", listen_addr);
-            }
-            PeerMode::Client => {
-                let ext_address = Multiaddr::empty()
-                    .with(Protocol::Ip4(Ipv4Addr::UNSPECIFIED))
-                    .with(Protocol::Udp(0))
-                    .with(Protocol::QuicV1);
-                self.swarm.add_external_address(ext_address.clone());
-
-                if let (Some(admin_peer), Some(rendezvous_address)) = (
-                    self.config.admin_peer,
-                    self.config.rendezvous_point_address.clone(),
-                ) {
-                    let dial_opts = DialOpts::peer_id(admin_peer)
-                        .addresses(vec![rendezvous_address.clone()])
-                        .condition(PeerCondition::Always)
-                        .build();
-                    self.swarm.dial(dial_opts).unwrap();
-                    debug!("Member connecting to admin at: {:?}", rendezvous_address);
-                }
+        if self.config.transport.uses_bus() {
+            local::join(
+                &self.config.workspace_id,
+                &self.id,
+                self.config.mode.clone(),
+                self.outside_tx.clone(),
+                self.config.transport == TransportMode::InProcess,
+                Self::get_current_timestamp(),
+            );
+        }
+        if self.config.transport == TransportMode::Broker {
+            self.start_broker(cancellation_token.clone()).await;
+        }
+        if self.config.transport.uses_network() {
+            if self.config.shared_memory {
+                self.start_shared_memory(cancellation_token.clone());
             }
+            self.start_network();
         }
 
         loop {
+            let publish_deadline = self.publish_deadline;
             select! {
                 _ = cancellation_token.cancelled() => {
                     debug!("Peer Stopping..");
                     break;
                 }
+                _ = tokio::time::sleep_until(publish_deadline.unwrap_or_else(Instant::now)),
+                    if publish_deadline.is_some() => {
+                    self.flush_publish();
+                }
                 event = self.swarm.select_next_some() => {
                     match event {
                         SwarmEvent::ConnectionEstablished { peer_id, .. } => {
@@ -190,8 +298,11 @@ impl UnifiedPeerImpl {
                                 _ => {}
                             }
                         }
-                        SwarmEvent::ConnectionClosed { peer_id, .. } => {
+                        SwarmEvent::ConnectionClosed { peer_id, num_established, .. } => {
                             debug!("Disconnected from {}", peer_id);
+                            if num_established == 0 {
+                                self.emit_unsubscribe(self.config.workspace_id.clone(), peer_id).await;
+                            }
                         }
                         SwarmEvent::Behaviour(event) => {
                             self.process_event(event).await;
@@ -203,42 +314,270 @@ impl UnifiedPeerImpl {
                 }
 
                 message = self.inside_rx.recv() => {
+                    // Never closed while running, the peer holds a sender itself
                     if let Some(node_message_tr) = message {
-                        let topic = gossipsub::IdentTopic::new(self.config.workspace_id.clone());
                         let (_from, message, to) = node_message_tr;
 
+                        self.next_seq += 1;
                         let distributed_message = NodeMessage::Message {
-                            data: message,
-                            time: std::time::SystemTime::now()
-                                .duration_since(std::time::UNIX_EPOCH)
-                                .unwrap()
-                                .as_nanos() as u64,
+                            data: message.into(),
+                            time: Self::get_current_timestamp(),
                             created_by: self.id.clone(),
-                            message_type: if to.is_none() {
-                                MessageType::Broadcast
-                            } else {
-                                MessageType::Direct {
-                                    to_peer: to.unwrap().to_string()
-                                }
+                            seq: self.next_seq,
+                            message_type: match &to {
+                                None => MessageType::Broadcast,
+                                Some(to_peer) => MessageType::Direct {
+                                    to_peer: to_peer.clone()
+                                },
                             },
                         };
+                        self.send_message(distributed_message, to);
+                    }
+                }
+            }
+        }
 
-                        debug!( "Broadcasting message: {:?} to topic: {}", distributed_message, topic.to_string());
+        // Broadcasts still waiting in a coalescing window are published before stopping. They
+        // only leave while the swarm is polled, so it is driven a little longer.
+        if !self.pending_publish.is_empty() {
+            self.flush_publish();
+            let swarm = &mut self.swarm;
+            let _ = tokio::time::timeout(STOP_FLUSH_GRACE, async {
+                loop {
+                    swarm.select_next_some().await;
+                }
+            })
+            .await;
+        }
+    }
 
-                        match self.swarm.behaviour_mut().gossip_sub.publish(topic, distributed_message.to_bytes()) {
-                            Ok(_) => {}
-                            Err(e) => {
-                                error!("Failed to broadcast message: {:?} {:#?}", e, distributed_message);
-                            }
-                        }
-                    }
+    fn start_network(&mut self) {
+        match self.config.mode {
+            PeerMode::Admin => {
+                let listen_addr = self.config.get_listen_address();
+                self.swarm.listen_on(listen_addr.clone()).unwrap();
+                debug!("Admin listening on: {:?}", listen_addr);
+            }
+            PeerMode::Client => {
+                let ext_address = Multiaddr::empty()
+                    .with(Protocol::Ip4(Ipv4Addr::UNSPECIFIED))
+                    .with(Protocol::Udp(0))
+                    .with(Protocol::QuicV1);
+                self.swarm.add_external_address(ext_address.clone());
+
+                if let (Some(admin_peer), Some(rendezvous_address)) = (
+                    self.config.admin_peer,
+                    self.config.rendezvous_point_address.clone(),
+                ) {
+                    let dial_opts = DialOpts::peer_id(admin_peer)
+                        .addresses(vec![rendezvous_address.clone()])
+                        .condition(PeerCondition::Always)
+                        .build();
+                    self.swarm.dial(dial_opts).unwrap();
+                    debug!("Member connecting to admin at: {:?}", rendezvous_address);
+                }
+            }
+        }
+    }
+
+    async fn start_broker(&mut self, cancellation_token: CancellationToken) {
+        let broker = match self.config.mode {
+            PeerMode::Admin => Broker::admin(
+                &self.id,
+                &self.config.workspace_id,
+                self.config.broker_bind,
+                self.config.listen_port.unwrap_or(0),
+                self.outside_tx.clone(),
+                cancellation_token,
+            )
+            .await
+            .map_err(|e| error!("Failed to start the broker: {}", e))
+            .ok(),
+            PeerMode::Client => match self.config.get_broker_address() {
+                Some(address) => Some(Broker::member(
+                    &self.id,
+                    &self.config.workspace_id,
+                    address,
+                    self.outside_tx.clone(),
+                    cancellation_token,
+                )),
+                None => {
+                    error!("Member has no broker address to connect to");
+                    None
+                }
+            },
+        };
+        self.broker = broker;
+    }
+
+    fn start_shared_memory(&mut self, cancellation_token: CancellationToken) {
+        let registry = ShmRegistry::for_workspace(&self.config.workspace_id);
+        let inbox = match ShmInbox::bind(&registry, &self.id) {
+            Ok(inbox) => inbox,
+            Err(e) => {
+                error!("Shared memory transport unavailable: {}", e);
+                return;
+            }
+        };
+        match ShmOutbox::new(registry, &self.id, DEFAULT_RING_SIZE) {
+            Ok(outbox) => {
+                let recent = Arc::new(Mutex::new(RecentMessages::new(RECENT_MESSAGES)));
+                tokio::spawn(inbox.run(
+                    self.outside_tx.clone(),
+                    recent.clone(),
+                    cancellation_token,
+                ));
+                self.shm = Some(outbox);
+                self.recent = Some(recent);
+            }
+            Err(e) => error!("Shared memory transport unavailable: {}", e),
+        }
+    }
+
+    fn send_message(&mut self, message: NodeMessage, to: Option<String>) {
+        let transport = self.config.transport;
+        if transport == TransportMode::Broker {
+            match &self.broker {
+                Some(broker) => {
+                    broker.send(to.as_deref(), &message.encode(self.config.wire_format));
+                }
+                None => error!("Dropping message, the broker is not running"),
+            }
+            return;
+        }
+        let message = match (&to, transport) {
+            (_, TransportMode::Network) => message,
+            (Some(to_peer), _) => {
+                match local::send_direct(&self.config.workspace_id, to_peer, message) {
+                    Ok(()) => return,
+                    Err(message) => message,
                 }
+            }
+            (None, _) => {
+                local::broadcast(&self.config.workspace_id, &self.id, &message);
+                message
+            }
+        };
+        if transport == TransportMode::InProcess {
+            if let Some(to_peer) = to {
+                error!(
+                    "Dropping direct message to {}, which is not in this process",
+                    to_peer
+                );
+            }
+            return;
+        }
 
-                _ = tokio::time::sleep(Duration::from_nanos(1)) => {
-                    CACHED_TIMESTAMP.store(0, Ordering::Relaxed);
+        if let Some(shm) = self.shm.as_mut() {
+            // Rings always carry binary frames, they are never read by a peer of another version
+            let frame = message.encode(WireFormat::Binary);
+            match &to {
+                Some(to_peer) => {
+                    if shm.contains(to_peer) && shm.send(to_peer, &frame) {
+                        return;
+                    }
+                }
+                // Still published below for the peers on other hosts, receivers on this host
+                // drop the copy that arrives second
+                None => {
+                    let peers = shm.peers().to_vec();
+                    for peer in peers.iter().filter(|peer| {
+                        transport == TransportMode::Network
+                            || !local::is_member(&self.config.workspace_id, peer)
+                    }) {
+                        shm.send(peer, &frame);
+                    }
                 }
             }
         }
+
+        let frame: Bytes = message.encode(self.config.wire_format).into();
+        match to {
+            Some(to_peer) => {
+                debug!("Sending direct message: {:?} to {}", message, to_peer);
+                self.send_direct(to_peer, frame);
+            }
+            None => {
+                debug!(
+                    "Broadcasting message: {:?} to topic: {}",
+                    message, self.config.workspace_id
+                );
+                self.publish_coalesced(frame);
+            }
+        }
+    }
+
+    fn publish_coalesced(&mut self, frame: Bytes) {
+        let Some(coalescing) = self.config.coalescing else {
+            return self.publish(frame);
+        };
+        if self.pending_publish_bytes + frame.len() > coalescing.max_bytes {
+            self.flush_publish();
+        }
+        self.pending_publish_bytes += frame.len();
+        self.pending_publish.push(frame);
+        if self.pending_publish.len() >= coalescing.max_messages
+            || self.pending_publish_bytes >= coalescing.max_bytes
+        {
+            self.flush_publish();
+        } else if self.publish_deadline.is_none() {
+            self.publish_deadline = Some(Instant::now() + coalescing.max_delay);
+        }
+    }
+
+    fn flush_publish(&mut self) {
+        self.publish_deadline = None;
+        self.pending_publish_bytes = 0;
+        let frame = match self.pending_publish.len() {
+            0 => return,
+            1 => self.pending_publish.pop().unwrap(),
+            _ => NodeMessage::encode_batch(&self.pending_publish).into(),
+        };
+        self.pending_publish.clear();
+        self.publish(frame);
+    }
+
+    fn publish(&mut self, frame: Bytes) {
+        let topic = gossipsub::IdentTopic::new(self.config.workspace_id.clone());
+        if let Err(e) = self.swarm.behaviour_mut().gossip_sub.publish(topic, frame) {
+            error!("Failed to broadcast message: {:?}", e);
+        }
+    }
+
+    // Direct messages go straight to the target when connected to it, otherwise through the
+    // admin, which every member is connected to. The topic is only used when neither route
+    // exists or the receiving peer does not speak the direct protocol.
+    fn send_direct(&mut self, to_peer: String, frame: Bytes) {
+        let target = match PeerId::from_str(&to_peer) {
+            Ok(target) => target,
+            Err(e) => {
+                error!(
+                    "Dropping direct message to invalid peer id {}: {}",
+                    to_peer, e
+                );
+                return;
+            }
+        };
+        let route = if self.swarm.is_connected(&target) {
+            Some(target)
+        } else {
+            self.config
+                .admin_peer
+                .filter(|admin| self.swarm.is_connected(admin))
+        };
+        match route {
+            Some(peer) => {
+                let request_id = self.swarm.behaviour_mut().direct.send_request(
+                    &peer,
+                    DirectRequest {
+                        to_peer,
+                        frame: frame.clone(),
+                    },
+                );
+                self.pending_direct.insert(request_id, frame);
+            }
+            None => self.publish(frame),
+        }
     }
 
     async fn process_event(&mut self, event: UnifiedPeerEvent) {
@@ -249,6 +588,9 @@ impl UnifiedPeerImpl {
             UnifiedPeerEvent::Rendezvous(event) => {
                 self.handle_rendezvous_event(event).await;
             }
+            UnifiedPeerEvent::Direct(event) => {
+                self.handle_direct_event(event).await;
+            }
             UnifiedPeerEvent::Ping(_) => {}
             UnifiedPeerEvent::Identify(_) => {}
         }
@@ -257,48 +599,22 @@ impl UnifiedPeerImpl {
     async fn handle_gossipsub_event(&mut self, event: gossipsub::Event) {
         match event {
             gossipsub::Event::Message { message, .. } => {
-                if let NodeMessage::Message {
-                    message_type,
+                let gossipsub::Message {
+                    source,
                     data,
-                    created_by,
+                    topic,
                     ..
-                } = NodeMessage::from_bytes(message.data.clone())
-                {
-                    debug!(
-                        "Process Message {:?} from {}: Topic {}",
-                        message_type,
-                        self.config.name,
-                        message.topic.to_string()
-                    );
-
-                    match message_type {
-                        MessageType::Direct { to_peer } => {
-                            if to_peer == self.id {
-                                let current_time = Self::get_current_timestamp();
-                                if let Err(e) = self
-                                    .outside_tx
-                                    .send(NodeMessage::Message {
-                                        time: current_time,
-                                        created_by,
-                                        message_type: MessageType::Direct { to_peer },
-                                        data,
-                                    })
-                                    .await
-                                {
-                                    error!("Failed to forward direct message: {:?}", e);
-                                }
-                            }
-                        }
-                        MessageType::Broadcast => {
-                            if let Err(e) = self
-                                .outside_tx
-                                .send(NodeMessage::from_bytes(message.data))
-                                .await
-                            {
-                                error!("Failed to forward broadcast message: {:?}", e);
-                            }
-                        }
+                } = message;
+                // The frame buffer is moved, not copied, and the payloads are views into it
+                let node_messages = match NodeMessage::decode_frame(data.into()) {
+                    Ok(node_messages) => node_messages,
+                    Err(e) => {
+                        error!("Dropping undecodable message from {:?}: {}", source, e);
+                        return;
                     }
+                };
+                for node_message in node_messages {
+                    self.receive_published(node_message, &topic).await;
                 }
             }
             gossipsub::Event::Subscribed { topic, peer_id } => {
@@ -336,11 +652,214 @@ impl UnifiedPeerImpl {
                         peers.retain(|p| p != &peer_id);
                     }
                 }
+                self.emit_unsubscribe(topic.to_string(), peer_id).await;
             }
             _ => {}
         }
     }
 
+    // Gossipsub does not report peers that went away without unsubscribing, so the last closed
+    // connection to a peer is reported as an unsubscribe as well
+    async fn emit_unsubscribe(&mut self, topic: String, peer_id: PeerId) {
+        let event = NodeMessage::Event {
+            time: Self::get_current_timestamp(),
+            created_by: peer_id.to_string(),
+            event: EventType::Unsubscribe {
+                topic,
+                peer_id: peer_id.to_string(),
+            },
+        };
+        if let Err(e) = self.outside_tx.send(event).await {
+            error!("Failed to send unsubscribe event: {:?}", e);
+        }
+    }
+
+    async fn receive_published(&mut self, node_message: NodeMessage, topic: &gossipsub::TopicHash) {
+        if let NodeMessage::Message {
+            message_type,
+            data,
+            created_by,
+            time,
+            seq,
+        } = node_message
+        {
+            // Peers on the in-process bus already handed this message over
+            if self.config.transport == TransportMode::Auto
+                && local::is_member(&self.config.workspace_id, &created_by)
+            {
+                return;
+            }
+            if let (MessageType::Broadcast, Some(recent)) = (&message_type, &self.recent) {
+                if !recent.lock().unwrap().first_seen(&created_by, seq) {
+                    return;
+                }
+            }
+            debug!(
+                "Process Message {:?} from {}: Topic {}",
+                message_type,
+                self.config.name,
+                topic.to_string()
+            );
+
+            match message_type {
+                MessageType::Direct { to_peer } => {
+                    if to_peer == self.id {
+                        let current_time = Self::get_current_timestamp();
+                        if let Err(e) = self
+                            .outside_tx
+                            .send(NodeMessage::Message {
+                                time: current_time,
+                                created_by,
+                                seq,
+                                message_type: MessageType::Direct { to_peer },
+                                data,
+                            })
+                            .await
+                        {
+                            error!("Failed to forward direct message: {:?}", e);
+                        }
+                    }
+                }
+                MessageType::Broadcast => {
+                    if let Err(e) = self
+                        .outside_tx
+                        .send(NodeMessage::Message {
+                            time,
+                            created_by,
+                            seq,
+                            message_type: MessageType::Broadcast,
+                            data,
+                        })
+                        .await
+                    {
+                        error!("Failed to forward broadcast message: {:?}", e);
+                    }
+                }
+            }
+        }
+    }
+
+    async fn handle_direct_event(&mut self, event: DirectEvent) {
+        match event {
+            request_response::Event::Message { peer, message, .. } => match message {
+                request_response::Message::Request {
+                    request, channel, ..
+                } => {
+                    let status = self.receive_direct(peer, request).await;
+                    if self
+                        .swarm
+                        .behaviour_mut()
+                        .direct
+                        .send_response(channel, status)
+                        .is_err()
+                    {
+                        debug!(
+                            "Direct message sender {} went away before the response",
+                            peer
+                        );
+                    }
+                }
+                request_response::Message::Response {
+                    request_id,
+                    response,
+                } => {
+                    let frame = self.pending_direct.remove(&request_id);
+                    if let (DirectResponse::Unreachable, Some(frame)) = (response, frame) {
+                        debug!(
+                            "{} cannot reach the target of a direct message, publishing it",
+                            peer
+                        );
+                        self.publish(frame);
+                    }
+                }
+            },
+            request_response::Event::OutboundFailure {
+                peer,
+                request_id,
+                error,
+                ..
+            } => {
+                let frame = self.pending_direct.remove(&request_id);
+                match (error, frame) {
+                    // The message never reached the peer, so publishing it cannot duplicate it
+                    (
+                        error @ (request_response::OutboundFailure::UnsupportedProtocols
+                        | request_response::OutboundFailure::DialFailure),
+                        Some(frame),
+                    ) => {
+                        debug!(
+                            "Direct message to {} failed ({}), publishing it",
+                            peer, error
+                        );
+                        self.publish(frame);
+                    }
+                    (error, _) => {
+                        error!("Failed to send direct message to {}: {}", peer, error);
+                    }
+                }
+            }
+            request_response::Event::InboundFailure { peer, error, .. } => {
+                error!("Failed to receive direct message from {}: {}", peer, error);
+            }
+            request_response::Event::ResponseSent { .. } => {}
+        }
+    }
+
+    async fn receive_direct(&mut self, peer: PeerId, request: DirectRequest) -> DirectResponse {
+        if request.to_peer != self.id {
+            // Only the admin relays, members are not expected to know other members
+            return match PeerId::from_str(&request.to_peer) {
+                Ok(target)
+                    if self.config.mode == PeerMode::Admin && self.swarm.is_connected(&target) =>
+                {
+                    let frame = request.frame.clone();
+                    let request_id = self
+                        .swarm
+                        .behaviour_mut()
+                        .direct
+                        .send_request(&target, request);
+                    self.pending_direct.insert(request_id, frame);
+                    DirectResponse::Relayed
+                }
+                _ => DirectResponse::Unreachable,
+            };
+        }
+
+        match NodeMessage::try_from_bytes(request.frame) {
+            Ok(NodeMessage::Message {
+                message_type: message_type @ MessageType::Direct { .. },
+                data,
+                created_by,
+                time,
+                seq,
+            }) => {
+                if let Err(e) = self
+                    .outside_tx
+                    .send(NodeMessage::Message {
+                        time,
+                        created_by,
+                        seq,
+                        message_type,
+                        data,
+                    })
+                    .await
+                {
+                    error!("Failed to forward direct message: {:?}", e);
+                }
+            }
+            Ok(other) => {
+                error!(
+                    "Dropping non direct message sent over the direct protocol by {}: {:?}",
+                    peer, other
+                );
+            }
+            Err(e) => {
+                error!("Dropping undecodable direct message from {}: {}", peer, e);
+            }
+        }
+        DirectResponse::Delivered
+    }
+
     async fn handle_rendezvous_event(&mut self, event: RendezvousEvent) {
         let config = self.config.clone();
         match (config.mode, event) {
@@ -377,3 +896,13 @@ impl UnifiedPeerImpl {
         }
     }
 }
+
+// Also runs when the peer is dropped without `run` finishing, a dead peer left on the bus would
+// be sent every later message of its workspace
+impl Drop for UnifiedPeerImpl {
+    fn drop(&mut self) {
+        if self.config.transport.uses_bus() {
+            local::leave(&self.config.workspace_id, &self.id);
+        }
+    }
+}
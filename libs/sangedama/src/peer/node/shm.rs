@@ -0,0 +1,692 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// Shared memory transport between the peers of a workspace that run on the same host.
+//
+// Every peer using it owns an inbox directory in the host registry,
+// `<registry>/<workspace id>/<peer id>/`, holding a doorbell socket and one ring file per
+// sender. A ring is a single producer, single consumer queue of binary `NodeMessage` frames in
+// a memory mapped file. Frames of at least `BLOB_THRESHOLD` bytes are written to a file of their
+// own instead, which the receiver maps and hands out as the message without copying it.
+//
+// Senders ring the doorbell with their peer id when they write to a ring the receiver had
+// drained; receivers sleep on the doorbell otherwise, so idle peers use no CPU.
+//
+// A receiver that stops removes its inbox. Senders notice that the file of a ring they mapped
+// is gone or was replaced by a restarted receiver, and map the new one.
+use bytes::Bytes;
+use memmap2::{Mmap, MmapMut};
+use std::collections::{HashMap, HashSet, VecDeque};
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, Write};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
+use tokio::sync::mpsc;
+use tokio_util::sync::CancellationToken;
+use tracing::{debug, error};
+
+use crate::peer::message::data::{MessageType, NodeMessage};
+
+/// Ring data size of each sender, receiver pair.
+pub const DEFAULT_RING_SIZE: usize = 1024 * 1024;
+/// Frames of at least this size go through a file of their own.
+pub const BLOB_THRESHOLD: usize = 64 * 1024;
+
+const RING_MAGIC: &[u8; 8] = b"CEYLRNG1";
+// Header: magic and capacity, then the write and read positions on cache lines of their own
+const HEADER_SIZE: usize = 256;
+const WRITE_POS: usize = 64;
+const READ_POS: usize = 128;
+// Record: u32 length, u8 kind, padding, then the body; records start 8 byte aligned
+const RECORD_HEADER: usize = 8;
+const WRAP: u32 = u32::MAX;
+const KIND_FRAME: u8 = 0;
+const KIND_BLOB: u8 = 1;
+
+const DOORBELL: &str = "doorbell";
+const REGISTRY_ENV: &str = "CEYLON_SHM_DIR";
+const PEER_REFRESH: Duration = Duration::from_secs(1);
+
+fn align(len: usize) -> usize {
+    (len + 7) & !7
+}
+
+/// Directory of the peers of one workspace on this host.
+#[derive(Clone, Debug)]
+pub struct ShmRegistry {
+    root: PathBuf,
+}
+
+impl ShmRegistry {
+    /// Registry of `workspace_id` under `$CEYLON_SHM_DIR`, `/dev/shm` when it exists, or the
+    /// temporary directory.
+    pub fn for_workspace(workspace_id: &str) -> Self {
+        let base = match std::env::var_os(REGISTRY_ENV) {
+            Some(dir) => PathBuf::from(dir),
+            None if Path::new("/dev/shm").is_dir() => PathBuf::from("/dev/shm/ceylon"),
+            None => std::env::temp_dir().join("ceylon-shm"),
+        };
+        let workspace: String = workspace_id
+            .chars()
+            .map(|c| {
+                if c.is_ascii_alphanumeric() || c == '-' || c == '.' {
+                    c
+                } else {
+                    '_'
+                }
+            })
+            .collect();
+        Self {
+            root: base.join(workspace),
+        }
+    }
+
+    fn peer_dir(&self, peer_id: &str) -> PathBuf {
+        self.root.join(peer_id)
+    }
+
+    fn ring_path(&self, receiver: &str, sender: &str) -> PathBuf {
+        self.peer_dir(receiver).join(sender).with_extension("ring")
+    }
+
+    fn peers(&self) -> Vec<String> {
+        let Ok(entries) = fs::read_dir(&self.root) else {
+            return Vec::new();
+        };
+        entries
+            .filter_map(|entry| entry.ok())
+            .filter(|entry| entry.path().join(DOORBELL).exists())
+            .filter_map(|entry| entry.file_name().into_string().ok())
+            .collect()
+    }
+}
+
+#[cfg(unix)]
+fn file_id(metadata: &fs::Metadata) -> (u64, u64) {
+    use std::os::unix::fs::MetadataExt;
+    (metadata.dev(), metadata.ino())
+}
+
+#[cfg(not(unix))]
+fn file_id(_: &fs::Metadata) -> (u64, u64) {
+    (0, 0)
+}
+
+struct Ring {
+    map: MmapMut,
+    capacity: u64,
+    // Device and inode of the mapped file
+    file_id: (u64, u64),
+}
+
+impl Ring {
+    fn create(path: &Path, capacity: usize) -> io::Result<Self> {
+        // Written under another name first, so receivers never map a ring without its header
+        let tmp = path.with_extension("tmp");
+        let file = OpenOptions::new()
+            .read(true)
+            .write(true)
+            .create(true)
+            .truncate(true)
+            .open(&tmp)?;
+        file.set_len((HEADER_SIZE + capacity) as u64)?;
+        let mut map = unsafe { MmapMut::map_mut(&file)? };
+        map[..8].copy_from_slice(RING_MAGIC);
+        map[8..16].copy_from_slice(&(capacity as u64).to_le_bytes());
+        fs::rename(&tmp, path)?;
+        Ok(Self {
+            map,
+            capacity: capacity as u64,
+            file_id: file_id(&file.metadata()?),
+        })
+    }
+
+    fn open(path: &Path) -> io::Result<Self> {
+        let file = OpenOptions::new().read(true).write(true).open(path)?;
+        let map = unsafe { MmapMut::map_mut(&file)? };
+        let invalid = || io::Error::new(io::ErrorKind::InvalidData, "not a ring file");
+        if map.len() < HEADER_SIZE || &map[..8] != RING_MAGIC {
+            return Err(invalid());
+        }
+        let capacity = u64::from_le_bytes(map[8..16].try_into().unwrap());
+        if capacity % 8 != 0 || map.len() as u64 != HEADER_SIZE as u64 + capacity {
+            return Err(invalid());
+        }
+        Ok(Self {
+            map,
+            capacity,
+            file_id: file_id(&file.metadata()?),
+        })
+    }
+
+    /// Whether `path` still is the file this ring maps.
+    fn is_current(&self, path: &Path) -> bool {
+        fs::metadata(path).is_ok_and(|metadata| file_id(&metadata) == self.file_id)
+    }
+
+    fn is_drained(&mut self) -> bool {
+        let write = self.position(WRITE_POS).load(Ordering::Relaxed);
+        self.position(READ_POS).load(Ordering::Acquire) == write
+    }
+
+    fn position(&mut self, offset: usize) -> &AtomicU64 {
+        // Both positions are 8 byte aligned within the page aligned mapping
+        unsafe { &*(self.map.as_mut_ptr().add(offset) as *const AtomicU64) }
+    }
+
+    /// Appends a record. Returns `None` when it does not fit, otherwise whether the receiver had
+    /// consumed everything before it and may be waiting for the doorbell.
+    fn push(&mut self, kind: u8, body: &[u8]) -> Option<bool> {
+        let capacity = self.capacity;
+        let write = self.position(WRITE_POS).load(Ordering::Relaxed);
+        let read = self.position(READ_POS).load(Ordering::Acquire);
+        let size = align(RECORD_HEADER + body.len()) as u64;
+        let to_end = capacity - write % capacity;
+        let skip = if size > to_end { to_end } else { 0 };
+        if size + skip > capacity - (write - read) {
+            return None;
+        }
+
+        let data = &mut self.map[HEADER_SIZE..];
+        if skip > 0 {
+            let at = (write % capacity) as usize;
+            data[at..at + 4].copy_from_slice(&WRAP.to_le_bytes());
+        }
+        let start = write + skip;
+        let at = (start % capacity) as usize;
+        data[at..at + 4].copy_from_slice(&(body.len() as u32).to_le_bytes());
+        data[at + 4] = kind;
+        data[at + RECORD_HEADER..at + RECORD_HEADER + body.len()].copy_from_slice(body);
+
+        // Pairs with the reader storing its position before loading this one: either it sees
+        // the new record or this sees that it drained the ring
+        self.position(WRITE_POS)
+            .store(start + size, Ordering::SeqCst);
+        Some(self.position(READ_POS).load(Ordering::SeqCst) == write)
+    }
+
+    fn pop(&mut self) -> Option<(u8, Bytes)> {
+        let capacity = self.capacity;
+        let mut read = self.position(READ_POS).load(Ordering::Relaxed);
+        let write = self.position(WRITE_POS).load(Ordering::SeqCst);
+        loop {
+            if read == write {
+                return None;
+            }
+            let at = (read % capacity) as usize;
+            let data = &self.map[HEADER_SIZE..];
+            let len = u32::from_le_bytes(data[at..at + 4].try_into().unwrap());
+            if len == WRAP {
+                read += capacity - at as u64;
+                continue;
+            }
+            let size = align(RECORD_HEADER + len as usize);
+            if at + size > capacity as usize || read + size as u64 > write {
+                error!("Dropping the rest of a corrupt shared memory ring");
+                self.position(READ_POS).store(write, Ordering::SeqCst);
+                return None;
+            }
+            let kind = data[at + 4];
+            let body = Bytes::copy_from_slice(
+                &data[at + RECORD_HEADER..at + RECORD_HEADER + len as usize],
+            );
+            self.position(READ_POS)
+                .store(read + size as u64, Ordering::SeqCst);
+            return Some((kind, body));
+        }
+    }
+
+    /// Drops everything written so far, for rings left over from a previous run.
+    fn skip_to_end(&mut self) {
+        let write = self.position(WRITE_POS).load(Ordering::SeqCst);
+        self.position(READ_POS).store(write, Ordering::SeqCst);
+    }
+}
+
+/// Broadcasts recently delivered, so the copy arriving over the other transport is dropped.
+pub struct RecentMessages {
+    order: VecDeque<(String, u64)>,
+    seen: HashSet<(String, u64)>,
+    capacity: usize,
+}
+
+impl RecentMessages {
+    pub fn new(capacity: usize) -> Self {
+        Self {
+            order: VecDeque::with_capacity(capacity),
+            seen: HashSet::with_capacity(capacity),
+            capacity,
+        }
+    }
+
+    /// True the first time message `seq` of `created_by` is seen, and always for unnumbered
+    /// messages.
+    pub fn first_seen(&mut self, created_by: &str, seq: u64) -> bool {
+        if seq == 0 {
+            return true;
+        }
+        let key = (created_by.to_string(), seq);
+        if self.seen.contains(&key) {
+            return false;
+        }
+        if self.order.len() == self.capacity {
+            if let Some(oldest) = self.order.pop_front() {
+                self.seen.remove(&oldest);
+            }
+        }
+        self.seen.insert(key.clone());
+        self.order.push_back(key);
+        true
+    }
+}
+
+fn read_blob(dir: &Path, name: &[u8]) -> io::Result<Bytes> {
+    let name =
+        std::str::from_utf8(name).map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+    let path = dir.join(name);
+    let file = File::open(&path)?;
+    let map = unsafe { Mmap::map(&file)? };
+    // The mapping stays valid after the file is gone and is released with the last view of it
+    fs::remove_file(&path)?;
+    Ok(Bytes::from_owner(map))
+}
+
+/// Receiving side: the rings and the doorbell of one peer.
+pub struct ShmInbox {
+    dir: PathBuf,
+    doorbell: doorbell::Receiver,
+    rings: HashMap<String, Ring>,
+}
+
+impl ShmInbox {
+    pub fn bind(registry: &ShmRegistry, peer_id: &str) -> io::Result<Self> {
+        let dir = registry.peer_dir(peer_id);
+        fs::create_dir_all(&dir)?;
+        let mut rings = HashMap::new();
+        for entry in fs::read_dir(&dir)?.filter_map(|entry| entry.ok()) {
+            let path = entry.path();
+            match path.extension().and_then(|ext| ext.to_str()) {
+                // Left over from a previous run of this peer
+                Some("ring") => {
+                    if let (Some(sender), Ok(mut ring)) = (
+                        path.file_stem().and_then(|stem| stem.to_str()),
+                        Ring::open(&path),
+                    ) {
+                        ring.skip_to_end();
+                        rings.insert(sender.to_string(), ring);
+                    }
+                }
+                Some("blob") => {
+                    let _ = fs::remove_file(&path);
+                }
+                _ => {}
+            }
+        }
+        let doorbell = doorbell::Receiver::bind(&dir.join(DOORBELL))?;
+        Ok(Self {
+            dir,
+            doorbell,
+            rings,
+        })
+    }
+
+    fn take_frames(&mut self) -> Vec<Bytes> {
+        let mut frames = Vec::new();
+        for ring in self.rings.values_mut() {
+            while let Some((kind, body)) = ring.pop() {
+                match kind {
+                    KIND_FRAME => frames.push(body),
+                    KIND_BLOB => match read_blob(&self.dir, &body) {
+                        Ok(frame) => frames.push(frame),
+                        Err(e) => error!("Dropping unreadable shared memory blob: {}", e),
+                    },
+                    other => error!("Dropping shared memory record of unknown kind {}", other),
+                }
+            }
+        }
+        frames
+    }
+
+    fn open_ring(&mut self, sender: &str) {
+        if self.rings.contains_key(sender) {
+            return;
+        }
+        match Ring::open(&self.dir.join(sender).with_extension("ring")) {
+            Ok(ring) => {
+                debug!("Shared memory ring from {} opened", sender);
+                self.rings.insert(sender.to_string(), ring);
+            }
+            Err(e) => error!("Failed to open shared memory ring of {}: {}", sender, e),
+        }
+    }
+
+    /// Delivers frames until cancelled. Broadcasts already delivered over the network are
+    /// dropped.
+    pub async fn run(
+        mut self,
+        outside_tx: mpsc::Sender<NodeMessage>,
+        recent: Arc<Mutex<RecentMessages>>,
+        cancellation_token: CancellationToken,
+    ) {
+        loop {
+            for frame in self.take_frames() {
+                let message = match NodeMessage::try_from_bytes(frame) {
+                    Ok(message) => message,
+                    Err(e) => {
+                        error!("Dropping undecodable shared memory message: {}", e);
+                        continue;
+                    }
+                };
+                if let NodeMessage::Message {
+                    message_type: MessageType::Broadcast,
+                    created_by,
+                    seq,
+                    ..
+                } = &message
+                {
+                    if !recent.lock().unwrap().first_seen(created_by, *seq) {
+                        continue;
+                    }
+                }
+                if let Err(e) = outside_tx.send(message).await {
+                    error!("Failed to forward shared memory message: {:?}", e);
+                }
+            }
+            // A doorbell rung while draining is still queued, so nothing written is missed
+            tokio::select! {
+                _ = cancellation_token.cancelled() => break,
+                sender = self.doorbell.recv() => match sender {
+                    Ok(sender) => self.open_ring(&sender),
+                    Err(e) => {
+                        error!("Shared memory doorbell failed: {}", e);
+                        break;
+                    }
+                },
+            }
+        }
+    }
+}
+
+impl Drop for ShmInbox {
+    fn drop(&mut self) {
+        if let Err(e) = fs::remove_dir_all(&self.dir) {
+            debug!("Failed to remove shared memory inbox {:?}: {}", self.dir, e);
+        }
+    }
+}
+
+/// Sending side: rings of this peer in the inboxes of the others.
+pub struct ShmOutbox {
+    registry: ShmRegistry,
+    peer_id: String,
+    ring_size: usize,
+    doorbell: doorbell::Sender,
+    rings: HashMap<String, Ring>,
+    peers: Vec<String>,
+    refreshed: Option<Instant>,
+    next_blob: u64,
+}
+
+impl ShmOutbox {
+    pub fn new(registry: ShmRegistry, peer_id: &str, ring_size: usize) -> io::Result<Self> {
+        Ok(Self {
+            registry,
+            peer_id: peer_id.to_string(),
+            ring_size: align(ring_size.max(BLOB_THRESHOLD)),
+            doorbell: doorbell::Sender::new()?,
+            rings: HashMap::new(),
+            peers: Vec::new(),
+            refreshed: None,
+            next_blob: 0,
+        })
+    }
+
+    /// Other peers of the workspace on this host, re-read from the registry at most once a
+    /// second.
+    pub fn peers(&mut self) -> &[String] {
+        if self
+            .refreshed
+            .map_or(true, |at| at.elapsed() >= PEER_REFRESH)
+        {
+            let peer_id = &self.peer_id;
+            self.peers = self
+                .registry
+                .peers()
+                .into_iter()
+                .filter(|peer| peer != peer_id)
+                .collect();
+            // Rings of peers that left, or that restarted and replaced their inbox
+            let (registry, peers) = (&self.registry, &self.peers);
+            self.rings.retain(|peer, ring| {
+                peers.contains(peer) && ring.is_current(&registry.ring_path(peer, peer_id))
+            });
+            self.refreshed = Some(Instant::now());
+        }
+        &self.peers
+    }
+
+    pub fn contains(&mut self, peer_id: &str) -> bool {
+        self.peers().iter().any(|peer| peer == peer_id)
+    }
+
+    fn ring(&mut self, to_peer: &str) -> io::Result<&mut Ring> {
+        let path = self.registry.ring_path(to_peer, &self.peer_id);
+        let open = match self.rings.get_mut(to_peer) {
+            // A receiver that restarted since the last refresh of the peers left this ring
+            // unlinked. Such a ring is drained unless it stopped in the middle of reading, and
+            // the refresh catches that case. Writing to a drained ring rings the doorbell, so
+            // the check adds a syscall only where there is one already.
+            Some(ring) => ring.is_drained() && !ring.is_current(&path),
+            None => true,
+        };
+        if open {
+            // This peer is the only writer, a ring of an earlier run is continued
+            let ring = match Ring::open(&path) {
+                Ok(ring) => ring,
+                Err(_) => Ring::create(&path, self.ring_size)?,
+            };
+            self.rings.insert(to_peer.to_string(), ring);
+        }
+        Ok(self.rings.get_mut(to_peer).unwrap())
+    }
+
+    fn write_blob(&mut self, to_peer: &str, frame: &[u8]) -> io::Result<String> {
+        let name = format!("{}-{}.blob", self.peer_id, self.next_blob);
+        self.next_blob += 1;
+        let mut file = File::create(self.registry.peer_dir(to_peer).join(&name))?;
+        file.write_all(frame)?;
+        Ok(name)
+    }
+
+    /// Writes a binary `NodeMessage` frame to the inbox of `to_peer`. False if it has to go
+    /// over the network instead: the peer is gone or its ring is full.
+    pub fn send(&mut self, to_peer: &str, frame: &[u8]) -> bool {
+        let pushed = if frame.len() >= BLOB_THRESHOLD {
+            let name = match self.write_blob(to_peer, frame) {
+                Ok(name) => name,
+                Err(e) => {
+                    debug!("Shared memory blob for {} failed: {}", to_peer, e);
+                    return false;
+                }
+            };
+            let pushed = self
+                .ring(to_peer)
+                .map(|ring| ring.push(KIND_BLOB, name.as_bytes()));
+            if !matches!(pushed, Ok(Some(_))) {
+                let _ = fs::remove_file(self.registry.peer_dir(to_peer).join(&name));
+            }
+            pushed
+        } else {
+            self.ring(to_peer).map(|ring| ring.push(KIND_FRAME, frame))
+        };
+
+        match pushed {
+            Ok(Some(true)) => {
+                let path = self.registry.peer_dir(to_peer).join(DOORBELL);
+                if let Err(e) = self.doorbell.ring(&path, self.peer_id.as_bytes()) {
+                    debug!("Shared memory peer {} is gone: {}", to_peer, e);
+                    self.rings.remove(to_peer);
+                    self.peers.retain(|peer| peer != to_peer);
+                    return false;
+                }
+                true
+            }
+            Ok(Some(false)) => true,
+            Ok(None) => {
+                debug!("Shared memory ring to {} is full", to_peer);
+                false
+            }
+            Err(e) => {
+                debug!("Shared memory ring to {} unavailable: {}", to_peer, e);
+                false
+            }
+        }
+    }
+}
+
+#[cfg(unix)]
+mod doorbell {
+    use std::io;
+    use std::os::unix::net::UnixDatagram as StdUnixDatagram;
+    use std::path::{Path, PathBuf};
+    use tokio::net::UnixDatagram;
+
+    pub struct Receiver {
+        socket: UnixDatagram,
+        path: PathBuf,
+    }
+
+    impl Receiver {
+        pub fn bind(path: &Path) -> io::Result<Self> {
+            let _ = std::fs::remove_file(path);
+            Ok(Self {
+                socket: UnixDatagram::bind(path)?,
+                path: path.to_path_buf(),
+            })
+        }
+
+        /// Waits for a ring and returns the peer id of the sender.
+        pub async fn recv(&self) -> io::Result<String> {
+            let mut buf = [0u8; 256];
+            let len = self.socket.recv(&mut buf).await?;
+            Ok(String::from_utf8_lossy(&buf[..len]).into_owned())
+        }
+    }
+
+    impl Drop for Receiver {
+        fn drop(&mut self) {
+            let _ = std::fs::remove_file(&self.path);
+        }
+    }
+
+    pub struct Sender {
+        socket: StdUnixDatagram,
+    }
+
+    impl Sender {
+        pub fn new() -> io::Result<Self> {
+            let socket = StdUnixDatagram::unbound()?;
+            socket.set_nonblocking(true)?;
+            Ok(Self { socket })
+        }
+
+        pub fn ring(&self, path: &Path, sender: &[u8]) -> io::Result<()> {
+            match self.socket.send_to(sender, path) {
+                // The receiver has rings queued already and will drain this one with them
+                Err(e) if e.kind() == io::ErrorKind::WouldBlock => Ok(()),
+                other => other.map(|_| ()),
+            }
+        }
+    }
+}
+
+#[cfg(not(unix))]
+mod doorbell {
+    use std::io;
+    use std::path::Path;
+
+    fn unsupported() -> io::Error {
+        io::Error::new(
+            io::ErrorKind::Unsupported,
+            "the shared memory transport needs unix sockets",
+        )
+    }
+
+    pub struct Receiver;
+
+    impl Receiver {
+        pub fn bind(_: &Path) -> io::Result<Self> {
+            Err(unsupported())
+        }
+
+        pub async fn recv(&self) -> io::Result<String> {
+            Err(unsupported())
+        }
+    }
+
+    pub struct Sender;
+
+    impl Sender {
+        pub fn new() -> io::Result<Self> {
+            Err(unsupported())
+        }
+
+        pub fn ring(&self, _: &Path, _: &[u8]) -> io::Result<()> {
+            Err(unsupported())
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn recent_messages_are_keyed_on_sender_and_seq() {
+        let mut recent = RecentMessages::new(2);
+        assert!(recent.first_seen("peer-a", 1));
+        assert!(!recent.first_seen("peer-a", 1));
+        // Same number from another sender, next number from the same sender
+        assert!(recent.first_seen("peer-b", 1));
+        assert!(recent.first_seen("peer-a", 2));
+        // Only the last two are remembered
+        assert!(recent.first_seen("peer-a", 1));
+    }
+
+    #[test]
+    fn unnumbered_messages_are_never_dropped() {
+        let mut recent = RecentMessages::new(2);
+        assert!(recent.first_seen("peer-a", 0));
+        assert!(recent.first_seen("peer-a", 0));
+    }
+
+    #[cfg(unix)]
+    #[tokio::test]
+    async fn sender_follows_a_restarted_receiver() {
+        let root = std::env::temp_dir().join(format!("ceylon-shm-test-{}", std::process::id()));
+        let registry = ShmRegistry {
+            root: root.join("restart"),
+        };
+        let mut outbox = ShmOutbox::new(registry.clone(), "sender", DEFAULT_RING_SIZE).unwrap();
+
+        let mut inbox = ShmInbox::bind(&registry, "receiver").unwrap();
+        assert!(outbox.send("receiver", b"first"));
+        inbox.open_ring("sender");
+        assert_eq!(inbox.take_frames(), vec![Bytes::from_static(b"first")]);
+
+        // Stopping removes the inbox with the ring the sender still has mapped
+        drop(inbox);
+        let mut inbox = ShmInbox::bind(&registry, "receiver").unwrap();
+        assert!(outbox.send("receiver", b"second"));
+        inbox.open_ring("sender");
+        assert_eq!(inbox.take_frames(), vec![Bytes::from_static(b"second")]);
+
+        drop(inbox);
+        let _ = fs::remove_dir_all(&root);
+    }
+}
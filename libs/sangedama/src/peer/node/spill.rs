@@ -0,0 +1,191 @@
+/*
+ * Copyright 2024-Present, Syigen Ltd. and Syigen Private Limited. All rights reserved.
+ * Licensed under the Apache License, Version 2.0 (See LICENSE or http://www.apache.org/licenses/LICENSE-2.0).
+ *
+ */
+
+// Channel sender for callers that must never wait, like a swarm loop: a loop blocked on a peer
+// that is itself blocked on it would never recover.
+//
+// Messages that do not fit into the channel are spilled into a bounded queue, which a single task
+// drains into the channel in order. Everything sent while the spill queue is not empty goes behind
+// it, so messages keep their order. Once the spill queue is full too, new messages are dropped:
+// unlike the network path there is no backpressure towards the sender. Drops are logged as
+// warnings and counted, see `dropped_messages`.
+use std::collections::VecDeque;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex};
+use tokio::sync::mpsc;
+use tokio::sync::mpsc::error::TrySendError;
+use tracing::warn;
+
+static DROPPED_MESSAGES: AtomicU64 = AtomicU64::new(0);
+
+/// Messages dropped by every `SpillSender` of this process, for a full spill queue or a
+/// receiver that went away.
+pub fn dropped_messages() -> u64 {
+    DROPPED_MESSAGES.load(Ordering::Relaxed)
+}
+
+// Under sustained overload every message is dropped, so only some drops are logged
+fn should_log_drop(dropped: u64) -> bool {
+    dropped == 1 || dropped % 1000 == 0
+}
+
+struct Spill<T> {
+    items: VecDeque<T>,
+    draining: bool,
+    dropped: u64,
+}
+
+pub struct SpillSender<T> {
+    tx: mpsc::Sender<T>,
+    spill: Arc<Mutex<Spill<T>>>,
+    limit: usize,
+}
+
+impl<T> Clone for SpillSender<T> {
+    fn clone(&self) -> Self {
+        Self {
+            tx: self.tx.clone(),
+            spill: self.spill.clone(),
+            limit: self.limit,
+        }
+    }
+}
+
+impl<T: Send + 'static> SpillSender<T> {
+    /// Spills at most `limit` messages, the channel's own capacity when `None`.
+    pub fn new(tx: mpsc::Sender<T>, limit: Option<usize>) -> Self {
+        let limit = limit.unwrap_or_else(|| tx.max_capacity());
+        Self {
+            tx,
+            spill: Arc::new(Mutex::new(Spill {
+                items: VecDeque::new(),
+                draining: false,
+                dropped: 0,
+            })),
+            limit,
+        }
+    }
+
+    /// Hands `item` to the channel or the spill queue. `false` when it was dropped because both
+    /// are full or the receiver went away.
+    pub fn send(&self, item: T) -> bool {
+        let mut spill = self.spill.lock().unwrap();
+        let item = if spill.draining {
+            item
+        } else {
+            match self.tx.try_send(item) {
+                Ok(()) => return true,
+                Err(TrySendError::Closed(_)) => {
+                    DROPPED_MESSAGES.fetch_add(1, Ordering::Relaxed);
+                    return false;
+                }
+                Err(TrySendError::Full(item)) => item,
+            }
+        };
+        if spill.items.len() >= self.limit {
+            spill.dropped += 1;
+            DROPPED_MESSAGES.fetch_add(1, Ordering::Relaxed);
+            if should_log_drop(spill.dropped) {
+                warn!(
+                    "Dropping a message for an overloaded receiver, {} dropped for it so far",
+                    spill.dropped
+                );
+            }
+            return false;
+        }
+        spill.items.push_back(item);
+        if !spill.draining {
+            spill.draining = true;
+            tokio::spawn(drain(self.tx.clone(), self.spill.clone()));
+        }
+        true
+    }
+
+    /// Messages this receiver lost because its spill queue was full too.
+    pub fn dropped(&self) -> u64 {
+        self.spill.lock().unwrap().dropped
+    }
+
+    pub fn is_closed(&self) -> bool {
+        self.tx.is_closed()
+    }
+
+    pub fn same_channel(&self, other: &SpillSender<T>) -> bool {
+        self.tx.same_channel(&other.tx)
+    }
+}
+
+async fn drain<T>(tx: mpsc::Sender<T>, spill: Arc<Mutex<Spill<T>>>) {
+    loop {
+        let item = {
+            let mut spill = spill.lock().unwrap();
+            match spill.items.pop_front() {
+                Some(item) => item,
+                None => {
+                    spill.draining = false;
+                    return;
+                }
+            }
+        };
+        if tx.send(item).await.is_err() {
+            let mut spill = spill.lock().unwrap();
+            let lost = spill.items.len() as u64 + 1;
+            DROPPED_MESSAGES.fetch_add(lost, Ordering::Relaxed);
+            warn!("Receiver went away, dropping {} spilled messages", lost);
+            spill.items.clear();
+            spill.draining = false;
+            return;
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::time::Duration;
+
+    #[tokio::test]
+    async fn keeps_order_through_the_spill_queue() {
+        let (tx, mut rx) = mpsc::channel(1);
+        let sender = SpillSender::new(tx, Some(4));
+        for item in 0..5 {
+            assert!(sender.send(item));
+        }
+        for item in 0..5 {
+            assert_eq!(rx.recv().await, Some(item));
+        }
+        assert_eq!(sender.dropped(), 0);
+    }
+
+    #[tokio::test]
+    async fn counts_messages_dropped_when_full() {
+        let (tx, mut rx) = mpsc::channel(1);
+        let sender = SpillSender::new(tx, Some(2));
+        let before = dropped_messages();
+        for item in 0..3 {
+            assert!(sender.send(item));
+        }
+        assert!(!sender.send(3));
+        assert_eq!(sender.dropped(), 1);
+        assert!(dropped_messages() > before);
+        assert_eq!(rx.recv().await, Some(0));
+    }
+
+    #[tokio::test]
+    async fn counts_spilled_messages_of_a_closed_receiver() {
+        let (tx, rx) = mpsc::channel(1);
+        let sender = SpillSender::new(tx, Some(4));
+        for item in 0..3 {
+            assert!(sender.send(item));
+        }
+        let before = dropped_messages();
+        drop(rx);
+        tokio::time::sleep(Duration::from_millis(20)).await;
+        assert!(!sender.send(3));
+        // Two spilled messages and the last one
+        assert!(dropped_messages() >= before + 3);
+    }
+}
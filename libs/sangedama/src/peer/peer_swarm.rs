@@ -6,10 +6,10 @@
 use std::num::NonZeroUsize;
 use std::time::Duration;
 
-use crate::peer::behaviour::peer::PeerBehaviour;
+use crate::peer::behaviour::peer::{GossipSettings, PeerBehaviour};
 use libp2p::{identity, noise, tls, yamux, Swarm, SwarmBuilder};
 
-pub async fn create_swarm<B>(key: identity::Keypair) -> Swarm<B>
+pub async fn create_swarm<B>(key: identity::Keypair, gossip: &GossipSettings) -> Swarm<B>
 where
     B: PeerBehaviour + Send + 'static, // Added Send trait
 {
@@ -30,7 +30,7 @@ where
         )
         .await
         .unwrap()
-        .with_behaviour(|key| Ok(B::new(key.clone())))
+        .with_behaviour(|key| Ok(B::new(key.clone(), gossip)))
         .unwrap()
         .with_swarm_config(|cfg| {
             cfg.with_idle_connection_timeout(Duration::from_secs(60)) // Reduced timeout